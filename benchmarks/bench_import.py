@@ -0,0 +1,59 @@
+"""Throughput of ImportServices on a generated CSV file, inserted into in-memory SQLite
+
+Usage:
+    python -m benchmarks.bench_import [rows] [chunk_size]
+"""
+from typing import Optional
+from pydantic import BaseModel as PydanticModel
+from ez_rest.modules.crud.models import BaseModel
+from ez_rest.modules.crud.repository import BaseRepository
+from ez_rest.modules.importer.services import ImportServices
+from ez_rest.modules.mapper.services import mapper_services
+from benchmarks.bench_read_rows import BenchDbServices, BenchItem
+import csv
+import os
+import resource
+import sys
+import tempfile
+import time
+
+class BenchItemImportDTO(PydanticModel):
+    id:int
+    name:str
+    category:str
+    description:Optional[str]
+
+mapper_services.register(
+    BenchItemImportDTO,
+    BenchItem,
+    lambda src : {
+        "id":src.id,
+        "name":src.name,
+        "category":src.category,
+        "description":src.description
+    }
+)
+
+def main(rows:int = 1_000_000, chunk_size:int = 5000):
+    db_services = BenchDbServices()
+    BaseModel.metadata.create_all(db_services.get_engine(), tables=[BenchItem.__table__])
+    repository = BaseRepository(BenchItem, db_services)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "items.csv")
+        with open(path, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(["id", "name", "category", "description"])
+            writer.writerows((i + 1, f"Item {i}", "Bench", "x" * 50) for i in range(rows))
+
+        started_at = time.perf_counter()
+        result = ImportServices().import_file(path, repository, BenchItemImportDTO, chunk_size=chunk_size)
+        elapsed = time.perf_counter() - started_at
+
+    assert result.inserted == rows and repository.count() == rows
+    # ru_maxrss is in KB on Linux
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{rows} rows in {elapsed:.1f} s, {rows / elapsed:,.0f} rows/s, peak RSS {peak_memory:.0f} MB")
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,44 @@
+"""Per-call overhead of readById when the statement is rebuilt on every call
+versus reused from the repository statement cache
+
+Usage:
+    python -m benchmarks.bench_read_by_id [calls] [repeat]
+"""
+from typing import Callable, Hashable
+from sqlalchemy import Executable
+from ez_rest.modules.crud.models import BaseModel
+from ez_rest.modules.crud.repository import BaseRepository
+from benchmarks.bench_read_rows import BenchDbServices, BenchItem
+import sys
+import timeit
+
+class UncachedRepository(BaseRepository):
+    """Builds every statement again, like readById did before the statement cache"""
+    def _get_statement(self, 
+                       key:Hashable, 
+                       build:Callable[[], Executable]) -> Executable:
+        return build()
+
+def main(calls:int = 10_000, repeat:int = 5):
+    db_services = BenchDbServices()
+    BaseModel.metadata.create_all(db_services.get_engine(), tables=[BenchItem.__table__])
+    BaseRepository(BenchItem, db_services).create_many(
+        [BenchItem(id=i + 1, name=f"Item {i}", category="Bench", description="x" * 200) for i in range(100)],
+        returning=False)
+
+    results = {}
+    for name, repository in (("rebuilt statement", UncachedRepository(BenchItem, db_services)), 
+                             ("cached statement", BaseRepository(BenchItem, db_services))):
+        def read_by_id():
+            for i in range(calls):
+                repository.readById(i % 100 + 1)
+
+        best = min(timeit.repeat(read_by_id, number=1, repeat=repeat))
+        results[name] = best
+        print(f"{name:<18} {best / calls * 1_000_000:6.2f} us/call")
+
+    baseline, fast = results.values()
+    print(f"speedup: {baseline / fast:.2f}x over {calls} calls")
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,89 @@
+"""Per-row cost of listing a page through ORM hydration + validated DTOs
+versus Core rows + DTOs built with construct()
+
+Usage:
+    python -m benchmarks.bench_read_rows [rows] [repeat]
+"""
+from typing import Optional
+from sqlalchemy import String, create_engine
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy.pool import StaticPool
+from ez_rest.modules.crud.models import BaseModel, BaseDTO
+from ez_rest.modules.crud.repository import BaseRepository
+from ez_rest.modules.mapper.services import mapper_services
+import sys
+import timeit
+
+class BenchDbServices():
+    _engine:Engine = None
+
+    def get_engine(self) -> Engine:
+        if self._engine == None:
+            self._engine = create_engine(
+                "sqlite://",
+                connect_args={"check_same_thread": False},
+                poolclass=StaticPool
+            )
+        return self._engine
+
+    def get_read_engine(self) -> Engine:
+        return self.get_engine()
+
+    def eject_replica(self, engine:Engine) -> bool:
+        return False
+
+class BenchItem(BaseModel):
+    __tablename__ = "bench_items"
+    name:Mapped[str] = mapped_column(String(100))
+    category:Mapped[str] = mapped_column(String(100))
+    description:Mapped[Optional[str]] = mapped_column(String(1000))
+
+class BenchItemDTO(BaseDTO):
+    name:str
+    category:str
+    description:Optional[str]
+
+mapper_services.register(
+    BenchItem,
+    BenchItemDTO,
+    lambda src : {
+        "id":src.id,
+        "created_at":src.created_at,
+        "deleted_at":src.deleted_at,
+        "updated_at":src.updated_at,
+        "name":src.name,
+        "category":src.category,
+        "description":src.description
+    }
+)
+
+def main(rows:int = 10_000, repeat:int = 5):
+    db_services = BenchDbServices()
+    BaseModel.metadata.create_all(db_services.get_engine(), tables=[BenchItem.__table__])
+    repository = BaseRepository(BenchItem, db_services)
+    repository.create_many(
+        [BenchItem(id=i + 1, name=f"Item {i}", category="Bench", description="x" * 200) for i in range(rows)],
+        returning=False)
+
+    def orm_path():
+        items = repository.read(limit=rows)
+        return [mapper_services.map(item, BenchItemDTO) for item in items]
+
+    def rows_path():
+        items = repository.read(limit=rows, hydrate=False)
+        return mapper_services.map_many(items, BenchItem, BenchItemDTO, validate=False)
+
+    assert [item.dict() for item in orm_path()] == [item.dict() for item in rows_path()]
+
+    results = {}
+    for name, fn in (("orm + validated DTOs", orm_path), ("rows + construct()", rows_path)):
+        best = min(timeit.repeat(fn, number=1, repeat=repeat))
+        results[name] = best
+        print(f"{name:<22} {best * 1000:8.1f} ms/page  {best / rows * 1_000_000:6.2f} us/row")
+
+    baseline, fast = results.values()
+    print(f"speedup: {baseline / fast:.1f}x for {rows} rows")
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -1,7 +1,7 @@
 from ..crud.models import BaseModel, BaseDTO
 from ..role.models import RoleModel, RoleDTO
 from pydantic import BaseModel as PydanticModel
-from sqlalchemy import BigInteger,ForeignKey,String
+from sqlalchemy import BigInteger,ForeignKey,Index,String,func,text
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 class BaseUserModel(BaseModel):
@@ -10,6 +10,25 @@ class BaseUserModel(BaseModel):
     role:Mapped[RoleModel] = relationship(lazy="joined")
     password:Mapped[str] = mapped_column(String(200))
 
+    @classmethod
+    def add_identity_indexes(cls, *fields:str) -> tuple:
+        """Adds partial functional indexes on lower(field) over live users to the table, 
+        for identity fields the repository compares case insensitively. Call it once 
+        after the model is defined:
+
+        class UserModel(BaseUserModel): ...
+        UserModel.add_identity_indexes("email")
+
+        Returns:
+            tuple: Created indexes
+        """
+        live_rows = text("deleted_at IS NULL")
+        return tuple(Index(f'ix_{cls.__tablename__}_{field}_lower', 
+                           func.lower(cls.__table__.c[field]),
+                           postgresql_where=live_rows,
+                           sqlite_where=live_rows)
+                     for field in fields)
+
 class BaseUserDTO(BaseDTO):
     role_id:int
     role:RoleDTO
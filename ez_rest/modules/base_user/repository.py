@@ -1,15 +1,20 @@
-from typing import Generic, TypeVar, Type, List
+from typing import Callable, Dict, Generic, TypeVar, Type, List
 from .models import BaseUserModel
 from ..crud.repository import BaseRepository
 from ..password.services import PaswordServices
 from ..db.services import DbServices
-from sqlalchemy import or_
+from sqlalchemy import bindparam, func, select, union_all
 
 T = TypeVar("T", bound=BaseUserModel)
 
+# Write listeners by table name, shared by every repository of the same users table
+_write_listeners:Dict[str, List[Callable[[List[int] | None], None]]] = {}
+
 class BaseUserRepository(Generic[T], BaseRepository[T]):
     _password_services:PaswordServices
     _identity_fields:List[str]
+    # Identity fields compared lowercased, e.g. emails
+    _case_insensitive_identity_fields:List[str] = []
 
     def __init__(self,
                  model:Type[T],
@@ -19,18 +24,59 @@ class BaseUserRepository(Generic[T], BaseRepository[T]):
         self._password_services = password_services if password_services != None else PaswordServices()
         super().__init__(model, db_services)
 
-    def create(self, item: T) -> T:
-        item.password = self._password_services.hash_password(item.password)
-        return super().create(item)
+    def add_write_listener(self, listener:Callable[[List[int] | None], None]):
+        """Registers a function called with the ids of the users written through any 
+        repository of this model's table, or None when any of them may have changed. Like 
+        the caches, it's called after each write and again after the commit of the active 
+        UnitOfWork
+
+        Args:
+            listener (Callable[[List[int] | None], None]): Function receiving the ids
+        """
+        _write_listeners.setdefault(self._model.__tablename__, []).append(listener)
 
     def read_by_identity_field(self, identity_field_value:str):
+        """Reads the live user with that value in any identity field. Each field is probed 
+        by its own equality condition, combined with UNION ALL instead of OR, so every probe 
+        can use the index of its column. Fields in _case_insensitive_identity_fields are 
+        compared lowercased, see BaseUserModel.add_identity_indexes
+
+        Args:
+            identity_field_value (str): Value of a login field (username, email, etc)
 
-        filters = \
-            [or_(
-                *[getattr(self._model,field) == identity_field_value 
-                  for field in self._identity_fields]
-            )]
+        Returns:
+            T | None: First user found, by id
+        """
+        def build_statement():
+            probes = union_all(*[
+                select(self._model.id) \
+                    .where(self._get_identity_condition(field),
+                           self._model.get_not_deleted_filter())
+                for field in self._identity_fields]).subquery()
+            return self._select() \
+                .where(self._model.id.in_(select(probes.c.id))) \
+                .order_by(self._model.id) \
+                .limit(1)
         
-        results = self.read(filters)
-        if len(results) == 0: return None
-        return results[0]
\ No newline at end of file
+        statement = self._get_statement(("read_by_identity_field",), build_statement)
+        return self._read(
+            lambda session: session.execute(
+                statement, 
+                {"identity_field_value":identity_field_value,
+                 "lowercase_identity_field_value":identity_field_value.lower()}
+                ).unique().scalars().first())
+
+    def _prepare_insert(self, item:T) -> T:
+        item.password = self._password_services.hash_password(item.password)
+        return item
+
+    def _get_identity_condition(self, field:str):
+        column = getattr(self._model, field)
+        if field in self._case_insensitive_identity_fields:
+            return func.lower(column) == bindparam("lowercase_identity_field_value", type_=column.type)
+        return column == bindparam("identity_field_value")
+
+    def _invalidate(self, ids:List[int] = None):
+        super()._invalidate(ids)
+        for listener in _write_listeners.get(self._model.__tablename__, []):
+            listener(ids)
@@ -8,8 +8,15 @@ from typing import List
 from jose import JWTError
 import datetime
 import os
-from typing import Generic, TypeVar, Type, List
+from typing import Generic, Tuple, TypeVar, Type, List
 from ..singleton.models import SingletonMeta
+from ..cache.models import CacheBackend
+from ..cache.services import InMemoryCacheBackend
+from ..db.services import get_current_session, without_unit_of_work
+from collections import OrderedDict
+from threading import Lock
+import hashlib
+import time
 
 TModel = TypeVar("TModel", bound=BaseUserModel)
 TRepository = TypeVar("TRepository", bound=BaseUserRepository)
@@ -20,18 +27,57 @@ class BaseUserServices(Generic[TModel], metaclass=SingletonMeta):
     _user_type:Type[TModel]
     _password_services:PaswordServices
     _jwt_services:JWTServices
+    _token_cache:CacheBackend | None
+    _token_cache_ttl:float
+    # Sequence number of the last write of each recently written user, in write order
+    _user_writes:OrderedDict
+    _max_user_writes:int
+    # Last write of the users dropped from _user_writes, or of a write of any user
+    _forgotten_writes_sequence:int = 0
+    _all_users_write_sequence:int = 0
+    _write_sequence:int = 0
+    _user_writes_lock:Lock
 
     def __init__(self, 
                  repository:BaseUserRepository[TModel],
                  user_type:Type[TModel],
                  password_services:PaswordServices = None,
-                 jwt_services:JWTServices = None
+                 jwt_services:JWTServices = None,
+                 token_cache:CacheBackend = None
                  ) -> None:
+        """
+        | .env variables:
+        | AUTH_TOKEN_CACHE_SECONDS (60 by default, 0 disables the verified token cache)
+        | AUTH_TOKEN_CACHE_SIZE (1024 by default)
+
+        The verified token cache is per process and only invalidated by the writes of this 
+        process: with several workers, a user deleted or demoted through another one stays 
+        authenticated with the tokens cached here for up to AUTH_TOKEN_CACHE_SECONDS
+
+        Args:
+            token_cache (CacheBackend, optional): Backend of the verified token cache, 
+                defaults to an InMemoryCacheBackend
+        """
         self._user_type = user_type
         self._repository = repository
         self._password_services = password_services if password_services != None else PaswordServices()
         self._jwt_services = jwt_services if jwt_services != None else JWTServices()
 
+        self._token_cache_ttl = float(os.getenv('AUTH_TOKEN_CACHE_SECONDS', 60))
+        cache_size = int(os.getenv('AUTH_TOKEN_CACHE_SIZE', 1024))
+        self._token_cache = None
+        if self._token_cache_ttl > 0:
+            self._token_cache = token_cache if token_cache != None else InMemoryCacheBackend(
+                max_size=cache_size,
+                ttl=self._token_cache_ttl)
+        self._user_writes = OrderedDict()
+        self._max_user_writes = cache_size
+        self._forgotten_writes_sequence = 0
+        self._all_users_write_sequence = 0
+        self._write_sequence = 0
+        self._user_writes_lock = Lock()
+        self._repository.add_write_listener(self._on_users_written)
+
     def validate_user(self,
                     identity_value:str, 
                     plain_password:str) -> TModel | None:
@@ -222,21 +268,31 @@ class BaseUserServices(Generic[TModel], metaclass=SingletonMeta):
             headers={"WWW-Authenticate": authenticate_value},
         )
 
-        payload = self.validate_token(
-            token,
-            secret,
-            algorithm
-        )
+        cache_key = self._get_token_cache_key(token, secret, algorithm)
+        cached_auth = self._get_cached_auth(cache_key)
+        if cached_auth != None:
+            payload, user = cached_auth
+        else:
+            # Taken before the lookup, so writes racing with it invalidate the cached user
+            write_sequence = self._write_sequence
+            payload = self.validate_token(
+                token,
+                secret,
+                algorithm
+            )
+            
+            if payload is False:
+                raise credentials_exception
         
-        if payload is False:
-            raise credentials_exception
-    
-        results = self._repository.read([
-            getattr(self._user_type, self._subject_claim_field) == 
-            payload.get('sub')])
-
-        if len(results) == 0:
-            raise credentials_exception
+            results = self._repository.read([
+                getattr(self._user_type, self._subject_claim_field) == 
+                payload.get('sub')], 
+                limit=1)
+
+            if len(results) == 0:
+                raise credentials_exception
+            user = results[0]
+            self._cache_auth(cache_key, payload, user, write_sequence)
         
         if not self.check_scopes(
             payload.get('scopes',[]), 
@@ -246,4 +302,71 @@ class BaseUserServices(Generic[TModel], metaclass=SingletonMeta):
                 headers={"WWW-Authenticate": authenticate_value},
             )
 
-        return results[0]
+        return user
+
+    def _get_token_cache_key(self, token:str, secret:str, algorithm:str) -> tuple:
+        # Tokens and secrets are only kept as a digest
+        return ("token", hashlib.sha256(f"{algorithm}|{secret}|{token}".encode()).hexdigest())
+
+    def _get_cached_auth(self, cache_key:tuple) -> Tuple[dict, TModel] | None:
+        """Payload and user of a token verified before, unless the user was written since. 
+        Cached users are shared between requests, so they must be treated as read-only"""
+        if self._token_cache == None:
+            return None
+
+        entry = self._token_cache.get(cache_key)
+        if entry is None:
+            return None
+
+        payload, user, write_sequence = entry
+        if self._get_last_write_sequence(user.id) > write_sequence:
+            self._token_cache.delete(cache_key)
+            return None
+        return payload, user
+
+    def _cache_auth(self, 
+                    cache_key:tuple, 
+                    payload:dict, 
+                    user:TModel, 
+                    write_sequence:int):
+        """Caches a verified token until the cache ttl or its expiration, whichever comes 
+        first. The entry is valid until the user is written after write_sequence. Users read 
+        inside a UnitOfWork belong to its session, and could have uncommitted changes, so the 
+        committed user is read again in its own session to be cached"""
+        if self._token_cache == None:
+            return
+        
+        ttl = self._token_cache_ttl
+        if payload.get('exp') != None:
+            ttl = min(ttl, float(payload['exp']) - time.time())
+        if ttl <= 0:
+            return
+
+        if get_current_session() is not None:
+            with without_unit_of_work():
+                results = self._repository.read([self._repository.get_model().id == user.id], limit=1)
+            if len(results) == 0:
+                return
+            user = results[0]
+
+        self._token_cache.set(cache_key, (payload, user, write_sequence), ttl)
+
+    def _get_last_write_sequence(self, id:int) -> int:
+        """Sequence number of the last write of a user. Users dropped from the bounded 
+        _user_writes are assumed to be written last when the latest of them was"""
+        return max(self._all_users_write_sequence, 
+                   self._user_writes.get(id, self._forgotten_writes_sequence))
+
+    def _on_users_written(self, ids:List[int] | None):
+        with self._user_writes_lock:
+            self._write_sequence += 1
+            if ids is None:
+                self._all_users_write_sequence = self._write_sequence
+                return
+
+            for id in ids:
+                self._user_writes[id] = self._write_sequence
+                self._user_writes.move_to_end(id)
+            while len(self._user_writes) > self._max_user_writes:
+                _, sequence = self._user_writes.popitem(last=False)
+                self._forgotten_writes_sequence = max(self._forgotten_writes_sequence, sequence)
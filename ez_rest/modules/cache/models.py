@@ -0,0 +1,29 @@
+from abc import ABC, abstractmethod
+from typing import Any, Hashable, Optional
+from pydantic import BaseModel as PydanticModel
+
+class CacheBackend(ABC):
+    """Storage used by the cache services. get returns None on a miss, so None values 
+    can't be cached. Implementations must be thread safe"""
+
+    @abstractmethod
+    def get(self, key:Hashable) -> Any | None:
+        pass
+
+    @abstractmethod
+    def set(self, key:Hashable, value:Any, ttl:float = None):
+        pass
+
+    @abstractmethod
+    def delete(self, key:Hashable):
+        pass
+
+    @abstractmethod
+    def clear(self):
+        pass
+
+class CacheStats(PydanticModel):
+    hits:int
+    misses:int
+    # None when the backend can't tell its size
+    size:Optional[int]
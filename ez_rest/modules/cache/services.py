@@ -0,0 +1,217 @@
+from collections import OrderedDict
+from collections.abc import Sized
+from threading import Lock
+from typing import Any, Callable, Dict, Hashable, List, Type
+from sqlalchemy import Executable
+from .models import CacheBackend, CacheStats
+import hashlib
+import time
+
+class InMemoryCacheBackend(CacheBackend):
+    """In-process LRU cache with per-entry expiration"""
+    _entries:OrderedDict
+    _max_size:int
+    _ttl:float
+    _lock:Lock
+
+    def __init__(self, 
+                 max_size:int = 1024, 
+                 ttl:float = 60) -> None:
+        self._entries = OrderedDict()
+        self._max_size = max_size
+        self._ttl = ttl
+        self._lock = Lock()
+
+    def get(self, key:Hashable) -> Any | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key:Hashable, value:Any, ttl:float = None):
+        expires_at = time.monotonic() + (self._ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key:Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+class EntityCacheServices():
+    """Read-through cache of entities by (model, id). Cached instances are detached and 
+    shared between callers, so they must be treated as read-only. Every model has a 
+    generation, bumped by each invalidation, so that reads racing with a write don't 
+    cache the row it replaced"""
+    _backend:CacheBackend
+    _generations:Dict[str, int]
+    _lock:Lock
+    _hits:int = 0
+    _misses:int = 0
+
+    def __init__(self, backend:CacheBackend = None) -> None:
+        self._backend = InMemoryCacheBackend() if backend is None else backend
+        self._generations = {}
+        self._lock = Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, model:Type, id:int) -> Any | None:
+        item = self._backend.get(self._get_key(model, id))
+        if item is None:
+            self._misses += 1
+        else:
+            self._hits += 1
+        return item
+
+    def get_generation(self, model:Type) -> int:
+        """Generation to give to set, taken before reading the item"""
+        return self._generations.get(model.__tablename__, 0)
+
+    def set(self, model:Type, id:int, item:Any, generation:int = None):
+        """Caches an item, unless the model was invalidated since generation was taken"""
+        with self._lock:
+            if generation != None and generation != self.get_generation(model):
+                return
+            self._backend.set(self._get_key(model, id), item)
+
+    def invalidate(self, model:Type, ids:List[int] = None):
+        """Removes the given ids of a model, or the whole cache when ids is None"""
+        with self._lock:
+            self._generations[model.__tablename__] = self.get_generation(model) + 1
+            if ids is None:
+                self._backend.clear()
+                return
+            
+            for id in ids:
+                self._backend.delete(self._get_key(model, id))
+
+    def get_stats(self) -> CacheStats:
+        return CacheStats(
+            hits=self._hits,
+            misses=self._misses,
+            size=len(self._backend) if isinstance(self._backend, Sized) else None
+        )
+
+    def _get_key(self, model:Type, id:int) -> tuple:
+        return ("entity", model.__tablename__, id)
+
+class QueryCacheServices():
+    """Caches query results by the SQLAlchemy cache key of the statement and its parameters. 
+    Every model has a version that is part of the key and is bumped by each write, so stale 
+    results become unreachable and are evicted by the backend on their own. Concurrent misses 
+    of the same key wait for a single computation. Cached results are shared between callers, 
+    so they must be treated as read-only.
+    
+    Versions are tracked per model and per process: results that load related models aren't 
+    invalidated by writes to those models, other than through the ttl"""
+    _backend:CacheBackend
+    _ttl:float
+    _versions:Dict[str, int]
+    _versions_lock:Lock
+    _locks:List[Lock]
+    _hits:int = 0
+    _misses:int = 0
+
+    def __init__(self, 
+                 backend:CacheBackend = None, 
+                 ttl:float = None,
+                 lock_stripes:int = 64) -> None:
+        """
+        Args:
+            backend (CacheBackend, optional): Defaults to an InMemoryCacheBackend
+            ttl (float, optional): Seconds a result is kept, defaults to the backend ttl
+            lock_stripes (int, optional): Number of locks shared by the keys being computed
+        """
+        self._backend = InMemoryCacheBackend() if backend is None else backend
+        self._ttl = ttl
+        self._versions = {}
+        self._versions_lock = Lock()
+        self._locks = [Lock() for _ in range(lock_stripes)]
+        self._hits = 0
+        self._misses = 0
+
+    def get_or_compute(self, 
+                       model:Type, 
+                       name:str, 
+                       statement:Executable, 
+                       compute:Callable[[], Any]) -> Any:
+        """Returns the cached result of a statement, or computes and caches it
+
+        Args:
+            model (Type): Model whose version is part of the key
+            name (str): Kind of result, for statements that compile alike but load different results
+            statement (Executable): Statement the result depends on
+            compute (Callable[[], Any]): Executes the statement, only called on a miss
+
+        Returns:
+            Any: Result of compute
+        """
+        key = self._get_key(model, name, statement)
+        result = self._backend.get(key)
+        if result is not None:
+            self._hits += 1
+            return result
+
+        with self._locks[hash(key) % len(self._locks)]:
+            # Another thread may have computed it while this one was waiting
+            result = self._backend.get(key)
+            if result is not None:
+                self._hits += 1
+                return result
+
+            self._misses += 1
+            result = compute()
+            self._backend.set(key, result, self._ttl)
+        return result
+
+    def get_version(self, model:Type) -> int:
+        return self._versions.get(model.__tablename__, 0)
+
+    def bump_version(self, model:Type):
+        """Makes every cached result of a model unreachable"""
+        with self._versions_lock:
+            self._versions[model.__tablename__] = self.get_version(model) + 1
+
+    def get_stats(self) -> CacheStats:
+        return CacheStats(
+            hits=self._hits,
+            misses=self._misses,
+            size=len(self._backend) if isinstance(self._backend, Sized) else None
+        )
+
+    def _get_key(self, model:Type, name:str, statement:Executable) -> tuple:
+        # The SQLAlchemy cache key is memoized by reused statements, unlike compiling them
+        cache_key = statement._generate_cache_key()
+        if cache_key is None:
+            compiled = statement.compile()
+            fingerprint = hashlib.sha256(
+                f"{compiled}|{sorted(compiled.params.items())!r}".encode()).hexdigest()
+        else:
+            fingerprint = (cache_key.key, 
+                           tuple(self._get_hashable(parameter.effective_value) 
+                                 for parameter in cache_key.bindparams))
+        return ("query", model.__tablename__, self.get_version(model), name, fingerprint)
+
+    def _get_hashable(self, value:Any) -> Hashable:
+        """Parameter values of IN are lists"""
+        if isinstance(value, (list, tuple)):
+            return tuple(self._get_hashable(item) for item in value)
+        return value
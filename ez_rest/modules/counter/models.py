@@ -0,0 +1,21 @@
+from ..crud.models import BaseModel
+from sqlalchemy.orm import Mapped, declared_attr, mapped_column
+from sqlalchemy import BigInteger, Integer, String, UniqueConstraint
+
+class CounterModel(BaseModel):
+    """Number of live rows of a table by value of a column, for the columns listed 
+    in the __counter_columns__ of a model. Values are stored JSON encoded"""
+    __tablename__ = "counters"
+    # BIGINT primary keys aren't autoincremented by SQLite
+    id:Mapped[int] = mapped_column(BigInteger().with_variant(Integer(), "sqlite"), primary_key=True)
+    table_name:Mapped[str] = mapped_column(String(100))
+    column_name:Mapped[str] = mapped_column(String(100))
+    value:Mapped[str] = mapped_column(String(255))
+    count:Mapped[int] = mapped_column(BigInteger(), default=0)
+
+    @declared_attr.directive
+    def __table_args__(cls):
+        return (
+            *cls.get_soft_delete_indexes(),
+            UniqueConstraint("table_name", "column_name", "value")
+        )
@@ -0,0 +1,145 @@
+from collections import Counter
+from typing import Any, List, Type
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from ..crud.models import BaseModel
+from .models import CounterModel
+import json
+
+class CounterServices():
+    """Maintains the counter table of the models declaring __counter_columns__, e.g.
+
+    class ProductModel(BaseModel):
+        __tablename__ = "products"
+        __counter_columns__ = ["category"]
+
+    Changes are written in the session of the write that caused them, so counters are 
+    committed or rolled back with it"""
+
+    def get_counter_columns(self, model:Type[BaseModel]) -> List[str]:
+        return getattr(model, "__counter_columns__", [])
+
+    def get_count(self, 
+                  session:Session, 
+                  model:Type[BaseModel], 
+                  column_name:str, 
+                  value:Any) -> int:
+        """Reads the number of live rows of a model where column_name == value
+
+        Args:
+            session (Session): Session
+            model (Type[BaseModel]): Model declaring column_name in __counter_columns__
+            column_name (str): Counted column
+            value (Any): Value of the column
+
+        Returns:
+            int: Number of rows
+        """
+        count = session.execute(
+            select(CounterModel.count) \
+                .where(CounterModel.table_name == model.__tablename__,
+                       CounterModel.column_name == column_name,
+                       CounterModel.value == self._encode(value))).scalar()
+        return count if count != None else 0
+
+    def count_rows(self, 
+                   session:Session, 
+                   model:Type[BaseModel], 
+                   ids:List[int],
+                   lock:bool = False) -> Counter:
+        """Counts the live rows among ids, by counted column and value
+
+        Args:
+            lock (bool, optional): Lock the rows first (SELECT ... FOR UPDATE), so that 
+                concurrent writes to them wait for this transaction, and then count the 
+                values it leaves instead of the ones it replaced
+
+        Returns:
+            Counter: Number of rows by (column_name, value)
+        """
+        if lock:
+            # FOR UPDATE can't be combined with the GROUP BY of the counts
+            session.execute(
+                select(model.id) \
+                    .where(model.id.in_(ids)) \
+                    .with_for_update()).all()
+
+        counts = Counter()
+        for column_name in self.get_counter_columns(model):
+            column = getattr(model, column_name)
+            rows = session.execute(
+                select(column, func.count()) \
+                    .where(model.id.in_(ids), 
+                           model.get_not_deleted_filter()) \
+                    .group_by(column)).all()
+            for value, count in rows:
+                counts[(column_name, value)] += count
+        return counts
+
+    def increment(self, 
+                  session:Session, 
+                  model:Type[BaseModel], 
+                  counts:Counter):
+        """Adds counts, that can be negative, to the counters of a model
+
+        Args:
+            session (Session): Session of the write that changed the rows
+            model (Type[BaseModel]): Counted model
+            counts (Counter): Changes by (column_name, value)
+        """
+        if len(counts) == 0:
+            return
+
+        dialect_name = session.connection().dialect.name
+        # Always locking counters in the same order avoids deadlocks between writers
+        for (column_name, value), count in sorted(counts.items(), key=repr):
+            if count == 0:
+                continue
+
+            key = {"table_name":model.__tablename__,
+                   "column_name":column_name,
+                   "value":self._encode(value)}
+            if dialect_name in ("postgresql", "sqlite"):
+                dialect_insert = postgresql.insert if dialect_name == "postgresql" else sqlite.insert
+                statement = dialect_insert(CounterModel) \
+                    .values(**key, count=count) \
+                    .on_conflict_do_update(
+                        index_elements=["table_name", "column_name", "value"],
+                        set_={"count":CounterModel.count + count})
+                session.execute(statement)
+                continue
+
+            result = session.execute(
+                update(CounterModel) \
+                    .where(*[getattr(CounterModel, name) == value for name, value in key.items()]) \
+                    .values(count=CounterModel.count + count) \
+                    .execution_options(synchronize_session=False))
+            if result.rowcount == 0:
+                session.execute(insert(CounterModel).values(**key, count=count))
+
+    def rebuild(self, 
+                session:Session, 
+                model:Type[BaseModel]):
+        """Recounts every counter of a model from its table, for rows written 
+        without going through BaseRepository, or counters added to an existing table"""
+        session.execute(
+            delete(CounterModel) \
+                .where(CounterModel.table_name == model.__tablename__))
+
+        for column_name in self.get_counter_columns(model):
+            column = getattr(model, column_name)
+            rows = session.execute(
+                select(column, func.count()) \
+                    .where(model.get_not_deleted_filter()) \
+                    .group_by(column)).all()
+            if len(rows) > 0:
+                session.execute(
+                    insert(CounterModel),
+                    [{"table_name":model.__tablename__,
+                      "column_name":column_name,
+                      "value":self._encode(value),
+                      "count":count} for value, count in rows])
+
+    def _encode(self, value:Any) -> str:
+        return json.dumps(value, default=str)
@@ -1,11 +1,19 @@
-from .repository import BaseRepository
+from .repository import BaseRepository, AsyncBaseRepository
 from ..pagination.services import PaginationServices
-from ..pagination.models import PaginationDTO
-from .models import BaseModel, BaseDTO
-from typing import TypeVar,Generic,List, Type
+from ..pagination.models import PaginationDTO, CursorPaginationDTO
+from .models import BaseModel, BaseDTO, UpsertResult, VersionedMixin
+from typing import Iterable, Iterator, TypeVar,Generic,List, Type
 from ez_rest.modules.mapper.services import mapper_services as mapper, MapperServices
 from abc import ABC, abstractmethod
-from fastapi import HTTPException, status
+from fastapi import HTTPException, Response, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import inspect
+from sqlalchemy.orm.exc import DetachedInstanceError, NoResultFound, StaleDataError
+from pydantic import BaseModel as PydanticModel
+from pydantic.json import pydantic_encoder
+import csv
+import io
+import json
 
 TModel = TypeVar("TModel", bound=BaseModel)
 TDtoIn = TypeVar("TDtoIn", bound=BaseDTO)
@@ -15,6 +23,8 @@ class BaseController(ABC, Generic[TModel]):
     _repository:BaseRepository[TModel]
     _pagination_services:PaginationServices
     _mapper_services:MapperServices
+    # When True and no fields are requested, only the columns matching the output DTO fields are loaded
+    _project_dto_fields:bool = False
 
     def __init__(
             self, 
@@ -40,11 +50,452 @@ class BaseController(ABC, Generic[TModel]):
             query:List = [],
             page:int = 1, 
             limit:int = None,
+            with_count:bool = True,
+            fields:List[str] | str = None,
+            hydrate:bool = True,
+            options:List = None,
+            approximate_count:bool = False
     ) -> PaginationDTO[TDtoOut]:
+        """Reads a page of items
+
+        Args:
+            type_out (Type[TDtoOut]): Output DTO
+            query (List, optional): Filters
+            page (int, optional): Page number
+            limit (int, optional): Max number of items per page
+            with_count (bool, optional): Count the items. When False count and pages_count 
+                are left unset and has_next is detected by fetching one extra item
+            fields (List[str] | str, optional): Columns to load, as a list or comma separated, 
+                besides the ones the output DTO needs (see _get_fields)
+            hydrate (bool, optional): When False, Core rows are read instead of ORM instances 
+                and DTOs are built without validation. Useful for large read-only listings
+            options (List, optional): Relationship loader options, defaults to the 
+                __loader_options__ declared by the output DTO, if any
+            approximate_count (bool, optional): Use the planner estimate of the count, when 
+                there is one (see BaseRepository.estimate_count). count_estimated tells if it was
+
+        Raises:
+            HTTPException: 400 if fields has unknown columns, or misses columns the output 
+                DTO is mapped from that it doesn't declare
+
+        Returns:
+            PaginationDTO[TDtoOut]: Page
+        """
         
-        count = self._repository.count(query)
         offset = self._pagination_services.get_offset(page, limit)
-        items = self._repository.read(
+        fields = self._get_fields(type_out, fields)
+        options = self._get_loader_options(type_out, options)
+        count = pages_count = None
+        count_estimated = False
+
+        if with_count and not approximate_count:
+            items, count = self._repository.read_with_count(
+                query,
+                limit,
+                offset,
+                fields=fields,
+                hydrate=hydrate,
+                options=options)
+            pages_count = self._pagination_services.get_pages_count(
+                count, 
+                limit)
+            has_next = page < pages_count
+        else:
+            # Fetching one extra item tells whether there is a next page without counting
+            items = self._repository.read(
+                query,
+                limit + 1,
+                offset,
+                fields=fields,
+                hydrate=hydrate,
+                options=options)
+            has_next = len(items) > limit
+            items = items[:limit]
+
+            if with_count:
+                count, count_estimated = self._repository.estimate_count(query)
+                pages_count = self._pagination_services.get_pages_count(
+                    count, 
+                    limit)
+        
+        try:
+            items = self._mapper_services.map_many(
+                items, 
+                self._repository.get_model(), 
+                type_out,
+                validate=hydrate)
+        except (DetachedInstanceError, AttributeError):
+            if fields is None:
+                raise
+            # The mapper read a column that wasn't loaded
+            raise HTTPException(status.HTTP_400_BAD_REQUEST, 
+                                f'fields must include the columns {type_out.__name__} is mapped from')
+
+        return PaginationDTO(
+            count=count,
+            count_estimated=count_estimated,
+            page=page, 
+            pages_count=pages_count, 
+            has_next=has_next,
+            items=items
+        )
+
+    def read_by_cursor(
+            self,
+            type_out:Type[TDtoOut],
+            query:List = [],
+            limit:int = 20,
+            cursor:str = None,
+            sort_field:str = "id"
+    ) -> CursorPaginationDTO[TDtoOut]:
+        
+        if sort_field not in self._repository.get_column_names():
+            raise HTTPException(status.HTTP_400_BAD_REQUEST, f"Unknown sort field: {sort_field}")
+
+        after = before = None
+        direction = "next"
+        if cursor is not None:
+            try:
+                key, direction = self._pagination_services.decode_cursor(cursor)
+            except ValueError:
+                raise HTTPException(status.HTTP_400_BAD_REQUEST)
+            # Cursors of another sort field, or tampered with, have another number of values
+            if len(key) != (1 if sort_field == "id" else 2):
+                raise HTTPException(status.HTTP_400_BAD_REQUEST, f"Invalid cursor for sort field {sort_field}")
+            if direction == "next":
+                after = key
+            else:
+                before = key
+
+        # One extra item tells whether there is another page in the seek direction
+        try:
+            items = self._repository.read_by_cursor(
+                query,
+                limit + 1,
+                sort_field,
+                after,
+                before)
+        except ValueError as error:
+            raise HTTPException(status.HTTP_400_BAD_REQUEST, str(error))
+        has_more = len(items) > limit
+        items = items[:limit] if direction == "next" else items[-limit:]
+
+        def get_key(item):
+            return [item.id] if sort_field == "id" else [getattr(item, sort_field), item.id]
+
+        next_cursor = prev_cursor = None
+        if len(items) > 0:
+            # Coming back from a later page means there is always a next one
+            has_next = has_more if direction == "next" else True
+            has_prev = cursor is not None if direction == "next" else has_more
+            if has_next:
+                next_cursor = self._pagination_services.encode_cursor(get_key(items[-1]), "next")
+            if has_prev:
+                prev_cursor = self._pagination_services.encode_cursor(get_key(items[0]), "prev")
+
+        return CursorPaginationDTO(
+            limit=limit,
+            next_cursor=next_cursor,
+            prev_cursor=prev_cursor,
+            items=[self._mapper_services.map(item, type_out) for item in items]
+        )
+
+    def read_by_id(self,
+                id:int, 
+                type_out:Type[TDtoOut],
+                fields:List[str] | str = None,
+                options:List = None,
+                response:Response = None) -> TDtoOut:
+        fields = self._get_fields(type_out, fields)
+        item = self._repository.readById(
+            id,
+            fields=fields,
+            options=self._get_loader_options(type_out, options))
+        if item is None:
+            raise HTTPException(status.HTTP_404_NOT_FOUND)
+        
+        self._set_etag(response, item)
+        try:
+            return self._mapper_services.map(item, type_out)
+        except (DetachedInstanceError, AttributeError):
+            if fields is None:
+                raise
+            # The mapper read a column that wasn't loaded
+            raise HTTPException(status.HTTP_400_BAD_REQUEST, 
+                                f'fields must include the columns {type_out.__name__} is mapped from')
+
+    def export(self,
+               type_out:Type[TDtoOut],
+               query:List = [],
+               format:str = "ndjson",
+               fields:List[str] | str = None,
+               hydrate:bool = True,
+               options:List = None,
+               batch_size:int = 1000) -> StreamingResponse:
+        """Streams every item matching the filters as NDJSON or CSV. Items are read with 
+        BaseRepository.stream and mapped as they are sent, so memory stays constant 
+        whatever the number of items
+
+        Args:
+            type_out (Type[TDtoOut]): Output DTO
+            query (List, optional): Filters
+            format (str, optional): ndjson or csv
+            fields (List[str] | str, optional): Columns to load, as a list or comma separated
+            hydrate (bool, optional): When False, Core rows are read and DTOs are built without validation
+            options (List, optional): Relationship loader options, defaults to the 
+                __loader_options__ declared by the output DTO, if any
+            batch_size (int, optional): Number of rows fetched, and items sent, at a time
+
+        Raises:
+            HTTPException: 400 if the format isn't supported
+
+        Returns:
+            StreamingResponse: Response streaming the items
+        """
+        if format not in ("ndjson", "csv"):
+            raise HTTPException(status.HTTP_400_BAD_REQUEST, f"Unsupported export format: {format}")
+
+        items = self._repository.stream(
+            query,
+            fields=self._get_fields(type_out, fields),
+            hydrate=hydrate,
+            options=self._get_loader_options(type_out, options),
+            batch_size=batch_size)
+        items = self._mapper_services.map_iter(
+            items, 
+            self._repository.get_model(), 
+            type_out, 
+            validate=hydrate)
+
+        if format == "csv":
+            content = self._to_csv(items, type_out, batch_size)
+            media_type = "text/csv"
+        else:
+            content = self._to_ndjson(items, batch_size)
+            media_type = "application/x-ndjson"
+        
+        filename = f"{self._repository.get_model().__tablename__}.{format}"
+        return StreamingResponse(
+            content, 
+            media_type=media_type,
+            headers={"Content-Disposition":f'attachment; filename="{filename}"'})
+
+    def _to_ndjson(self, 
+                   items:Iterable[TDtoOut], 
+                   batch_size:int) -> Iterator[str]:
+        lines = []
+        for item in items:
+            lines.append(item.json())
+            if len(lines) == batch_size:
+                yield "\n".join(lines) + "\n"
+                lines = []
+        if len(lines) > 0:
+            yield "\n".join(lines) + "\n"
+
+    def _to_csv(self, 
+                items:Iterable[TDtoOut], 
+                type_out:Type[TDtoOut], 
+                batch_size:int) -> Iterator[str]:
+        columns = list(type_out.__fields__.keys())
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        
+        for index, item in enumerate(items, 1):
+            values = [getattr(item, column, None) for column in columns]
+            writer.writerow([json.dumps(value, default=pydantic_encoder) 
+                             if isinstance(value, (dict, list, PydanticModel)) else value 
+                             for value in values])
+            if index % batch_size == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    def _get_fields(self, 
+                    type_out:Type[TDtoOut], 
+                    fields:List[str] | str = None) -> List[str] | None:
+        """Resolves the columns to load, from a list, a comma separated ?fields= value,
+        or the output DTO fields when _project_dto_fields is enabled. The columns the output 
+        DTO needs are always loaded: its fields named after columns, and the columns its 
+        mapper reads, declared in __required_fields__:
+
+        class ProductReadDTO(BaseDTO):
+            __required_fields__ = ["name", "category"]
+        """
+        if isinstance(fields, str):
+            fields = [field.strip() for field in fields.split(",") if field.strip()]
+        if not fields and not self._project_dto_fields:
+            return None
+        
+        column_names = self._repository.get_column_names()
+        dto_fields = [field for field in [*type_out.__fields__, *getattr(type_out, "__required_fields__", [])] 
+                      if field in column_names]
+        if not fields:
+            return list(dict.fromkeys(dto_fields))
+
+        unknown_fields = [field for field in fields if field not in column_names]
+        if unknown_fields:
+            raise HTTPException(status.HTTP_400_BAD_REQUEST, 
+                                f'Unknown fields: {", ".join(unknown_fields)}')
+        return list(dict.fromkeys([*fields, *dto_fields]))
+
+    def _get_loader_options(self, 
+                            type_out:Type[TDtoOut], 
+                            options:List = None) -> List | None:
+        """Loader options given to the endpoint, or else the ones declared by the output DTO:
+
+        class UserSummaryDTO(BaseDTO):
+            __loader_options__ = [noload(UserModel.role)]
+        """
+        if options is not None:
+            return options
+        return getattr(type_out, "__loader_options__", None)
+
+    def _parse_if_match(self, if_match:str) -> List[int] | None:
+        """Reads the versions an If-Match header accepts: "3", a list like "3", "4", or None 
+        for *, that accepts any version. If-Match compares ETags strongly, so weak ETags 
+        like W/"3" never match
+
+        Raises:
+            HTTPException: 400 if an ETag isn't a version, 412 if every ETag is weak
+        """
+        if if_match.strip() == "*":
+            return None
+
+        versions = []
+        for etag in if_match.split(","):
+            etag = etag.strip()
+            if etag.startswith("W/"):
+                continue
+            try:
+                versions.append(int(etag.strip('"')))
+            except ValueError:
+                raise HTTPException(status.HTTP_400_BAD_REQUEST, f"Invalid If-Match: {if_match}")
+
+        if len(versions) == 0:
+            raise HTTPException(status.HTTP_412_PRECONDITION_FAILED, 
+                                "If-Match requires strong ETags")
+        return versions
+
+    def _set_etag(self, response:Response, item:TModel):
+        """Sends the version of an item as its ETag, for models with VersionedMixin"""
+        if response is None or \
+            not isinstance(item, VersionedMixin) or \
+            "version" in inspect(item).unloaded:
+            return
+        response.headers["ETag"] = f'"{item.version}"'
+
+    def update_by_id( self,
+                    id:int,
+                    partial_item:TDtoIn,
+                    type_in:Type[TDtoIn],
+                    type_out:Type[TModel],
+                    dto_type_out:Type[TDtoOut] = None,
+                    if_match:str = None,
+                    response:Response = None):
+        """Updates an item
+
+        Args:
+            if_match (str, optional): If-Match header with the version the client read, 
+                e.g. "3", a list like "3", "4", or *, for models with VersionedMixin
+            response (Response, optional): Response of the endpoint, that gets the new 
+                version as its ETag
+
+        Raises:
+            HTTPException: 400 if If-Match isn't a version, 404 if the item doesn't exist, 
+                409 if it was updated since the client read it, 412 if If-Match only has 
+                weak ETags
+        """
+        partial_data = self._mapper_services.map_dict(
+            type_in(**partial_item.dict(exclude_unset=True)),
+            type_out
+        )
+        expected_version = self._parse_if_match(if_match) if if_match != None else None
+        
+        try:
+            item = self._repository.updateById(partial_data, id, expected_version)
+        except NoResultFound:
+            raise HTTPException(status.HTTP_404_NOT_FOUND)
+        except StaleDataError as error:
+            raise HTTPException(status.HTTP_409_CONFLICT, str(error))
+        except ValueError as error:
+            raise HTTPException(status.HTTP_400_BAD_REQUEST, str(error))
+
+        self._set_etag(response, item)
+        if dto_type_out is None:
+            return item
+        return self._mapper_services.map(item, dto_type_out)
+
+    def create_many(self, 
+                    items:List[TDtoIn], 
+                    type_in:Type[TModel], 
+                    type_out:Type[TDtoOut]) -> List[TDtoOut]:
+        new_items = [self._mapper_services.map(item, type_in) for item in items]
+        created_items = self._repository.create_many(new_items)
+        return [self._mapper_services.map(item, type_out) for item in created_items]
+
+    def update_many(self, 
+                    partial_items:List[TDtoIn],
+                    type_in:Type[TDtoIn],
+                    type_out:Type[TModel]):
+        partial_data = {}
+        for partial_item in partial_items:
+            if partial_item.id is None:
+                raise HTTPException(status.HTTP_400_BAD_REQUEST)
+            partial_data[partial_item.id] = self._mapper_services.map_dict(
+                type_in(**partial_item.dict(exclude_unset=True)),
+                type_out
+            )
+
+        self._repository.update_many(partial_data)
+
+    def upsert_many(self, 
+                    items:List[TDtoIn], 
+                    type_in:Type[TModel]) -> UpsertResult:
+        new_items = [self._mapper_services.map(item, type_in) for item in items]
+        return self._repository.upsert_many(new_items)
+
+    def delete_many(self, 
+                    ids:List[int],
+                    soft_delete:bool = True) -> int:
+        return self._repository.delete_many(ids, soft_delete)
+
+
+class AsyncBaseController(ABC, Generic[TModel]):
+    _repository:AsyncBaseRepository[TModel]
+    _pagination_services:PaginationServices
+    _mapper_services:MapperServices
+
+    def __init__(
+            self, 
+            repository:AsyncBaseRepository,
+            pagination_services:PaginationServices = None,
+            mapper_services:MapperServices = None
+        ) -> None:
+        self._repository = repository
+        self._pagination_services = PaginationServices() if pagination_services is None else pagination_services
+        self._mapper_services = mapper if mapper_services is None else mapper_services
+
+    async def create(self, 
+               item:TDtoIn, 
+               type_in:Type[TModel], 
+               type_out:Type[TDtoOut]):
+        new_item = self._mapper_services.map(item, type_in)
+        created_item = await self._repository.create(new_item)
+        return  self._mapper_services.map(created_item, type_out)
+    
+    async def read(
+            self,
+            type_out:Type[TDtoOut],
+            query:List = [],
+            page:int = 1, 
+            limit:int = None,
+    ) -> PaginationDTO[TDtoOut]:
+        
+        count = await self._repository.count(query)
+        offset = self._pagination_services.get_offset(page, limit)
+        items = await self._repository.read(
             query,
             limit,
             offset)
@@ -61,22 +512,22 @@ class BaseController(ABC, Generic[TModel]):
             items=items
         )
 
-    def read_by_id(self,
+    async def read_by_id(self,
                 id:int, 
                 type_out:Type[TDtoOut]) -> TDtoOut:
-        item = self._repository.readById(id)
+        item = await self._repository.readById(id)
         if item is None:
             raise HTTPException(status.HTTP_404_NOT_FOUND)
         
         return self._mapper_services.map(item, type_out)
 
-    def update_by_id( self, 
+    async def update_by_id( self, 
                     id:int,
                     partial_item:TDtoIn,
                     type_in:Type[TDtoIn],
                     type_out:Type[TModel]):
         
-        item = self._repository.readById(id)
+        item = await self._repository.readById(id)
         if item is None:
             raise HTTPException(status.HTTP_404_NOT_FOUND)
         
@@ -85,6 +536,4 @@ class BaseController(ABC, Generic[TModel]):
             type_out
         )
         
-        self._repository.updateById(partial_data, id)
-        
-        
+        await self._repository.updateById(partial_data, id)
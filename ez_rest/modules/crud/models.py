@@ -1,21 +1,101 @@
 from datetime import datetime
 from typing import Optional
-from sqlalchemy import BigInteger, DateTime
-from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
+from sqlalchemy import BigInteger, Boolean, Column, DateTime, Index, Integer, Table, event, text
+from sqlalchemy.orm import DeclarativeBase, Mapped, declared_attr, has_inherited_table, mapped_column
 from pydantic import BaseModel as PydanticModel
 
 class BaseModel(DeclarativeBase):
     __abstract__ = True
     id: Mapped[int] = mapped_column(BigInteger(), primary_key=True)
     created_at:Mapped[datetime] = mapped_column(DateTime(), default=datetime.utcnow())
-    # TODO: Index and/or add is_deleted field
     deleted_at:Mapped[Optional[datetime]]
     updated_at:Mapped[Optional[datetime]]
     #def to_dict(self):
     #    return {field.name:getattr(self, field.name) for field in self.__table__.c}
 
+    @declared_attr.directive
+    def __table_args__(cls):
+        """Indexes backing the soft delete filter of every repository query: deleted_at 
+        for purges, and a partial index of live ids where the dialect supports it. 
+        Models declaring their own __table_args__ should include get_soft_delete_indexes()
+        """
+        if has_inherited_table(cls):
+            return None
+        return cls.get_soft_delete_indexes()
+
+    @classmethod
+    def get_soft_delete_indexes(cls) -> tuple:
+        live_rows = text("deleted_at IS NULL")
+        return (
+            Index(f'ix_{cls.__tablename__}_deleted_at', "deleted_at"),
+            Index(f'ix_{cls.__tablename__}_live_id', 
+                  "id",
+                  postgresql_where=live_rows,
+                  sqlite_where=live_rows),
+        )
+
+    @classmethod
+    def get_not_deleted_filter(cls):
+        return cls.deleted_at == None
+
+    @classmethod
+    def get_soft_delete_values(cls, deleted_at:datetime) -> dict:
+        return {"deleted_at":deleted_at}
+
+    @classmethod
+    def get_archive_table(cls) -> Table:
+        """Table with the same columns, without constraints, where purged rows can be archived"""
+        name = f'{cls.__tablename__}_archive'
+        if name in cls.metadata.tables:
+            return cls.metadata.tables[name]
+
+        return Table(
+            name, 
+            cls.metadata,
+            *[Column(column.name, column.type, primary_key=column.primary_key) 
+              for column in cls.__table__.columns]
+        )
+
+class SoftDeleteFlagMixin:
+    """Adds an indexed is_deleted flag, which repositories filter on instead of deleted_at. 
+    It must precede BaseModel in the bases:
+
+    class Product(SoftDeleteFlagMixin, BaseModel): ...
+    """
+    is_deleted:Mapped[bool] = mapped_column(Boolean(), default=False, index=True)
+
+    @classmethod
+    def get_not_deleted_filter(cls):
+        return cls.is_deleted == False
+
+    @classmethod
+    def get_soft_delete_values(cls, deleted_at:datetime) -> dict:
+        return {"deleted_at":deleted_at, "is_deleted":deleted_at is not None}
+
+@event.listens_for(SoftDeleteFlagMixin, "before_insert", propagate=True)
+@event.listens_for(SoftDeleteFlagMixin, "before_update", propagate=True)
+def _sync_is_deleted(mapper, connection, target:SoftDeleteFlagMixin):
+    target.is_deleted = target.deleted_at is not None
+
+class VersionedMixin:
+    """Adds a version column, incremented by every update. Repositories check it in the 
+    UPDATE itself when an expected version is given (optimistic concurrency), and ORM 
+    flushes check it through version_id_col. It must precede BaseModel in the bases:
+
+    class Product(VersionedMixin, BaseModel): ...
+    """
+    version:Mapped[int] = mapped_column(Integer(), default=1, nullable=False)
+
+    @declared_attr.directive
+    def __mapper_args__(cls):
+        return {"version_id_col":cls.__table__.c.version}
+
 class BaseDTO(PydanticModel):
     id:int
     created_at:Optional[datetime]
     deleted_at:Optional[datetime]
     updated_at:Optional[datetime]
+
+class UpsertResult(PydanticModel):
+    inserted:int
+    updated:int
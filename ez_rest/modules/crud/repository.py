@@ -1,28 +1,56 @@
-from typing import List, TypeVar, Generic, Type
-from sqlalchemy import func, select
-from sqlalchemy.orm import Session
-from ..db.services import DbServices
-from .models import BaseModel
-from datetime import datetime
+from typing import Any, Callable, Dict, Hashable, Iterable, Iterator, List, Tuple, TypeVar, Generic, Type
+from sqlalchemy import BinaryExpression, BindParameter, Column, Executable, Row, Select, Table, UniqueConstraint, bindparam, delete, event, func, insert, inspect, select, text, tuple_, update
+from sqlalchemy.orm import Session, load_only, selectinload
+from sqlalchemy.orm.exc import NoResultFound, StaleDataError
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.sql import operators
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..db.services import DbServices, get_current_session, pin_primary
+from ..cache.services import EntityCacheServices, QueryCacheServices
+from ..counter.services import CounterServices
+from .models import BaseModel, UpsertResult, VersionedMixin
+from datetime import datetime, timedelta
 from abc import ABC
+from collections import Counter
+from contextlib import contextmanager
+import json
 
 T = TypeVar("T", bound=BaseModel)
 
 class BaseRepository(ABC, Generic[T]):
     _db_services:DbServices
     _model: Type[T]
+    _default_loader_options:List = None
+    _entity_cache:EntityCacheServices = None
+    _query_cache:QueryCacheServices = None
+    _counter_services:CounterServices
+    _statements:Dict[Hashable, Executable]
+    # Estimates below it are replaced by an exact count, see estimate_count
+    _approximate_count_threshold:int = 10000
     
     def __init__(self,  
                  model:Type[T], 
-                 db_services:DbServices = None) -> None:
+                 db_services:DbServices = None,
+                 entity_cache:EntityCacheServices = None,
+                 query_cache:QueryCacheServices = None) -> None:
         self._db_services = DbServices() if db_services == None else db_services
         self._model = model
+        self._counter_services = CounterServices()
+        self._statements = {}
+        if entity_cache != None:
+            self._entity_cache = entity_cache
+        if query_cache != None:
+            self._query_cache = query_cache
         
     def create(self, item:T) -> T:
-        with Session(self._db_services.get_engine()) as session:
+        item = self._prepare_insert(item)
+        with self._session() as session:
             session.add(item)
-            session.commit()
+            self._count_inserted(session, lambda: [item.id])
+            self._commit(session)
             session.refresh(item)
+        self._on_write([item.id])
         return item
 
     def read(
@@ -30,83 +58,1231 @@ class BaseRepository(ABC, Generic[T]):
             query = None,
             limit:int = None, 
             offset:int = None,
+            include_deleted:bool = False,
+            fields:List[str] = None,
+            hydrate:bool = True,
+            options:List = None
+            ) -> List[T] | List[Row]:
+        query = query if query != None else []
+        statement = self._select(fields, hydrate, options) \
+            .where(*query)
+
+        if include_deleted == False:
+            statement = statement \
+                .where(self._model.get_not_deleted_filter())
+
+        statement = statement \
+            .order_by(self._model.id) \
+            .limit(limit) \
+            .offset(offset)
+
+        def execute(session:Session):
+            results = session.execute(statement)
+            # unique() is required when a collection is joined eagerly
+            return results.unique().scalars().all() if hydrate else results.all()
+
+        items = self._cached("read" if hydrate else "read_rows", statement, execute)
+        return items
+
+    def stream(
+            self,
+            query = None,
+            include_deleted:bool = False,
+            fields:List[str] = None,
+            hydrate:bool = True,
+            options:List = None,
+            batch_size:int = 1000
+            ) -> Iterator[T | Row]:
+        """Reads items lazily, ordered by id, fetching batch_size rows at a time (yield_per, 
+        with a server-side cursor where the driver supports it), so memory doesn't grow 
+        with the number of rows. It uses its own session, which stays open until the 
+        generator is exhausted or closed, and doesn't join the active UnitOfWork
+
+        Args:
+            query (List, optional): Filters
+            include_deleted (bool, optional): Include soft deleted items
+            fields (List[str], optional): Columns to load, see get_column_names
+            hydrate (bool, optional): Yield ORM instances. When False, Core rows are yielded
+            options (List, optional): Relationship loader options. Collections can't be 
+                joined eagerly while streaming, selectinload loads them once per batch
+            batch_size (int, optional): Number of rows fetched at a time
+
+        Yields:
+            Iterator[T | Row]: Items
+        """
+        query = query if query != None else []
+        statement = self._select(fields, hydrate, options) \
+            .where(*query)
+
+        if include_deleted == False:
+            statement = statement \
+                .where(self._model.get_not_deleted_filter())
+
+        statement = statement \
+            .order_by(self._model.id) \
+            .execution_options(yield_per=batch_size)
+
+        with Session(self._db_services.get_read_engine()) as session:
+            results = session.execute(statement)
+            yield from results.scalars() if hydrate else results
+
+    def read_by_cursor(
+            self,
+            query = None,
+            limit:int = None,
+            sort_field:str = "id",
+            after:List = None,
+            before:List = None,
             include_deleted:bool = False
             ) -> List[T]:
+        """Keyset pagination: seeks from a sort key instead of skipping rows,
+        so every page costs the same regardless of its depth
+
+        Args:
+            query (List, optional): Filters
+            limit (int, optional): Max number of items
+            sort_field (str, optional): Column used to sort, ties are broken by id
+            after (List, optional): Sort key (value, id) of the item to start after
+            before (List, optional): Sort key (value, id) of the item to end before
+            include_deleted (bool, optional): Include soft deleted items
+
+        Raises:
+            ValueError: If sort_field isn't a column, or is nullable (rows with NULL can't 
+                be compared to a sort key, so they would be skipped), or after/before 
+                don't have a value per sort column
+
+        Returns:
+            List[T]: Items sorted by (sort_field, id)
+        """
+        query = query if query != None else []
+        if sort_field not in self.get_column_names():
+            raise ValueError(f"Unknown sort field: {sort_field}")
+        if getattr(self._model, sort_field).expression.nullable:
+            raise ValueError(f"Nullable columns can't be used to sort by cursor: {sort_field}")
+
+        sort_columns = [self._model.id] if sort_field == "id" else \
+            [getattr(self._model, sort_field), self._model.id]
+        for key in (after, before):
+            if key != None and len(key) != len(sort_columns):
+                raise ValueError(f"Sort keys of {sort_field} have {len(sort_columns)} values")
+        sort_key = tuple_(*sort_columns)
+
+        statement = select(self._model) \
+            .where(*query)
+
+        if include_deleted == False:
+            statement = statement \
+                .where(self._model.get_not_deleted_filter())
+
+        if after != None:
+            statement = statement \
+                .where(sort_key > tuple_(*after)) \
+                .order_by(*sort_columns)
+        elif before != None:
+            statement = statement \
+                .where(sort_key < tuple_(*before)) \
+                .order_by(*[column.desc() for column in sort_columns])
+        else:
+            statement = statement \
+                .order_by(*sort_columns)
+
+        items = self._read(
+            lambda session: session.execute(statement.limit(limit)).unique().scalars().all())
+
+        if before != None:
+            items = list(reversed(items))
+        return items
+    
+    def readById(
+            self,
+            id:int,
+            include_deleted:bool = False,
+            fields:List[str] = None,
+            options:List = None
+            ) -> T:
+        # Only full, live items read outside a UnitOfWork go through the entity cache
+        use_cache = self._entity_cache != None and \
+            get_current_session() is None and \
+            include_deleted == False and \
+            fields == None and \
+            options == None
+        if use_cache:
+            item = self._entity_cache.get(self._model, id)
+            if item is not None:
+                return item
+            generation = self._entity_cache.get_generation(self._model)
+
+        def build_statement():
+            statement = self._select(fields, options=options) \
+                        .where(self._model.id == bindparam("id"))
+
+            if include_deleted == False:
+                statement = statement \
+                    .where(self._model.get_not_deleted_filter())
+            return statement
+
+        # Loader options can't be part of the key, statements using them aren't reused
+        statement = build_statement() if options != None else self._get_statement(
+            ("readById", include_deleted, tuple(sorted(fields)) if fields else None), 
+            build_statement)
+        item = self._read(
+            lambda session: session.execute(statement, {"id":id}).unique().scalar_one_or_none(),
+            primary=use_cache)
+
+        if use_cache and item is not None:
+            self._entity_cache.set(self._model, id, item, generation)
+        return item
+    
+    def updateById(self,
+                   partial_data:dict, 
+                   id:int, 
+                   expected_version:int | List[int] = None) -> T:
+        """Updates an item with a single UPDATE ... RETURNING statement
+
+        Args:
+            partial_data (dict): Values to set
+            id (int): Item id
+            expected_version (int | List[int], optional): Only update the item if it's still 
+                at this version, or one of these versions, for models with VersionedMixin
+
+        Raises:
+            NoResultFound: If there is no item with that id, or it was soft deleted
+            StaleDataError: If the item isn't at the expected version anymore
+            ValueError: If an expected version is given for a model without versions
+
+        Returns:
+            T: Updated item
+        """
+        values = {key:value for key,value in partial_data.items() if key not in ("id", "version")}
+        values["updated_at"] = datetime.utcnow()
+        filters = [self._model.id == id, 
+                   self._model.get_not_deleted_filter()]
+
+        if issubclass(self._model, VersionedMixin):
+            values["version"] = self._model.version + 1
+            if isinstance(expected_version, list):
+                filters.append(self._model.version.in_(expected_version))
+            elif expected_version != None:
+                filters.append(self._model.version == expected_version)
+        elif expected_version != None:
+            raise ValueError(f"{self._model.__name__} doesn't have versions")
+
+        statement = update(self._model) \
+            .where(*filters) \
+            .values(**values) \
+            .execution_options(synchronize_session=False)
+
+        with self._session(expire_on_commit=False) as session:
+            with self._counting(session, [id], values.keys()):
+                # RETURNING doesn't load relationships, models with any are read back instead
+                if session.connection().dialect.update_returning and \
+                    not inspect(self._model).relationships:
+                    item = session.execute(
+                        statement.returning(self._model) \
+                            .execution_options(populate_existing=True)).scalar_one_or_none()
+                    if item is None:
+                        raise self._get_update_error(session, id, expected_version)
+                else:
+                    if session.execute(statement).rowcount == 0:
+                        raise self._get_update_error(session, id, expected_version)
+                    item = session.execute(
+                        select(self._model) \
+                            .where(self._model.id == id) \
+                            .execution_options(populate_existing=True)).scalar_one()
+            self._commit(session)
+        
+        self._on_write([id])
+        return item
+
+    def deleteById(self, id:int, soft_delete:bool = True):
+        """Deletes an item with a single statement
+
+        Args:
+            id (int): Item id
+            soft_delete (bool, optional): Set deleted_at instead of removing the row
+
+        Raises:
+            NoResultFound: If there is no item with that id, or it was already soft deleted
+        """
+        if soft_delete:
+            statement = update(self._model) \
+                .where(self._model.id == id, 
+                       self._model.get_not_deleted_filter()) \
+                .values(**self._model.get_soft_delete_values(datetime.utcnow()))
+        else:
+            statement = delete(self._model) \
+                .where(self._model.id == id)
+
+        with self._session() as session:
+            with self._counting(session, [id]):
+                result = session.execute(statement)
+                if result.rowcount == 0:
+                    raise NoResultFound()
+            self._commit(session)
+        self._on_write([id])
+
+    def create_many(self, 
+                    items:List[T], 
+                    chunk_size:int = 1000,
+                    returning:bool = True) -> List[T]:
+        """Inserts items in executemany batches inside a single transaction
+
+        Args:
+            items (List[T]): Items to insert
+            chunk_size (int, optional): Max number of rows per INSERT batch
+            returning (bool, optional): Load and return the inserted items. Uses RETURNING 
+                when the dialect supports it, otherwise items are flushed through the session
+
+        Returns:
+            List[T]: Inserted items, empty when returning is False
+        """
+        items = [self._prepare_insert(item) for item in items]
+        created_items = []
+        # Counters need the ids of the inserted rows, to count them with their defaults applied
+        load_items = returning or len(self._counter_services.get_counter_columns(self._model)) > 0
+        # Items are kept loaded after commit, instead of refreshing them one by one
+        with self._session(expire_on_commit=False) as session:
+            dialect = session.connection().dialect
+            use_returning = load_items and \
+                dialect.insert_executemany_returning_sort_by_parameter_order
+
+            for chunk in self._chunks(items, chunk_size):
+                if use_returning:
+                    created_items.extend(session.scalars(
+                        insert(self._model).returning(self._model, sort_by_parameter_order=True),
+                        [self._get_values(item) for item in chunk]
+                    ).all())
+                elif load_items:
+                    session.add_all(chunk)
+                    session.flush()
+                    created_items.extend(chunk)
+                else:
+                    session.execute(
+                        insert(self._model),
+                        [self._get_values(item) for item in chunk])
+            self._count_inserted(session, lambda: [item.id for item in created_items])
+            self._commit(session)
+        self._on_write()
+        return created_items if returning else []
+
+    def update_many(self, 
+                    partial_data:Dict[int, dict], 
+                    chunk_size:int = 1000):
+        """Updates items by id in executemany batches inside a single transaction
+
+        Args:
+            partial_data (Dict[int, dict]): Partial data to set, by item id
+            chunk_size (int, optional): Max number of rows per UPDATE batch
+        """
+        updated_at = datetime.utcnow()
+        values = [{**{key:value for key,value in data.items() if key not in ("id", "version")},
+                   "id":id,
+                   "updated_at":updated_at} 
+                  for id, data in partial_data.items()]
+
+        if issubclass(self._model, VersionedMixin):
+            # ORM bulk updates by primary key only set the given values, so versions are 
+            # incremented with a Core executemany UPDATE
+            table = self._model.__table__
+            statement = update(table) \
+                .where(table.c.id == bindparam("_id"), 
+                       self._model.get_not_deleted_filter()) \
+                .values(version=table.c.version + 1)
+            get_params = lambda chunk: [{**{key:value for key,value in values.items() if key != "id"}, 
+                                         "_id":values["id"]} 
+                                        for values in chunk]
+        else:
+            statement = update(self._model) \
+                .where(self._model.get_not_deleted_filter()) \
+                .execution_options(synchronize_session=None)
+            get_params = lambda chunk: chunk
+
+        with self._session() as session:
+            for chunk in self._chunks(values, chunk_size):
+                with self._counting(session, 
+                                    [values["id"] for values in chunk], 
+                                    set().union(*chunk)):
+                    session.execute(statement, get_params(chunk))
+                self._expire(session, [values["id"] for values in chunk])
+            self._commit(session)
+        self._on_write(list(partial_data.keys()))
+
+    def upsert(self, 
+               item:T, 
+               conflict_columns:List[str] = None,
+               update_columns:List[str] = None) -> T:
+        """Inserts an item, or updates the row that has the same conflict columns, 
+        with a single INSERT ... ON CONFLICT DO UPDATE statement
+
+        Args:
+            item (T): Item to insert or update
+            conflict_columns (List[str], optional): Columns of a unique constraint, see get_conflict_columns
+            update_columns (List[str], optional): Columns set on conflict, defaults to every 
+                column set on the item except the conflict columns, id and created_at
+
+        Returns:
+            T: Inserted or updated item
+        """
+        values = self._get_upsert_values(self._prepare_insert(item))
+        conflict_columns = conflict_columns if conflict_columns != None else self.get_conflict_columns()
+        with self._session(expire_on_commit=False) as session:
+            statement = self._upsert_statement(session, values.keys(), conflict_columns, update_columns)
+            with self._counting_upserts(session, conflict_columns, [values]) as upserted_ids:
+                upserted_item = session.execute(
+                    statement.values(**values).returning(self._model) \
+                        .execution_options(populate_existing=True)).scalar_one()
+                upserted_ids.append(upserted_item.id)
+            self._commit(session)
+        self._on_write([upserted_item.id])
+        return upserted_item
+
+    def upsert_many(self, 
+                    items:List[T], 
+                    conflict_columns:List[str] = None,
+                    update_columns:List[str] = None,
+                    chunk_size:int = 1000) -> UpsertResult:
+        """Inserts items, or updates the rows that have the same conflict columns, with one 
+        INSERT ... ON CONFLICT DO UPDATE per chunk, inside a single transaction
+
+        Args:
+            items (List[T]): Items to insert or update
+            conflict_columns (List[str], optional): Columns of a unique constraint, see get_conflict_columns
+            update_columns (List[str], optional): Columns set on conflict, defaults to every 
+                column set on the first item except the conflict columns, id and created_at
+            chunk_size (int, optional): Max number of rows per statement
+
+        Returns:
+            UpsertResult: Number of inserted and updated rows
+        """
+        result = UpsertResult(inserted=0, updated=0)
+        if len(items) == 0:
+            return result
+
+        values = [self._get_upsert_values(self._prepare_insert(item)) for item in items]
+        conflict_columns = conflict_columns if conflict_columns != None else self.get_conflict_columns()
+        upserted_ids = []
+        with self._session() as session:
+            statement = self._upsert_statement(session, values[0].keys(), conflict_columns, update_columns)
+            # updated_at is only set by the update, so it's NULL in the rows just inserted
+            statement = statement.returning(
+                self._model.id, 
+                (self._model.updated_at == None).label("inserted"))
+
+            for chunk in self._chunks(values, chunk_size):
+                with self._counting_upserts(session, conflict_columns, chunk) as chunk_ids:
+                    rows = session.execute(statement, chunk).all()
+                    chunk_ids.extend(row.id for row in rows)
+                inserted_count = sum(1 for row in rows if row.inserted)
+                result.inserted += inserted_count
+                result.updated += len(rows) - inserted_count
+                upserted_ids.extend(chunk_ids)
+                self._expire(session, chunk_ids)
+            self._commit(session)
+        self._on_write(upserted_ids)
+        return result
+
+    def get_conflict_columns(self) -> List[str]:
+        """Columns identifying the rows of upserts: the only unique constraint (or unique 
+        column) of the model, or the primary key if it has none
+
+        Raises:
+            ValueError: If the model has more than one unique constraint
+
+        Returns:
+            List[str]: Column names
+        """
+        table = self._model.__table__
+        # unique=True columns are declared as unique constraints too
+        unique_columns = {tuple(column.name for column in constraint.columns) 
+                          for constraint in table.constraints 
+                          if isinstance(constraint, UniqueConstraint)}
+        unique_columns |= {tuple(column.name for column in index.columns) 
+                           for index in table.indexes if index.unique}
+        if len(unique_columns) > 1:
+            raise ValueError(f"{self._model.__name__} has many unique constraints, conflict_columns must be given")
+        if len(unique_columns) == 1:
+            return list(unique_columns.pop())
+        return [column.name for column in table.primary_key.columns]
+
+    def delete_many(self, 
+                    ids:List[int], 
+                    soft_delete:bool = True,
+                    chunk_size:int = 1000) -> int:
+        """Deletes items by id with one set-based statement per chunk, inside a single transaction
+
+        Args:
+            ids (List[int]): Ids of the items to delete
+            soft_delete (bool, optional): Set deleted_at instead of removing the rows
+            chunk_size (int, optional): Max number of ids per statement
+
+        Returns:
+            int: Number of deleted items
+        """
+        deleted_count = 0
+        deleted_at = datetime.utcnow()
+        with self._session() as session:
+            for chunk in self._chunks(ids, chunk_size):
+                if soft_delete:
+                    statement = update(self._model) \
+                        .where(self._model.id.in_(chunk), 
+                               self._model.get_not_deleted_filter()) \
+                        .values(**self._model.get_soft_delete_values(deleted_at))
+                else:
+                    statement = delete(self._model) \
+                        .where(self._model.id.in_(chunk))
+
+                with self._counting(session, chunk):
+                    result = session.execute(statement)
+                deleted_count += result.rowcount
+            self._commit(session)
+        self._on_write(ids)
+        return deleted_count
+
+    def purge_deleted(self,
+                      older_than_days:int,
+                      chunk_size:int = 1000,
+                      archive_table:Table = None) -> int:
+        """Hard deletes the rows soft deleted more than older_than_days ago, optionally 
+        copying them into an archive table first (see BaseModel.get_archive_table). 
+        Rows are processed in chunks, each one in its own short transaction, so locks 
+        are never held for long. It doesn't join the active UnitOfWork
+
+        Args:
+            older_than_days (int): Minimum age of the deletion
+            chunk_size (int, optional): Max number of rows per transaction
+            archive_table (Table, optional): Table where the rows are copied before deleting them
+
+        Returns:
+            int: Number of purged rows
+        """
+        # Purged rows were already deleted, so counters don't change
+        cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+        table = self._model.__table__
+        purged_count = 0
+
+        while True:
+            with Session(self._db_services.get_engine()) as session:
+                ids = session.execute(
+                    select(self._model.id) \
+                        .where(self._model.deleted_at < cutoff) \
+                        .order_by(self._model.id) \
+                        .limit(chunk_size)).scalars().all()
+                if len(ids) == 0:
+                    break
+
+                if archive_table is not None:
+                    columns = [column.name for column in archive_table.columns 
+                               if column.name in table.columns]
+                    session.execute(
+                        insert(archive_table).from_select(
+                            columns,
+                            select(*[table.columns[column] for column in columns]) \
+                                .where(table.columns.id.in_(ids))))
+
+                session.execute(
+                    delete(table).where(table.columns.id.in_(ids)))
+                session.commit()
+            self._on_write(ids)
+
+            purged_count += len(ids)
+            if len(ids) < chunk_size:
+                break
+        return purged_count
+
+    def count(self, 
+            query = None,
+            include_deleted:bool = False,
+            approximate:bool = False) -> int:
+        """Counts the items matching the filters
+
+        Args:
+            query (List, optional): Filters
+            include_deleted (bool, optional): Include soft deleted items
+            approximate (bool, optional): Return the planner estimate when there is one, 
+                see estimate_count
+
+        Returns:
+            int: Number of items
+        """
+        if approximate:
+            return self.estimate_count(query, include_deleted)[0]
+
+        counter = self._get_counter(query) if include_deleted == False else None
+        if counter != None:
+            return self._read(
+                lambda session: self._counter_services.get_count(session, self._model, *counter))
+
+        statement = self._count_statement(query, include_deleted)
+        count_result = self._cached(
+            "count", statement, lambda session: session.execute(statement).scalar())
+        return count_result
+
+    def exists(self, 
+               query = None,
+               include_deleted:bool = False) -> bool:
+        """Checks if any item matches the filters, with an EXISTS that stops at the first 
+        matching row instead of counting or loading them
+
+        Args:
+            query (List, optional): Filters
+            include_deleted (bool, optional): Include soft deleted items
+
+        Returns:
+            bool: True if at least one item matches
+        """
+        query = query if query != None else []
+        statement = select(self._model.id) \
+            .where(*query)
+
+        if include_deleted == False:
+            statement = statement.where(self._model.get_not_deleted_filter())
+
+        statement = select(statement.exists())
+        return self._cached(
+            "exists", statement, lambda session: session.execute(statement).scalar())
+
+    def estimate_count(self, 
+            query = None,
+            include_deleted:bool = False) -> Tuple[int, bool]:
+        """Estimates the number of items from the planner statistics, without scanning the table. 
+        PostgreSQL estimates any filter through EXPLAIN, or reads pg_class.reltuples when there 
+        is none. SQLite only estimates unfiltered counts, from the sqlite_stat1 table filled by 
+        ANALYZE. When there is no estimate, or it's below the approximate count threshold, 
+        the items are counted exactly instead
+
+        Args:
+            query (List, optional): Filters
+            include_deleted (bool, optional): Include soft deleted items
+
+        Returns:
+            Tuple[int, bool]: Number of items, and whether it is an estimate
+        """
+        query = query if query != None else []
+        with self._session() as session:
+            estimate = self._get_planner_estimate(session, query, include_deleted)
+
+        if estimate == None or estimate < self._approximate_count_threshold:
+            return self.count(query, include_deleted), False
+        return estimate, True
+
+    def read_with_count(
+            self, 
+            query = None,
+            limit:int = None, 
+            offset:int = None,
+            include_deleted:bool = False,
+            fields:List[str] = None,
+            hydrate:bool = True,
+            options:List = None
+            ) -> Tuple[List[T] | List[Row], int]:
+        """Reads a page and the total number of items matching the filters
+        in a single statement, using COUNT(*) OVER ()
+
+        Args:
+            query (List, optional): Filters
+            limit (int, optional): Max number of items
+            offset (int, optional): Number of items to skip
+            include_deleted (bool, optional): Include soft deleted items
+            fields (List[str], optional): Columns to load, see get_column_names
+            hydrate (bool, optional): Return ORM instances. When False, Core rows are returned
+                instead, skipping the identity map and attribute instrumentation
+            options (List, optional): Relationship loader options (selectinload, joinedload, 
+                raiseload, noload...), replacing the defaults from get_loader_options
+
+        Returns:
+            Tuple[List[T] | List[Row], int]: Page items and total count
+        """
         query = query if query != None else []
+        statement = self._select(fields, hydrate, options) \
+            .where(*query)
+
+        if include_deleted == False:
+            statement = statement \
+                .where(self._model.get_not_deleted_filter())
+
+        statement = statement \
+            .order_by(self._model.id) \
+            .limit(limit) \
+            .offset(offset)
+
+        def execute(session:Session):
+            if not self._supports_window_functions(session.connection().dialect):
+                count = session.execute(
+                    self._count_statement(query, include_deleted)).scalar()
+                results = session.execute(statement)
+            else:
+                count = None
+                results = session.execute(
+                    statement.add_columns(func.count().over().label("total_count")))
+
+            rows = results.unique().all() if hydrate else results.all()
+            items = [row[0] for row in rows] if hydrate else rows
+
+            if count == None:
+                if len(rows) > 0:
+                    count = rows[0].total_count
+                elif offset:
+                    # Past the last page the window has no row to report the total on
+                    count = session.execute(
+                        self._count_statement(query, include_deleted)).scalar()
+                else:
+                    count = 0
+            return items, count
+
+        return self._cached(
+            "read_with_count" if hydrate else "read_with_count_rows", statement, execute)
+
+    def rebuild_counters(self):
+        """Recounts the counters declared in __counter_columns__, see CounterServices.rebuild"""
+        with self._session() as session:
+            self._counter_services.rebuild(session, self._model)
+            self._commit(session)
+
+    def get_model(self) -> Type[T]:
+        return self._model
+
+    def get_column_names(self) -> List[str]:
+        """Names of the model columns, which can be requested as fields"""
+        return [attribute.key for attribute in inspect(self._model).column_attrs]
+
+    def _get_projection(self, fields:List[str] = None) -> List:
+        """Loader options that only load the requested columns (plus id)"""
+        if not fields:
+            return []
+
+        self._validate_fields(fields)
+        return [load_only(*[getattr(self._model, field) for field in sorted({"id", *fields})])]
+
+    def _validate_fields(self, fields:List[str]):
+        """Raises:
+            ValueError: If a field isn't a column of the model
+        """
+        column_names = self.get_column_names()
+        unknown_fields = [field for field in fields if field not in column_names]
+        if unknown_fields:
+            raise ValueError(f'Unknown fields: {", ".join(unknown_fields)}')
+
+    def get_loader_options(self, options:List = None) -> List:
+        """Relationship loader options of read statements. Unless other options are given, 
+        collections are loaded with selectinload, so that they don't multiply the rows of 
+        the page (and the LIMIT) the way a join does
+
+        Args:
+            options (List, optional): Loader options replacing the defaults
+
+        Returns:
+            List: Loader options
+        """
+        if options is not None:
+            return options
+
+        if self._default_loader_options is None:
+            self._default_loader_options = [
+                selectinload(getattr(self._model, relationship.key))
+                for relationship in inspect(self._model).relationships
+                if relationship.uselist and relationship.lazy in ("select", "joined", "subquery")
+            ]
+        return self._default_loader_options
+
+    def _select(self, 
+                fields:List[str] = None, 
+                hydrate:bool = True,
+                options:List = None) -> Select:
+        """Base select of read statements, of ORM instances or of plain columns"""
+        if hydrate:
+            return select(self._model).options(
+                *self._get_projection(fields),
+                *self.get_loader_options(options))
+
+        column_names = self.get_column_names()
+        if fields:
+            self._validate_fields(fields)
+            column_names = [name for name in column_names if name == "id" or name in fields]
+        return select(*[getattr(self._model, name) for name in column_names])
+
+    def _count_statement(self, 
+                         query = None,
+                         include_deleted:bool = False):
+        query = query if query != None else []
+        def build_statement():
+            statement = select(func.count(self._model.id)) \
+                .where(*query)
+            
+            if include_deleted == False:
+                statement = statement.where(self._model.get_not_deleted_filter())
+            return statement
+
+        # Filters embed their values, only unfiltered counts can be reused
+        if len(query) > 0:
+            return build_statement()
+        return self._get_statement(("count", include_deleted), build_statement)
+
+    def _get_update_error(self, 
+                          session:Session, 
+                          id:int, 
+                          expected_version:int | List[int] = None) -> Exception:
+        """Tells why a conditional update matched no row"""
+        if expected_version != None:
+            current_version = session.execute(
+                select(self._model.version) \
+                    .where(self._model.id == id, 
+                           self._model.get_not_deleted_filter())).scalar()
+            if current_version != None:
+                if isinstance(expected_version, list):
+                    expected_version = ", ".join(str(version) for version in expected_version)
+                return StaleDataError(
+                    f"{self._model.__name__} {id} is at version {current_version}, not {expected_version}")
+        return NoResultFound()
+
+    def _get_upsert_values(self, item:T) -> dict:
+        # updated_at is only set when a row is updated, to tell them from inserted rows.
+        # Unset ids are left to the database
+        return {key:value for key, value in self._get_values(item).items() 
+                if key != "updated_at" and not (key in ("id", "version") and value == None)}
+
+    def _upsert_statement(self, 
+                          session:Session, 
+                          columns:Iterable[str],
+                          conflict_columns:List[str] = None,
+                          update_columns:List[str] = None):
+        dialect_name = session.connection().dialect.name
+        if dialect_name not in ("postgresql", "sqlite"):
+            raise NotImplementedError(f"Upserts aren't supported on {dialect_name}")
+
+        conflict_columns = conflict_columns if conflict_columns != None else self.get_conflict_columns()
+        update_columns = update_columns if update_columns != None else \
+            [column for column in columns 
+             if column not in ("id", "created_at", "version", *conflict_columns)]
+
+        statement = (postgresql.insert if dialect_name == "postgresql" else sqlite.insert)(self._model)
+        set_ = {**{column:statement.excluded[column] for column in update_columns},
+                "updated_at":datetime.utcnow()}
+        if issubclass(self._model, VersionedMixin):
+            set_["version"] = self._model.version + 1
+        return statement.on_conflict_do_update(index_elements=conflict_columns, set_=set_)
+
+    def _get_statement(self, 
+                       key:Hashable, 
+                       build:Callable[[], Executable]) -> Executable:
+        """Returns the statement built for a key on the first call. Reusing the same 
+        statement, with bindparam() for the values, skips building it and generating its 
+        cache key, which SQLAlchemy memoizes, on every call; compilation is then 
+        always served from the engine's compiled cache"""
+        statement = self._statements.get(key)
+        if statement is None:
+            statement = self._statements[key] = build()
+        return statement
+
+    def _prepare_insert(self, item:T) -> T:
+        """Called on every item before it's inserted, by create, create_many and upserts. 
+        Repositories override it to set derived values, e.g. hashing passwords"""
+        return item
+
+    @contextmanager
+    def _session(self, **kwargs) -> Iterator[Session]:
+        """Yields the session of the active UnitOfWork, or a new one for this call only"""
+        session = get_current_session()
+        if session is not None:
+            yield session
+            return
+
+        with Session(self._db_services.get_engine(), **kwargs) as session:
+            yield session
+
+    def _commit(self, session:Session):
+        """Commits the changes, unless the session belongs to a UnitOfWork, 
+        which commits once when it ends"""
+        if session is get_current_session():
+            session.flush()
+        else:
+            session.commit()
+
+    def _expire(self, session:Session, ids:List[int]):
+        """Expires cached instances after statements that can't synchronize the session"""
+        for id in ids:
+            item = session.identity_map.get(session.identity_key(self._model, id))
+            if item is not None:
+                session.expire(item)
+
+    @contextmanager
+    def _counting(self, 
+                  session:Session, 
+                  ids:List[int], 
+                  columns:Iterable[str] = None) -> Iterator[None]:
+        """Applies to the counter table the changes that the block makes to the rows of ids. 
+        It does nothing when the model has no counters, or when the written columns are 
+        neither counted nor soft delete columns"""
+        counter_columns = self._counter_services.get_counter_columns(self._model)
+        affected_columns = {*counter_columns, 
+                            *self._model.get_soft_delete_values(datetime.utcnow()).keys()}
+        if len(counter_columns) == 0 or \
+            (columns != None and affected_columns.isdisjoint(columns)):
+            yield
+            return
+
+        counts = self._counter_services.count_rows(session, self._model, ids, lock=True)
+        yield
+        changes = self._counter_services.count_rows(session, self._model, ids)
+        changes.subtract(counts)
+        self._counter_services.increment(session, self._model, changes)
+
+    def _count_inserted(self, session:Session, get_ids:Callable[[], List[int]]):
+        """Adds inserted rows to the counters. They are counted from the table after a flush, 
+        so that column defaults are applied"""
+        if len(self._counter_services.get_counter_columns(self._model)) == 0:
+            return
+
+        session.flush()
+        self._counter_services.increment(
+            session, 
+            self._model, 
+            self._counter_services.count_rows(session, self._model, get_ids()))
+
+    @contextmanager
+    def _counting_upserts(self, 
+                          session:Session, 
+                          conflict_columns:List[str], 
+                          values:List[dict]) -> Iterator[List[int]]:
+        """Like _counting, for upserts: the rows they may update are found by their conflict 
+        columns before the block, which adds the ids it upserted to the yielded list"""
+        upserted_ids = []
+        if len(self._counter_services.get_counter_columns(self._model)) == 0:
+            yield upserted_ids
+            return
+
+        keys = [tuple(item.get(column) for column in conflict_columns) for item in values]
+        existing_ids = session.execute(
+            select(self._model.id) \
+                .where(tuple_(*[getattr(self._model, column) for column in conflict_columns]).in_(keys)) \
+                .with_for_update()
+        ).scalars().all()
+        counts = self._counter_services.count_rows(session, self._model, existing_ids)
+        yield upserted_ids
+        changes = self._counter_services.count_rows(session, self._model, upserted_ids)
+        changes.subtract(counts)
+        self._counter_services.increment(session, self._model, changes)
+
+    def _get_counter(self, query:List = None) -> Tuple[str, Any] | None:
+        """Returns (column_name, value) when the query is a single equality 
+        on a column of __counter_columns__"""
+        if query == None or len(query) != 1:
+            return None
+
+        expression = query[0]
+        if not isinstance(expression, BinaryExpression) or \
+            expression.operator is not operators.eq or \
+            not isinstance(expression.left, Column) or \
+            not isinstance(expression.right, BindParameter) or \
+            expression.left.table is not self._model.__table__ or \
+            expression.left.name not in self._counter_services.get_counter_columns(self._model):
+            return None
+        return expression.left.name, expression.right.value
+
+    def _cached(self, 
+                name:str, 
+                statement:Select, 
+                execute:Callable[[Session], Any]) -> Any:
+        """Executes a read (see _read) through the query cache. Loader options are part of 
+        the statement cache key, so each of them is cached apart. Reads inside a UnitOfWork 
+        can see its uncommitted changes and aren't cached"""
+        if self._query_cache == None or get_current_session() is not None:
+            return self._read(execute)
+        return self._query_cache.get_or_compute(
+            self._model, name, statement, lambda: self._read(execute, primary=True))
+
+    def _read(self, 
+              execute:Callable[[Session], Any], 
+              primary:bool = False) -> Any:
+        """Executes a read in the session of the active UnitOfWork, or in a new session 
+        bound to the read engine (see DbServices.get_read_engine). When the connection to 
+        a replica is lost, it's ejected and the read is retried on the primary. Other errors, 
+        e.g. a failing query, are raised as is
+
+        Args:
+            execute (Callable[[Session], Any]): Read
+            primary (bool, optional): Read from the primary even if there are replicas, 
+                for results that are cached: a lagging replica could return rows older 
+                than the last invalidation, that would then be served for the whole ttl
+        """
+        session = get_current_session()
+        if session is not None:
+            return execute(session)
+
+        engine = self._db_services.get_engine() if primary else self._db_services.get_read_engine()
+        try:
+            with Session(engine) as session:
+                return execute(session)
+        except OperationalError as error:
+            if not error.connection_invalidated or not self._db_services.eject_replica(engine):
+                raise
+
         with Session(self._db_services.get_engine()) as session:
+            return execute(session)
+
+    def _on_write(self, ids:List[int] = None):
+        """Called after items are written, drops them from the entity cache and bumps the 
+        model version of the query cache. Inside a UnitOfWork it's repeated after the commit, 
+        since reads made before it could have cached the previous state. Reads that follow 
+        are pinned to the primary, which replicas may not have caught up with yet"""
+        pin_primary()
+        self._invalidate(ids)
+
+        session = get_current_session()
+        if session is not None:
+            event.listen(session, "after_commit", lambda session: self._invalidate(ids), once=True)
+
+    def _invalidate(self, ids:List[int] = None):
+        if self._entity_cache != None and ids != None:
+            self._entity_cache.invalidate(self._model, ids)
+        if self._query_cache != None:
+            self._query_cache.bump_version(self._model)
+
+    def _get_values(self, item:T) -> dict:
+        """Column values that were set on an item, as expected by Core insert()"""
+        state = inspect(item)
+        return {attribute.key:state.dict[attribute.key] 
+                for attribute in state.mapper.column_attrs 
+                if attribute.key in state.dict}
+
+    def _chunks(self, items:List, chunk_size:int) -> Iterator[List]:
+        for index in range(0, len(items), chunk_size):
+            yield items[index:index + chunk_size]
+
+    def _get_planner_estimate(self, 
+                              session:Session, 
+                              query:List, 
+                              include_deleted:bool) -> int | None:
+        connection = session.connection()
+        dialect = connection.dialect
+        table_name = self._model.__table__.fullname
+
+        if dialect.name == "postgresql":
+            if len(query) == 0 and include_deleted:
+                reltuples = session.execute(
+                    text("SELECT reltuples FROM pg_class WHERE oid = to_regclass(:table_name)"),
+                    {"table_name":table_name}).scalar()
+                # reltuples is -1 (or 0 before PostgreSQL 14) until the table is analyzed
+                return int(reltuples) if reltuples != None and reltuples > 0 else None
+
+            statement = select(self._model.id).where(*query)
+            if include_deleted == False:
+                statement = statement \
+                    .where(self._model.get_not_deleted_filter())
+
+            compiled = statement.compile(
+                dialect=dialect, 
+                compile_kwargs={"render_postcompile": True})
+            parameters = tuple(compiled.params[name] for name in compiled.positiontup) \
+                if compiled.positional else compiled.params
+            plan = connection.exec_driver_sql(
+                f"EXPLAIN (FORMAT JSON) {compiled}", parameters).scalar()
+            plan = json.loads(plan) if isinstance(plan, str) else plan
+            return int(plan[0]["Plan"]["Plan Rows"])
+
+        if dialect.name == "sqlite" and len(query) == 0:
+            if not dialect.has_table(connection, "sqlite_stat1"):
+                return None
+
+            stats = session.execute(
+                text("SELECT idx, stat FROM sqlite_stat1 WHERE tbl = :table_name"),
+                {"table_name":table_name}).all()
+            # The first number of a stat is the number of rows in the index, or in the table 
+            # when idx is NULL. The partial index over live rows counts the items not deleted
+            rows = {index:int(stat.split()[0]) for index, stat in stats}
+            live_index = f'ix_{table_name}_live_id'
+            if include_deleted == False:
+                return rows.get(live_index)
+            return max([count for index, count in rows.items() if index != live_index], 
+                       default=None)
+
+        return None
+
+    def _supports_window_functions(self, dialect) -> bool:
+        if dialect.name == "sqlite":
+            return dialect.dbapi.sqlite_version_info >= (3, 25)
+        if dialect.name in ("mysql", "mariadb"):
+            minimum_version = (10, 2) if dialect.is_mariadb else (8,)
+            return dialect.server_version_info >= minimum_version
+        return True
+
+
+class AsyncBaseRepository(ABC, Generic[T]):
+    """Async counterpart of BaseRepository, runs on AsyncEngine/AsyncSession
+    so that route handlers don't block a threadpool worker while waiting for
+    the database. Writes keep counters in sync and invalidate the caches like 
+    BaseRepository does, so caches shared with sync repositories must be given to both.
+    """
+    _db_services:DbServices
+    _model: Type[T]
+    _entity_cache:EntityCacheServices = None
+    _query_cache:QueryCacheServices = None
+    _counter_services:CounterServices
+    _default_loader_options:List = None
+
+    def __init__(self,
+                 model:Type[T],
+                 db_services:DbServices = None,
+                 entity_cache:EntityCacheServices = None,
+                 query_cache:QueryCacheServices = None) -> None:
+        self._db_services = DbServices() if db_services == None else db_services
+        self._model = model
+        self._counter_services = CounterServices()
+        if entity_cache != None:
+            self._entity_cache = entity_cache
+        if query_cache != None:
+            self._query_cache = query_cache
+
+    async def create(self, item:T) -> T:
+        async with AsyncSession(self._db_services.get_async_engine()) as session:
+            session.add(item)
+            await session.flush()
+            await self._increment_counters(session, await self._count_rows(session, [item.id]))
+            await session.commit()
+            await session.refresh(item)
+        self._on_write([item.id])
+        return item
+
+    async def read(
+            self,
+            query = None,
+            limit:int = None,
+            offset:int = None,
+            include_deleted:bool = False,
+            options:List = None
+            ) -> List[T]:
+        query = query if query != None else []
+        async with AsyncSession(self._db_services.get_async_engine()) as session:
             statement = select(self._model) \
+                .options(*self.get_loader_options(options)) \
                 .where(*query)
 
             if include_deleted == False:
                 statement = statement \
-                    .where(self._model.deleted_at == None)
+                    .where(self._model.get_not_deleted_filter())
 
             statement = statement \
+                .order_by(self._model.id) \
                 .limit(limit) \
                 .offset(offset)
 
-            results = session.execute(statement)
-            items = results.scalars().all()
+            results = await session.execute(statement)
+            # unique() is required when a collection is joined eagerly
+            items = results.unique().scalars().all()
         return items
-    
-    def readById(
+
+    async def readById(
             self,
             id:int,
-            include_deleted:bool = False
+            include_deleted:bool = False,
+            options:List = None
             ) -> T:
-        with Session(self._db_services.get_engine()) as session:
+        async with AsyncSession(self._db_services.get_async_engine()) as session:
             statement = select(self._model) \
+                        .options(*self.get_loader_options(options)) \
                         .where(self._model.id == id)
 
             if include_deleted == False:
                 statement = statement \
-                    .where(self._model.deleted_at == None)
-                        
-            results = session.execute(statement)
-            item = results.scalar_one_or_none()
+                    .where(self._model.get_not_deleted_filter())
+
+            results = await session.execute(statement)
+            item = results.unique().scalar_one_or_none()
         return item
-    
-    def updateById(self,partial_data:dict, id:int):
-        with Session(self._db_services.get_engine()) as session:            
+
+    async def updateById(self,partial_data:dict, id:int):
+        async with AsyncSession(self._db_services.get_async_engine()) as session:
+            counts = await self._count_rows(session, [id], lock=True)
             statement = select(self._model).where(self._model.id == id)
-            item = session.execute(statement).scalar_one()
+            item = (await session.execute(statement)).scalar_one()
             item.updated_at = datetime.utcnow()
-            
+
             for key in partial_data:
                 value = partial_data[key]
                 if key == "id" : continue
                 setattr(item, key, value)
 
             session.add(item)
-            session.commit()
-            session.refresh(item)
-        
+            await session.flush()
+            await self._increment_counters(session, await self._count_rows(session, [id]), counts)
+            await session.commit()
+            await session.refresh(item)
+        self._on_write([id])
         return item
 
-    def deleteById(self, id:int, soft_delete:bool = True):
-        with Session(self._db_services.get_engine()) as session:
+    async def deleteById(self, id:int, soft_delete:bool = True):
+        async with AsyncSession(self._db_services.get_async_engine()) as session:
+            counts = await self._count_rows(session, [id], lock=True)
             statement = select(self._model).where(self._model.id == id)
-            item = session.execute(statement).scalar_one()
-            
+            item = (await session.execute(statement)).scalar_one()
+
             if soft_delete:
                 item.deleted_at = datetime.utcnow()
                 session.add(item)
             else:
-                session.delete(item)
-            session.commit()
+                await session.delete(item)
+            await session.flush()
+            await self._increment_counters(session, await self._count_rows(session, [id]), counts)
+            await session.commit()
+        self._on_write([id])
 
-    def count(self, 
+    async def count(self,
             query = None,
             include_deleted:bool = False) -> int:
         query = query if query != None else []
-        with Session(self._db_services.get_engine()) as session:
-            query = session\
-                .query(func.count(self._model.id))\
+        async with AsyncSession(self._db_services.get_async_engine()) as session:
+            statement = select(func.count(self._model.id))\
                 .where(*query)
-            
+
             if include_deleted == False:
-                query = query.where(self._model.deleted_at == None)
-            
-            count_result = query.scalar()
+                statement = statement.where(self._model.get_not_deleted_filter())
+
+            count_result = (await session.execute(statement)).scalar()
         return count_result
-        
+
+    async def exists(self,
+            query = None,
+            include_deleted:bool = False) -> bool:
+        query = query if query != None else []
+        async with AsyncSession(self._db_services.get_async_engine()) as session:
+            statement = select(self._model.id)\
+                .where(*query)
+
+            if include_deleted == False:
+                statement = statement.where(self._model.get_not_deleted_filter())
+
+            exists_result = (await session.execute(select(statement.exists()))).scalar()
+        return exists_result
+
+    def get_loader_options(self, options:List = None) -> List:
+        """Relationship loader options of read statements, see BaseRepository.get_loader_options. 
+        Lazy loads can't run once the async session is closed, so collections are loaded eagerly"""
+        return BaseRepository.get_loader_options(self, options)
+
+    async def _count_rows(self, 
+                          session:AsyncSession, 
+                          ids:List[int], 
+                          lock:bool = False) -> Counter:
+        """See CounterServices.count_rows, empty when the model has no counters"""
+        if len(self._counter_services.get_counter_columns(self._model)) == 0:
+            return Counter()
+        return await session.run_sync(
+            lambda sync_session: self._counter_services.count_rows(sync_session, self._model, ids, lock))
+
+    async def _increment_counters(self, 
+                                  session:AsyncSession, 
+                                  counts:Counter, 
+                                  previous_counts:Counter = None):
+        """Adds the counts of the written rows to the counters, minus their counts before the write"""
+        if previous_counts != None:
+            counts.subtract(previous_counts)
+        if len(counts) > 0:
+            await session.run_sync(
+                lambda sync_session: self._counter_services.increment(sync_session, self._model, counts))
+
+    def _on_write(self, ids:List[int]):
+        """See BaseRepository._on_write"""
+        pin_primary()
+        if self._entity_cache != None:
+            self._entity_cache.invalidate(self._model, ids)
+        if self._query_cache != None:
+            self._query_cache.bump_version(self._model)
@@ -1,14 +1,309 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from itertools import count
+from typing import Any, Callable, Coroutine, Dict, Iterator, List, Optional
+from starlette.concurrency import run_in_threadpool
+from fastapi import Request, Response
+from fastapi.routing import APIRoute
 from sqlalchemy import create_engine
 from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
 from ..singleton.models import SingletonMeta
+from ..instrumentation.services import instrumentation_services
 import os
+import time
+
+_primary_pinned_until:ContextVar[float] = ContextVar("ez_rest_primary_pinned_until", default=0)
+
+def pin_primary(seconds:float = None):
+    """Routes the reads of the current context to the primary for a while, so they see 
+    its writes even if replicas lag behind. Repositories call it after every write
+    | .env variables:
+    | DB_READ_YOUR_WRITES_SECONDS (5 by default)
+
+    Args:
+        seconds (float, optional): Length of the window, defaults to DB_READ_YOUR_WRITES_SECONDS
+    """
+    seconds = seconds if seconds != None else float(os.getenv("DB_READ_YOUR_WRITES_SECONDS", 5))
+    _primary_pinned_until.set(max(_primary_pinned_until.get(), time.monotonic() + seconds))
 
 class DbServices(metaclass=SingletonMeta):
     _engine:Engine = None
+    _async_engine:AsyncEngine = None
+    _replica_engines:List[Engine] = None
+    _replica_ejected_until:Dict[Engine, float] = None
+    _replica_counter:Iterator[int] = None
 
     def get_engine(self) -> Engine:
+        """Returns the engine of the primary database
+        | .env variables:
+        | DB_CONNECTION_STRING
+        | DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_RECYCLE, DB_POOL_TIMEOUT, DB_POOL_PRE_PING 
+        | (driver defaults when not set, they apply to every engine)
+        | DEBUG (echo the statements, 0 by default)
+
+        Returns:
+            Engine: Primary engine
+        """
         if self._engine == None:
             self._engine = create_engine(
-                os.getenv('DB_CONNECTION_STRING'), echo=bool(int(os.getenv("DEBUG",1)))
+                os.getenv('DB_CONNECTION_STRING'), **self._get_engine_options()
+            )
+            instrumentation_services.instrument(self._engine)
+        return self._engine
+
+    def get_async_engine(self) -> AsyncEngine:
+        """Returns the engine used by async repositories
+        | .env variables:
+        | DB_ASYNC_CONNECTION_STRING (falls back to DB_CONNECTION_STRING)
+
+        Returns:
+            AsyncEngine: Engine bound to an async driver (asyncpg, aiosqlite, etc)
+        """
+        if self._async_engine == None:
+            self._async_engine = create_async_engine(
+                os.getenv('DB_ASYNC_CONNECTION_STRING', os.getenv('DB_CONNECTION_STRING')),
+                **self._get_engine_options()
             )
-        return self._engine
\ No newline at end of file
+            instrumentation_services.instrument(self._async_engine.sync_engine)
+        return self._async_engine
+
+    def get_replica_engines(self) -> List[Engine]:
+        """Returns the engines of the read replicas
+        | .env variables:
+        | DB_REPLICA_CONNECTION_STRINGS (comma separated, none by default)
+
+        Returns:
+            List[Engine]: Replica engines
+        """
+        if self._replica_engines == None:
+            urls = [url.strip() for url in os.getenv('DB_REPLICA_CONNECTION_STRINGS', '').split(',') 
+                    if url.strip() != '']
+            self._replica_engines = [
+                create_engine(url, **self._get_engine_options(pool_pre_ping=True)) 
+                for url in urls]
+            for engine in self._replica_engines:
+                instrumentation_services.instrument(engine)
+            self._replica_ejected_until = {}
+            self._replica_counter = count()
+        return self._replica_engines
+
+    def get_read_engine(self) -> Engine:
+        """Returns the engine for reads: one of the healthy replicas, or the primary 
+        when there are none or the current context wrote recently (see pin_primary)
+        | .env variables:
+        | DB_REPLICA_STRATEGY (round_robin by default, or least_connections)
+
+        Returns:
+            Engine: Replica or primary engine
+        """
+        replicas = self.get_replica_engines()
+        now = time.monotonic()
+        if len(replicas) == 0 or _primary_pinned_until.get() > now:
+            return self.get_engine()
+
+        healthy_replicas = [replica for replica in replicas 
+                            if self._replica_ejected_until.get(replica, 0) <= now]
+        if len(healthy_replicas) == 0:
+            return self.get_engine()
+
+        if os.getenv('DB_REPLICA_STRATEGY', 'round_robin') == 'least_connections':
+            # Pools that don't keep connections, like NullPool, can't tell how many are in use
+            return min(healthy_replicas, 
+                       key=lambda replica: getattr(replica.pool, "checkedout", lambda: 0)())
+        return healthy_replicas[next(self._replica_counter) % len(healthy_replicas)]
+
+    def eject_replica(self, engine:Engine) -> bool:
+        """Stops routing reads to a replica that failed, until it's retried
+        | .env variables:
+        | DB_REPLICA_EJECT_SECONDS (30 by default)
+
+        Args:
+            engine (Engine): Engine returned by get_read_engine
+
+        Returns:
+            bool: False if the engine isn't a replica
+        """
+        if engine not in self.get_replica_engines():
+            return False
+
+        self._replica_ejected_until[engine] = time.monotonic() + \
+            float(os.getenv('DB_REPLICA_EJECT_SECONDS', 30))
+        return True
+
+    def warmup(self, connections:int = None) -> int:
+        """Opens pooled connections to the primary and the replicas up front, so the first 
+        requests don't pay the connect latency. Call it in each worker process, e.g. on 
+        startup, since pools are replaced after a fork
+
+        Args:
+            connections (int, optional): Connections per engine, defaults to the pool size. 
+                It shouldn't exceed pool size + max overflow, or it waits for the pool timeout
+
+        Returns:
+            int: Number of connections opened
+        """
+        opened_count = 0
+        for engine in [self.get_engine(), *self.get_replica_engines()]:
+            # Pools without a size, like StaticPool, hold a single connection
+            size = connections if connections != None else getattr(engine.pool, "size", lambda: 1)()
+            opened_connections = []
+            try:
+                for _ in range(size):
+                    opened_connections.append(engine.connect())
+            finally:
+                for connection in opened_connections:
+                    connection.close()
+            opened_count += len(opened_connections)
+        return opened_count
+
+    def dispose(self, close:bool = True):
+        """Replaces the connection pools of every engine
+
+        Args:
+            close (bool, optional): Close the pooled connections. After a fork they belong 
+                to the parent process, so the child must drop them without closing them
+        """
+        engines = [self._engine, *(self._replica_engines or [])]
+        if self._async_engine != None:
+            engines.append(self._async_engine.sync_engine)
+
+        for engine in engines:
+            if engine != None:
+                engine.dispose(close=close)
+
+    def _get_engine_options(self, **defaults) -> dict:
+        # Echoing every statement is slow, statements are timed by the instrumentation services instead
+        options = {"echo":bool(int(os.getenv("DEBUG",0))), **defaults}
+        for variable, option, parse in [("DB_POOL_SIZE", "pool_size", int),
+                                        ("DB_MAX_OVERFLOW", "max_overflow", int),
+                                        ("DB_POOL_RECYCLE", "pool_recycle", int),
+                                        ("DB_POOL_TIMEOUT", "pool_timeout", float),
+                                        ("DB_POOL_PRE_PING", "pool_pre_ping", lambda value: bool(int(value)))]:
+            value = os.getenv(variable)
+            if value != None:
+                options[option] = parse(value)
+        return options
+
+def _dispose_after_fork():
+    # Engines inherited through the singleton would share sockets with the parent process
+    db_services = SingletonMeta._instances.get(DbServices)
+    if db_services is not None:
+        db_services.dispose(close=False)
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_dispose_after_fork)
+
+
+_current_session:ContextVar[Optional[Session]] = ContextVar("ez_rest_current_session", default=None)
+
+def get_current_session() -> Optional[Session]:
+    """Returns the session of the active unit of work, if any"""
+    return _current_session.get()
+
+@contextmanager
+def without_unit_of_work() -> Iterator[None]:
+    """Runs repository calls in their own sessions even inside a UnitOfWork, e.g. to read 
+    committed rows that are cached beyond the unit of work"""
+    token = _current_session.set(None)
+    try:
+        yield
+    finally:
+        _current_session.reset(token)
+
+class UnitOfWork():
+    """Shares a single Session (one connection, one transaction, one identity map) 
+    with every repository call made inside it. Repositories flush instead of 
+    committing, and the transaction is committed when the block exits, or rolled 
+    back if it raises. Nested units of work join the outer one.
+
+    Usage:
+        with UnitOfWork():
+            user = users_repository.readById(1)
+            products_repository.create(product)
+    """
+    _db_services:DbServices
+    _session:Session = None
+    _token = None
+
+    def __init__(self, db_services:DbServices = None) -> None:
+        self._db_services = DbServices() if db_services == None else db_services
+
+    def __enter__(self) -> Session:
+        current_session = get_current_session()
+        if current_session is not None:
+            return current_session
+
+        self._session = Session(self._db_services.get_engine(), expire_on_commit=False)
+        self._token = _current_session.set(self._session)
+        return self._session
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        try:
+            self._close(exc_type is None)
+        finally:
+            self._reset()
+
+    def _close(self, commit:bool):
+        if self._session is None:
+            return
+
+        try:
+            if commit:
+                self._session.commit()
+            else:
+                self._session.rollback()
+        finally:
+            self._session.close()
+
+    def _reset(self):
+        if self._token is not None:
+            _current_session.reset(self._token)
+        self._session = self._token = None
+
+class UnitOfWorkRoute(APIRoute):
+    """Route class wrapping each request in a UnitOfWork, committed before the response is 
+    sent, so a failed commit returns a 500 instead of a success whose writes were lost. 
+    The bodies of streaming responses are sent after the commit
+
+    Usage:
+        router = APIRouter(route_class=UnitOfWorkRoute)
+    """
+    def get_route_handler(self) -> Callable[[Request], Coroutine[Any, Any, Response]]:
+        handler = super().get_route_handler()
+
+        async def handle(request:Request) -> Response:
+            # Sync endpoints and dependencies run in the threadpool, in a copy of this context
+            unit = UnitOfWork()
+            unit.__enter__()
+            try:
+                response = await handler(request)
+            except BaseException:
+                await run_in_threadpool(unit._close, False)
+                raise
+            else:
+                await run_in_threadpool(unit._close, True)
+            finally:
+                unit._reset()
+            return response
+        return handle
+
+async def unit_of_work() -> Session:
+    """FastAPI dependency returning the session of the request's unit of work, 
+    for routes of a UnitOfWorkRoute router. Cleanup of dependencies with yield runs 
+    after the response is sent, too late to report a failed commit
+
+    Usage:
+        router = APIRouter(route_class=UnitOfWorkRoute)
+
+        @router.post("/orders")
+        def create_order(session:Session = Depends(unit_of_work)): ...
+
+    Raises:
+        RuntimeError: If the route isn't a UnitOfWorkRoute
+    """
+    session = get_current_session()
+    if session is None:
+        raise RuntimeError("unit_of_work requires routes with route_class=UnitOfWorkRoute")
+    return session
@@ -0,0 +1,16 @@
+from typing import List
+from pydantic import BaseModel as PydanticModel
+
+class ImportRowError(PydanticModel):
+    # Line of the file where the row starts
+    line:int
+    message:str
+
+class ImportProgress(PydanticModel):
+    processed:int
+    inserted:int
+    failed:int
+
+class ImportResult(ImportProgress):
+    # Only the first max_errors errors are kept, failed counts all of them
+    errors:List[ImportRowError]
@@ -0,0 +1,115 @@
+from typing import Callable, Iterator, List, TextIO, Tuple, Type
+from pydantic import BaseModel as PydanticModel, ValidationError
+from sqlalchemy.exc import SQLAlchemyError
+from ..crud.repository import BaseRepository
+from ..mapper.services import mapper_services as mapper, MapperServices
+from .models import ImportProgress, ImportResult, ImportRowError
+import csv
+import json
+
+class ImportServices():
+    """Imports CSV or NDJSON files through a repository: rows are read lazily, validated 
+    into the input DTO, mapped to the model with the mapper registration and inserted in 
+    chunks with BaseRepository.create_many, so memory is bounded by the chunk size. 
+    Invalid rows are collected as errors instead of aborting the import"""
+    _mapper_services:MapperServices
+
+    def __init__(self, mapper_services:MapperServices = None) -> None:
+        self._mapper_services = mapper if mapper_services is None else mapper_services
+
+    def import_file(self,
+                    file:str | TextIO,
+                    repository:BaseRepository,
+                    type_in:Type[PydanticModel],
+                    format:str = "csv",
+                    chunk_size:int = 1000,
+                    progress:Callable[[ImportProgress], None] = None,
+                    max_errors:int = 1000) -> ImportResult:
+        """Imports a file. Each chunk is inserted in its own transaction; when it fails, its 
+        rows are inserted one by one to find the failing ones. It must not run inside a 
+        UnitOfWork, whose transaction can't recover from a failed chunk
+
+        Args:
+            file (str | TextIO): Path or text file
+            repository (BaseRepository): Repository of the model the rows are inserted into
+            type_in (Type[PydanticModel]): Input DTO, mapped to the repository model
+            format (str, optional): csv (with a header row) or ndjson
+            chunk_size (int, optional): Rows per transaction
+            progress (Callable[[ImportProgress], None], optional): Called after each chunk
+            max_errors (int, optional): Max number of errors kept in the result
+
+        Raises:
+            ValueError: If the format isn't supported
+
+        Returns:
+            ImportResult: Number of processed, inserted and failed rows, and the errors
+        """
+        if format not in ("csv", "ndjson"):
+            raise ValueError(f"Unsupported import format: {format}")
+        
+        if isinstance(file, str):
+            with open(file, newline="") as opened_file:
+                return self.import_file(
+                    opened_file, repository, type_in, format, chunk_size, progress, max_errors)
+
+        result = ImportResult(processed=0, inserted=0, failed=0, errors=[])
+        def add_error(line:int, message:str):
+            result.failed += 1
+            if len(result.errors) < max_errors:
+                result.errors.append(ImportRowError(line=line, message=message))
+
+        chunk:List[Tuple[int, object]] = []
+        def insert_chunk():
+            try:
+                repository.create_many([item for _, item in chunk], returning=False)
+                result.inserted += len(chunk)
+            except SQLAlchemyError:
+                for line, item in chunk:
+                    try:
+                        repository.create_many([item], returning=False)
+                        result.inserted += 1
+                    except SQLAlchemyError as exception:
+                        add_error(line, str(exception))
+            chunk.clear()
+            if progress != None:
+                progress(ImportProgress(
+                    processed=result.processed, 
+                    inserted=result.inserted, 
+                    failed=result.failed))
+
+        rows = self._read_csv(file) if format == "csv" else self._read_ndjson(file)
+        parse_row = self._parse_csv_row if format == "csv" else json.loads
+        for line, row in rows:
+            result.processed += 1
+            try:
+                item = self._mapper_services.map(
+                    type_in.parse_obj(parse_row(row)), 
+                    repository.get_model())
+            # Also covers invalid JSON
+            except (ValidationError, ValueError) as exception:
+                add_error(line, str(exception))
+                continue
+
+            chunk.append((line, item))
+            if len(chunk) == chunk_size:
+                insert_chunk()
+
+        if len(chunk) > 0:
+            insert_chunk()
+        return result
+
+    def _read_csv(self, file:TextIO) -> Iterator[Tuple[int, dict]]:
+        reader = csv.DictReader(file)
+        line = reader.line_num + 1
+        for row in reader:
+            yield line, row
+            line = reader.line_num + 1
+
+    def _parse_csv_row(self, row:dict) -> dict:
+        # Empty cells are missing values, so they validate as optional fields
+        return {key:value for key, value in row.items() if value != ""}
+
+    def _read_ndjson(self, file:TextIO) -> Iterator[Tuple[int, str]]:
+        for line, text in enumerate(file, 1):
+            if text.strip() != "":
+                yield line, text
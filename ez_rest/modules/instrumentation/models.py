@@ -0,0 +1,19 @@
+from collections import Counter
+from typing import List
+
+class QueryStats():
+    """Statements executed in a tracked context, see InstrumentationServices.track"""
+    query_count:int
+    # Seconds
+    total_duration:float
+    slow_query_count:int
+    statement_counts:Counter
+    # Statements repeated more times than the N+1 threshold
+    n_plus_one_statements:List[str]
+
+    def __init__(self) -> None:
+        self.query_count = 0
+        self.total_duration = 0
+        self.slow_query_count = 0
+        self.statement_counts = Counter()
+        self.n_plus_one_statements = []
@@ -0,0 +1,131 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from .models import QueryStats
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger("ez_rest.sql")
+
+_current_stats:ContextVar[Optional[QueryStats]] = ContextVar("ez_rest_query_stats", default=None)
+
+class InstrumentationServices():
+    """Times every statement of the instrumented engines. Statements slower than the 
+    threshold are logged as JSON to the ez_rest.sql logger, and inside track() the 
+    statements are counted, warning about the ones repeated like N+1 queries
+    | .env variables:
+    | DB_SLOW_QUERY_MS (500 by default)
+    | DB_N_PLUS_ONE_THRESHOLD (10 by default)
+    """
+    _slow_query_seconds:float
+    _n_plus_one_threshold:int
+
+    def instrument(self, engine:Engine):
+        """Registers the event hooks on an engine, once"""
+        self._slow_query_seconds = float(os.getenv("DB_SLOW_QUERY_MS", 500)) / 1000
+        self._n_plus_one_threshold = int(os.getenv("DB_N_PLUS_ONE_THRESHOLD", 10))
+        if not event.contains(engine, "before_cursor_execute", self._before_cursor_execute):
+            event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+            event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+            event.listen(engine, "handle_error", self._handle_error)
+
+    @contextmanager
+    def track(self) -> Iterator[QueryStats]:
+        """Counts the statements executed in the current context, and the contexts copied 
+        from it, like the threadpool running sync endpoints
+
+        Usage:
+            with instrumentation_services.track() as stats:
+                users_repository.read()
+            print(stats.query_count)
+        """
+        stats = QueryStats()
+        token = _current_stats.set(stats)
+        try:
+            yield stats
+        finally:
+            _current_stats.reset(token)
+
+    def get_stats(self) -> QueryStats | None:
+        """Returns the stats of the active track(), if any"""
+        return _current_stats.get()
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("ez_rest_started_at", []).append(time.perf_counter())
+
+    def _handle_error(self, exception_context):
+        # after_cursor_execute doesn't run for statements that raise, their start time would 
+        # stay in the info of the pooled connection
+        connection = exception_context.connection
+        if connection is not None and exception_context.execution_context is not None:
+            started_at = connection.info.get("ez_rest_started_at")
+            if started_at:
+                started_at.pop()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - conn.info["ez_rest_started_at"].pop()
+        stats = _current_stats.get()
+        is_slow = duration >= self._slow_query_seconds
+
+        if is_slow:
+            logger.warning(json.dumps({
+                "event":"slow_query",
+                "duration_ms":round(duration * 1000, 3),
+                "statement":statement
+            }))
+
+        if stats is None:
+            return
+
+        stats.query_count += 1
+        stats.total_duration += duration
+        stats.slow_query_count += int(is_slow)
+        # Statements are parameterized, so the same query with other values has the same text
+        stats.statement_counts[statement] += 1
+        if stats.statement_counts[statement] == self._n_plus_one_threshold + 1:
+            stats.n_plus_one_statements.append(statement)
+            logger.warning(json.dumps({
+                "event":"n_plus_one",
+                "count":stats.statement_counts[statement],
+                "statement":statement
+            }))
+
+class QueryStatsMiddleware():
+    """ASGI middleware tracking the statements of each request (see 
+    InstrumentationServices.track). When expose_headers is set, which defaults to 
+    the DEBUG variable, the totals are added to the response headers:
+    X-DB-Query-Count, X-DB-Query-Time-Ms and X-DB-N-Plus-One
+
+    Usage:
+        app.add_middleware(QueryStatsMiddleware)
+    """
+    def __init__(self, 
+                 app:ASGIApp, 
+                 expose_headers:bool = None) -> None:
+        self._app = app
+        self._expose_headers = bool(int(os.getenv("DEBUG",0))) \
+            if expose_headers == None else expose_headers
+
+    async def __call__(self, scope:Scope, receive:Receive, send:Send):
+        if scope["type"] != "http":
+            await self._app(scope, receive, send)
+            return
+
+        with instrumentation_services.track() as stats:
+            async def send_with_stats(message:Message):
+                if self._expose_headers and message["type"] == "http.response.start":
+                    headers = MutableHeaders(scope=message)
+                    headers.append("X-DB-Query-Count", str(stats.query_count))
+                    headers.append("X-DB-Query-Time-Ms", f"{stats.total_duration * 1000:.3f}")
+                    headers.append("X-DB-N-Plus-One", str(len(stats.n_plus_one_statements)))
+                await send(message)
+
+            await self._app(scope, receive, send_with_stats)
+
+instrumentation_services = InstrumentationServices()
@@ -1,4 +1,4 @@
-from typing import Type, Callable, TypeVar, Dict
+from typing import Type, Callable, TypeVar, Dict, Iterable, Iterator, List
 from ..singleton.models import SingletonMeta
 
 S = TypeVar("S")
@@ -29,4 +29,48 @@ class MapperServices(metaclass=SingletonMeta):
         result = target_type(**data)
         return result
 
-mapper_services = MapperServices()
\ No newline at end of file
+    def map_many(self,
+                 sources:Iterable,
+                 source_type:Type[S],
+                 target_type:Type[T],
+                 validate:bool = True
+                 ) -> List[T]:
+        """Maps many items with the function registered for source_type, which is looked up once. 
+        Sources only need the attributes used by that function, so Core rows can be mapped 
+        with the function registered for their model.
+
+        Args:
+            sources (Iterable): Items to map
+            source_type (Type[S]): Type the mapping function was registered for
+            target_type (Type[T]): Target type
+            validate (bool, optional): When False, pydantic targets are built with construct(), 
+                skipping validation. Only use it for trusted data, like rows read from the database
+
+        Returns:
+            List[T]: Mapped items
+        """
+        return list(self.map_iter(sources, source_type, target_type, validate))
+
+    def map_iter(self,
+                 sources:Iterable,
+                 source_type:Type[S],
+                 target_type:Type[T],
+                 validate:bool = True
+                 ) -> Iterator[T]:
+        """Lazy version of map_many, items are mapped as sources are consumed
+
+        Args:
+            sources (Iterable): Items to map, like the generator returned by BaseRepository.stream
+            source_type (Type[S]): Type the mapping function was registered for
+            target_type (Type[T]): Target type
+            validate (bool, optional): When False, pydantic targets are built with construct()
+
+        Yields:
+            Iterator[T]: Mapped items
+        """
+        map_fn = self._map_fn[f'{source_type.__name__}__{target_type.__name__}']
+        build = target_type if validate else target_type.construct
+        for source in sources:
+            yield build(**map_fn(source))
+
+mapper_services = MapperServices()
@@ -1,10 +1,20 @@
 from pydantic.generics import GenericModel
-from typing import List, TypeVar, Generic
+from typing import List, TypeVar, Generic, Optional
 T = TypeVar("T")
 
 # https://github.com/tiangolo/fastapi/issues/653#issuecomment-984509798
 class PaginationDTO(GenericModel, Generic[T]):
-    count:int
+    # count and pages_count are None when the count was skipped
+    count:Optional[int]
+    # True when count is a planner estimate instead of an exact count
+    count_estimated:bool = False
     page:int
-    pages_count:int
-    items:List[T]
\ No newline at end of file
+    pages_count:Optional[int]
+    has_next:Optional[bool]
+    items:List[T]
+
+class CursorPaginationDTO(GenericModel, Generic[T]):
+    limit:int
+    next_cursor:Optional[str]
+    prev_cursor:Optional[str]
+    items:List[T]
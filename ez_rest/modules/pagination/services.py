@@ -1,3 +1,8 @@
+from datetime import datetime
+from typing import List, Tuple
+import base64
+import binascii
+import json
 import math
 
 class PaginationServices():
@@ -27,4 +32,49 @@ class PaginationServices():
         Returns:
             int: Total pages
         """
-        return math.ceil(count / limit)
\ No newline at end of file
+        return math.ceil(count / limit)
+
+    def encode_cursor(self, 
+                      values:List, 
+                      direction:str = "next") -> str:
+        """Builds an opaque cursor from the sort key of an item
+
+        Args:
+            values (List): Sort key values of the last seen item, id last
+            direction (str): "next" to seek after the key, "prev" to seek before it
+
+        Returns:
+            str: Url-safe cursor
+        """
+        data = {
+            "v":[{"$dt":value.isoformat()} if isinstance(value, datetime) else value 
+                 for value in values],
+            "d":direction
+        }
+        return base64.urlsafe_b64encode(
+            json.dumps(data, separators=(",",":")).encode()
+        ).decode()
+
+    def decode_cursor(self, cursor:str) -> Tuple[List, str]:
+        """Reverts encode_cursor
+
+        Args:
+            cursor (str): Cursor generated by encode_cursor
+
+        Raises:
+            ValueError: If the cursor is malformed
+
+        Returns:
+            Tuple[List, str]: Sort key values and direction
+        """
+        try:
+            data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            values = [datetime.fromisoformat(value["$dt"]) if isinstance(value, dict) else value 
+                      for value in data["v"]]
+            direction = data["d"]
+        except (binascii.Error, ValueError, KeyError, TypeError) as e:
+            raise ValueError("Invalid cursor") from e
+
+        if direction not in ("next", "prev"):
+            raise ValueError("Invalid cursor")
+        return values, direction
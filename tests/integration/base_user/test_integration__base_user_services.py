@@ -7,8 +7,10 @@ from ez_rest.modules.role.repository import RoleRepository
 from ez_rest.modules.base_user.services import BaseUserServices
 from ez_rest.modules.base_user.models import BaseUserModel, TokenConfig
 from ez_rest.modules.base_user.repository import BaseUserRepository
-from ez_rest.modules.db.services import DbServices
+from ez_rest.modules.db.services import DbServices, UnitOfWork
 from ez_rest.modules.password.services import PaswordServices
+from ez_rest.modules.cache.services import InMemoryCacheBackend
+from ez_rest.modules.singleton.models import SingletonMeta
 from fastapi import HTTPException, status
 from fastapi.security import SecurityScopes
 import time_machine
@@ -326,4 +328,112 @@ def test_check_auth(repository,
                     secret,
                     "HS256",
                 )
-            assert ex.value.status_code == expected_exception
\ No newline at end of file
+            assert ex.value.status_code == expected_exception
+
+class CountingJWTServices(JWTServices):
+    decode_count = 0
+
+    def decode(self, token, key, algorithms):
+        self.decode_count += 1
+        return super().decode(token, key, algorithms)
+
+class RecordingCacheBackend(InMemoryCacheBackend):
+    def __init__(self):
+        super().__init__()
+        self.ttls = []
+
+    def set(self, key, value, ttl = None):
+        self.ttls.append(ttl)
+        super().set(key, value, ttl)
+
+@pytest.fixture
+def cached_services(repository, monkeypatch):
+    monkeypatch.delitem(SingletonMeta._instances, UserServices, raising=False)
+    repository.create(UserModel(id=1, username="johndoe", phone="123123", password="111111"))
+    services = UserServices(repository, jwt_services=CountingJWTServices())
+    services._token_cache = RecordingCacheBackend()
+    yield services
+    monkeypatch.delitem(SingletonMeta._instances, UserServices, raising=False)
+
+def create_test_token(services, expire_minutes = 10):
+    return services.create_token(UserModel(username="johndoe"), 
+                                 ["users:read"], 
+                                 TokenConfig(expire_minutes=expire_minutes, secret="qwerty", algorithm="HS256"))
+
+def test_check_auth__cached(cached_services, monkeypatch):
+    token = create_test_token(cached_services)
+    read_count = 0
+    read = cached_services._repository.read
+    def counting_read(*args, **kwargs):
+        nonlocal read_count
+        read_count += 1
+        return read(*args, **kwargs)
+    monkeypatch.setattr(cached_services._repository, "read", counting_read)
+
+    for _ in range(3):
+        user = cached_services.check_auth(SecurityScopes(["users:read"]), token, "qwerty", "HS256")
+        assert user.username == "johndoe"
+    
+    assert (cached_services._jwt_services.decode_count, read_count) == (1, 1)
+    with pytest.raises(HTTPException) as ex:
+        cached_services.check_auth(SecurityScopes(["users:create"]), token, "qwerty", "HS256")
+    assert ex.value.status_code == status.HTTP_403_FORBIDDEN
+    with pytest.raises(HTTPException) as ex:
+        cached_services.check_auth(SecurityScopes(["users:read"]), token, "other", "HS256")
+    assert ex.value.status_code == status.HTTP_401_UNAUTHORIZED
+
+def test_check_auth__cached_in_unit_of_work(cached_services):
+    token = create_test_token(cached_services)
+    with UnitOfWork(cached_services._repository._db_services) as session:
+        users = [cached_services.check_auth(SecurityScopes([]), token, "qwerty", "HS256") for _ in range(2)]
+
+        assert cached_services._jwt_services.decode_count == 1
+        assert users[0] in session
+        assert users[1] not in session
+
+    user = cached_services.check_auth(SecurityScopes([]), token, "qwerty", "HS256")
+    assert user.username == "johndoe"
+    assert cached_services._jwt_services.decode_count == 1
+
+def test_check_auth__ttl_capped_by_expiration(cached_services):
+    cached_services._token_cache_ttl = 120
+    token = create_test_token(cached_services, expire_minutes=1)
+    cached_services.check_auth(SecurityScopes([]), token, "qwerty", "HS256")
+
+    assert 55 < cached_services._token_cache.ttls[-1] <= 60
+
+def test_check_auth__invalidated_by_writes(cached_services):
+    token = create_test_token(cached_services)
+    cached_services.check_auth(SecurityScopes([]), token, "qwerty", "HS256")
+
+    cached_services._repository.updateById({"phone":"555555"}, 1)
+    user = cached_services.check_auth(SecurityScopes([]), token, "qwerty", "HS256")
+    assert user.phone == "555555"
+    assert cached_services._jwt_services.decode_count == 2
+
+    cached_services._repository.deleteById(1)
+    with pytest.raises(HTTPException) as ex:
+        cached_services.check_auth(SecurityScopes([]), token, "qwerty", "HS256")
+    assert ex.value.status_code == status.HTTP_401_UNAUTHORIZED
+
+def test_check_auth__invalidated_by_other_repositories(cached_services):
+    token = create_test_token(cached_services)
+    cached_services.check_auth(SecurityScopes([]), token, "qwerty", "HS256")
+
+    UserRepository(cached_services._repository._db_services).deleteById(1)
+    with pytest.raises(HTTPException) as ex:
+        cached_services.check_auth(SecurityScopes([]), token, "qwerty", "HS256")
+    assert ex.value.status_code == status.HTTP_401_UNAUTHORIZED
+
+def test_check_auth__bounded_user_writes(cached_services):
+    cached_services._max_user_writes = 10
+    token = create_test_token(cached_services)
+    cached_services.check_auth(SecurityScopes([]), token, "qwerty", "HS256")
+
+    cached_services._repository.updateById({"phone":"555555"}, 1)
+    cached_services._on_users_written(list(range(2, 100)))
+
+    assert len(cached_services._user_writes) == 10
+    user = cached_services.check_auth(SecurityScopes([]), token, "qwerty", "HS256")
+    assert user.phone == "555555"
+    assert cached_services._jwt_services.decode_count == 2
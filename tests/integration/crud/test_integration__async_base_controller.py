@@ -0,0 +1,104 @@
+from typing import List, Optional
+from tests.mock_db_services import MockDbServices
+from ez_rest.modules.crud.repository import AsyncBaseRepository
+from ez_rest.modules.crud.models import BaseModel, BaseDTO
+from ez_rest.modules.crud.controller import AsyncBaseController
+from ez_rest.modules.mapper.services import mapper_services
+from sqlalchemy import Table, Column, MetaData, Integer, String, DateTime
+from sqlalchemy.orm import Mapped, mapped_column
+from fastapi import HTTPException, status
+import pytest
+
+meta = MetaData()
+books = Table(
+    'books',
+    meta,
+    Column('created_at',DateTime),
+    Column('updated_at',DateTime),
+    Column('deleted_at',DateTime),
+    Column('id', Integer, primary_key=True),
+    Column('title',String),
+)
+
+class Book(BaseModel):
+     __tablename__ = "books"
+     title:Mapped[str] = mapped_column(String(100))
+
+class BookSaveDTO(BaseDTO):
+    id:Optional[int]
+    title:Optional[str]
+
+class BookReadDTO(BaseDTO):
+    title:str
+
+mapper_services.register(
+    BookSaveDTO,
+    Book,
+    lambda src : src.dict(exclude_unset=True)
+)
+mapper_services.register(
+    Book,
+    BookReadDTO,
+    lambda src : {"id":src.id, "title":src.title}
+)
+
+class BooksController(AsyncBaseController[Book]):
+    async def create(self, item: BookSaveDTO):
+        return await super().create(item, Book, BookReadDTO)
+
+    async def read(self, query: List = [], page: int = 1, limit: int = None):
+        return await super().read(BookReadDTO, query, page, limit)
+
+    async def read_by_id(self, id: int):
+        return await super().read_by_id(id, BookReadDTO)
+
+    async def update_by_id(self, id: int, partial_data: BookSaveDTO):
+        return await super().update_by_id(id, partial_data, BookSaveDTO, Book)
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+@pytest.fixture
+def controller():
+    db_services = MockDbServices()
+    engine = db_services.get_engine()
+    meta.create_all(engine)
+
+    return BooksController(AsyncBaseRepository(Book, db_services))
+
+@pytest.mark.parametrize("limit,page,expected_pages,expected_items", 
+                         [(3,1,2,3),
+                          (3,2,2,2)])
+async def test_read(controller, limit, page, expected_pages, expected_items):
+    for i in range(0,5):
+        await controller.create(BookSaveDTO(title=f"Book {i}"))
+
+    result = await controller.read(limit=limit, page=page)
+
+    assert len(result.items) == expected_items and\
+        result.count == 5 and \
+        result.page == page and \
+        result.pages_count == expected_pages
+
+@pytest.mark.parametrize("id,found", [(1,True),(6,False)])
+async def test_read_by_id(controller, id, found):
+    await controller.create(BookSaveDTO(title="Book"))
+
+    if found:
+        item = await controller.read_by_id(id)
+        assert item.id == id
+    else:
+        with pytest.raises(HTTPException) as ex:
+            await controller.read_by_id(id)
+        assert ex.value.status_code == status.HTTP_404_NOT_FOUND
+
+async def test_update_by_id(controller):
+    await controller.create(BookSaveDTO(title="Book"))
+
+    await controller.update_by_id(1, BookSaveDTO(title="Other book"))
+
+    item = await controller.read_by_id(1)
+    assert item.title == "Other book"
@@ -1,7 +1,7 @@
 from typing import List, Optional, Type
 from tests.mock_db_services import MockDbServices
 from ez_rest.modules.crud.repository import BaseRepository
-from ez_rest.modules.crud.models import BaseModel, BaseDTO
+from ez_rest.modules.crud.models import BaseModel, BaseDTO, VersionedMixin
 from ez_rest.modules.crud.controller import BaseController
 from ez_rest.modules.db.services import DbServices
 from ez_rest.modules.mapper.services import mapper_services
@@ -11,7 +11,8 @@ import pytest
 from ez_rest.modules.pagination.services import PaginationServices
 from automapper import mapper
 from datetime import datetime
-from fastapi import HTTPException, status
+from fastapi import FastAPI, HTTPException, Response, status
+from fastapi.testclient import TestClient
 
 from sqlalchemy.orm import relationship
 from sqlalchemy import BigInteger
@@ -49,6 +50,9 @@ class ProductSavePartialDTO(BaseDTO):
 class ProductReadDTO(BaseDTO):
     name_category:str
 
+class ProductNameDTO(BaseDTO):
+    name:str
+
 
 mapper_services.register(
     ProductSaveDTO,
@@ -86,6 +90,15 @@ mapper_services.register(
     }
 )
 
+mapper_services.register(
+    Product,
+    ProductNameDTO,
+    lambda src : {
+        "id":src.id,
+        "name":src.name
+    }
+)
+
 class ProductsRepository(BaseRepository[Product]):
     def __init__(self, 
                  db_services: DbServices = None) -> None:
@@ -105,19 +118,52 @@ class ProductsController(BaseController[Product]):
     def read(self, 
              query: List = [], 
              page: int = 1, 
-             limit: int = None):
-        return super().read(ProductReadDTO, query, page, limit)
+             limit: int = None,
+             with_count: bool = True,
+             fields = None,
+             hydrate: bool = True,
+             approximate_count: bool = False):
+        return super().read(ProductReadDTO, 
+                            query, 
+                            page, 
+                            limit, 
+                            with_count, 
+                            fields, 
+                            hydrate, 
+                            approximate_count=approximate_count)
     
+    def read_by_cursor(self, 
+                       query: List = [], 
+                       limit: int = 20, 
+                       cursor: str = None, 
+                       sort_field: str = "id"):
+        return super().read_by_cursor(ProductReadDTO, query, limit, cursor, sort_field)
+
     def read_by_id(self, id: int) :
         return super().read_by_id(id, ProductReadDTO)
 
+    def export(self, format: str = "ndjson", batch_size: int = 1000):
+        return super().export(ProductReadDTO, format=format, batch_size=batch_size)
+
     def update_by_id(self, 
                      id: int, 
                      partial_data: ProductSavePartialDTO):
         return super().update_by_id(id, 
                                     partial_data, 
                                     ProductSavePartialDTO, 
-                                    Product)
+                                    Product,
+                                    ProductReadDTO)
+
+    def create_many(self, items: List[ProductSaveDTO]):
+        return super().create_many(items, Product, ProductReadDTO)
+
+    def upsert_many(self, items: List[ProductSaveDTO]):
+        return super().upsert_many(items, Product)
+
+    def update_many(self, partial_items: List[ProductSavePartialDTO]):
+        return super().update_many(partial_items, 
+                                   ProductSavePartialDTO, 
+                                   Product)
 
 
 @pytest.fixture
@@ -143,7 +189,86 @@ def test_read(controller, limit, page, expected_pages, expected_items):
     assert len(result.items) == expected_items and\
         result.count == 5 and \
         result.page == page and \
-        result.pages_count == expected_pages
+        result.pages_count == expected_pages and \
+        result.has_next == (page < expected_pages)
+
+@pytest.mark.parametrize("limit,page,expected_items,expected_has_next", 
+                         [(3,1,3,True),
+                          (3,2,2,False),
+                          (5,1,5,False),
+                          (2,4,0,False)])
+def test_read__without_count(controller, limit, page, expected_items, expected_has_next):
+    for i in range(0,5):
+        controller.create(ProductSaveDTO(
+            product_category="Furniture",
+            product_name=f"Oven {i}"
+        ))
+    
+    result = controller.read(limit=limit, page=page, with_count=False)
+
+    assert len(result.items) == expected_items
+    assert result.has_next == expected_has_next
+    assert result.count is None and result.pages_count is None
+
+@pytest.mark.parametrize("threshold, expected_count, expected_estimated", 
+                         [(1,4,True),
+                          (10,5,False)])
+def test_read__approximate_count(controller, monkeypatch, threshold, expected_count, expected_estimated):
+    for i in range(0,4):
+        controller.create(ProductSaveDTO(
+            product_category="Furniture",
+            product_name=f"Oven {i}"
+        ))
+    engine = controller._repository._db_services.get_engine()
+    for index in Product.__table__.indexes:
+        index.create(engine)
+    with engine.begin() as connection:
+        connection.exec_driver_sql("ANALYZE")
+    controller.create(ProductSaveDTO(product_category="Furniture", product_name="Oven 4"))
+    monkeypatch.setattr(controller._repository, "_approximate_count_threshold", threshold)
+
+    result = controller.read(limit=3, page=1, approximate_count=True)
+
+    assert len(result.items) == 3 and result.has_next
+    assert result.count == expected_count
+    assert result.count_estimated == expected_estimated
+    assert result.pages_count == 2
+
+@pytest.mark.parametrize("sort_field", [("id"),("name")])
+def test_read_by_cursor(controller, sort_field):
+    for i in range(0,5):
+        controller.create(ProductSaveDTO(
+            product_category="Furniture",
+            product_name=f"Oven {i}"
+        ))
+
+    first = controller.read_by_cursor(limit=2, sort_field=sort_field)
+    second = controller.read_by_cursor(limit=2, cursor=first.next_cursor, sort_field=sort_field)
+    third = controller.read_by_cursor(limit=2, cursor=second.next_cursor, sort_field=sort_field)
+    back = controller.read_by_cursor(limit=2, cursor=third.prev_cursor, sort_field=sort_field)
+
+    assert [item.id for item in first.items] == [1,2]
+    assert first.prev_cursor is None
+    assert [item.id for item in second.items] == [3,4]
+    assert [item.id for item in third.items] == [5]
+    assert third.next_cursor is None
+    assert [item.id for item in back.items] == [3,4]
+    assert back.next_cursor is not None and back.prev_cursor is not None
+
+def test_read_by_cursor__invalid_cursor(controller):
+    with pytest.raises(HTTPException) as ex:
+        controller.read_by_cursor(cursor="invalid")
+    assert ex.value.status_code == status.HTTP_400_BAD_REQUEST
+
+def test_read_by_cursor__invalid_sort(controller):
+    controller.create(ProductSaveDTO(product_category="Furniture", product_name="Oven 1"))
+    controller.create(ProductSaveDTO(product_category="Furniture", product_name="Oven 2"))
+    cursor = controller.read_by_cursor(limit=1, sort_field="name").next_cursor
+
+    for sort_field, cursor in [("price", None), ("id", cursor), ("deleted_at", None)]:
+        with pytest.raises(HTTPException) as ex:
+            controller.read_by_cursor(cursor=cursor, sort_field=sort_field)
+        assert ex.value.status_code == status.HTTP_400_BAD_REQUEST
 
 def test_create(controller):
     item = controller.create(ProductSaveDTO(
@@ -191,12 +316,13 @@ def test_update_by_id(controller, id, partial_data, expected_name_category):
        
 
     if expected_name_category != None:
-        controller.update_by_id(
+        returned_item = controller.update_by_id(
             id,
             ProductSavePartialDTO(**partial_data)
         )
         updated_item = controller.read_by_id(id)
         assert updated_item.name_category == expected_name_category
+        assert returned_item == updated_item
     else:
         with pytest.raises(HTTPException) as ex:
             controller.update_by_id(
@@ -204,4 +330,245 @@ def test_update_by_id(controller, id, partial_data, expected_name_category):
                 ProductSavePartialDTO(**partial_data)
             )
     
-        assert ex.value.status_code == status.HTTP_404_NOT_FOUND
\ No newline at end of file
+        assert ex.value.status_code == status.HTTP_404_NOT_FOUND
+
+def test_create_many(controller):
+    items = controller.create_many([
+        ProductSaveDTO(product_category="Furniture", product_name="Oven"),
+        ProductSaveDTO(product_category="Food", product_name="Apple")
+    ])
+
+    assert [item.id for item in items] == [1,2]
+    assert [item.name_category for item in items] == ["Oven Furniture", "Apple Food"]
+
+def test_update_many(controller):
+    controller.create_many([
+        ProductSaveDTO(product_category="Furniture", product_name="Oven"),
+        ProductSaveDTO(product_category="Food", product_name="Apple")
+    ])
+
+    controller.update_many([
+        ProductSavePartialDTO(id=1, product_name="Fridge"),
+        ProductSavePartialDTO(id=2, product_category="Fruit")
+    ])
+
+    assert controller.read_by_id(1).name_category == "Fridge Furniture"
+    assert controller.read_by_id(2).name_category == "Apple Fruit"
+
+def test_update_many__missing_id(controller):
+    with pytest.raises(HTTPException) as ex:
+        controller.update_many([ProductSavePartialDTO(product_name="Fridge")])
+    assert ex.value.status_code == status.HTTP_400_BAD_REQUEST
+
+def test_delete_many(controller):
+    controller.create_many([
+        ProductSaveDTO(product_category="Furniture", product_name=f"Oven {i}")
+        for i in range(0,3)
+    ])
+
+    assert controller.delete_many([1,3]) == 2
+    assert [item.id for item in controller.read(limit=10).items] == [2]
+
+def test_read__fields(controller):
+    controller.create(ProductSaveDTO(product_category="Furniture", product_name="Oven"))
+
+    result = controller.read(limit=10, fields="name, category")
+
+    assert result.items[0].name_category == "Oven Furniture"
+
+class ProductDeclaredReadDTO(ProductReadDTO):
+    __required_fields__ = ["name", "category"]
+
+mapper_services.register(
+    Product,
+    ProductDeclaredReadDTO,
+    lambda src : {
+        "id":src.id,
+        "name_category":f'{src.name} {src.category}' if src.category is not None else src.name
+    }
+)
+
+@pytest.mark.parametrize("hydrate", [(True),(False)])
+def test_read__fields_required_by_dto(controller, hydrate):
+    controller.create(ProductSaveDTO(product_category="Furniture", product_name="Oven"))
+
+    result = BaseController.read(controller, ProductDeclaredReadDTO, limit=10, fields="name", hydrate=hydrate)
+    assert result.items[0].name_category == "Oven Furniture"
+
+    with pytest.raises(HTTPException) as ex:
+        BaseController.read(controller, ProductReadDTO, limit=10, fields="name", hydrate=hydrate)
+    assert ex.value.status_code == status.HTTP_400_BAD_REQUEST
+
+def test_read_by_id__fields_required_by_dto(controller):
+    controller.create(ProductSaveDTO(product_category="Furniture", product_name="Oven"))
+
+    item = BaseController.read_by_id(controller, 1, ProductDeclaredReadDTO, fields="name")
+    assert item.name_category == "Oven Furniture"
+
+    with pytest.raises(HTTPException) as ex:
+        BaseController.read_by_id(controller, 1, ProductReadDTO, fields="name")
+    assert ex.value.status_code == status.HTTP_400_BAD_REQUEST
+
+def test_read__unknown_fields(controller):
+    with pytest.raises(HTTPException) as ex:
+        controller.read(limit=10, fields="name,price")
+    assert ex.value.status_code == status.HTTP_400_BAD_REQUEST
+
+def test_read__dto_projection(controller, monkeypatch):
+    monkeypatch.setattr(controller, "_project_dto_fields", True)
+    controller.create(ProductSaveDTO(product_category="Furniture", product_name="Oven"))
+
+    assert controller._get_fields(ProductNameDTO, None) == \
+        ["id", "created_at", "deleted_at", "updated_at", "name"]
+    assert BaseController.read_by_id(controller, 1, ProductNameDTO).name == "Oven"
+
+@pytest.mark.parametrize("with_count", [(True),(False)])
+def test_read__without_hydration(controller, with_count):
+    controller.create(ProductSaveDTO(product_category="Furniture", product_name="Oven"))
+    controller.create(ProductSaveDTO(product_category="Food", product_name="Apple"))
+
+    result = controller.read(limit=10, with_count=with_count, hydrate=False)
+
+    assert [item.name_category for item in result.items] == ["Oven Furniture", "Apple Food"]
+    assert all(isinstance(item, ProductReadDTO) for item in result.items)
+
+def test_read__dto_loader_options(controller, monkeypatch):
+    options = []
+    monkeypatch.setattr(ProductReadDTO, "__loader_options__", options, raising=False)
+    read_calls = []
+    read_with_count = controller._repository.read_with_count
+    monkeypatch.setattr(controller._repository, 
+                        "read_with_count", 
+                        lambda *args, **kwargs: read_calls.append(kwargs) or read_with_count(*args, **kwargs))
+
+    controller.read(limit=10)
+
+    assert read_calls[0]["options"] is options
+
+@pytest.mark.parametrize("format, expected_content, expected_media_type", 
+                         [("ndjson", 
+                           '{"id": 1, "created_at": null, "deleted_at": null, "updated_at": null, "name_category": "Oven 0 Furniture"}\n'
+                           '{"id": 2, "created_at": null, "deleted_at": null, "updated_at": null, "name_category": "Oven 1 Furniture"}\n'
+                           '{"id": 3, "created_at": null, "deleted_at": null, "updated_at": null, "name_category": "Oven 2 Furniture"}\n', 
+                           "application/x-ndjson"),
+                          ("csv", 
+                           "id,created_at,deleted_at,updated_at,name_category\r\n"
+                           "1,,,,Oven 0 Furniture\r\n2,,,,Oven 1 Furniture\r\n3,,,,Oven 2 Furniture\r\n", 
+                           "text/csv")])
+def test_export(controller, format, expected_content, expected_media_type):
+    for i in range(0,4):
+        controller.create(ProductSaveDTO(
+            product_category="Furniture",
+            product_name=f"Oven {i}"
+        ))
+    controller.delete_many([4])
+    app = FastAPI()
+
+    @app.get("/products/export")
+    def export(format:str):
+        return controller.export(format, batch_size=2)
+
+    response = TestClient(app).get("/products/export", params={"format":format})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith(expected_media_type)
+    assert response.text == expected_content
+
+def test_export__unsupported_format(controller):
+    with pytest.raises(HTTPException) as exception:
+        controller.export("xml")
+
+    assert exception.value.status_code == status.HTTP_400_BAD_REQUEST
+
+def test_upsert_many(controller):
+    controller.create(ProductSaveDTO(product_category="Furniture", product_name="Oven"))
+
+    result = controller.upsert_many([
+        ProductSaveDTO(id=1, product_category="Kitchen", product_name="Oven"),
+        ProductSaveDTO(product_category="Furniture", product_name="Chair")])
+
+    assert (result.inserted, result.updated) == (1, 1)
+    assert [item.name_category for item in controller.read(limit=10).items] == ["Oven Kitchen", "Chair Furniture"]
+
+versioned_products = Table(
+    'versioned_products',
+    meta,
+    Column('created_at',DateTime),
+    Column('updated_at',DateTime),
+    Column('deleted_at',DateTime),
+    Column('id', Integer, primary_key=True),
+    Column('version', Integer, nullable=False),
+    Column('name',String),
+    Column('category',String),
+)
+
+class VersionedProduct(VersionedMixin, BaseModel):
+     __tablename__ = "versioned_products"
+     name:Mapped[str] = mapped_column(String(100))
+     category:Mapped[str] = mapped_column(String(100))
+
+mapper_services.register(
+    ProductSavePartialDTO,
+    VersionedProduct,
+    map_product_read_dto
+)
+
+@pytest.fixture
+def versioned_controller(controller):
+    repository = BaseRepository(VersionedProduct, controller._repository._db_services)
+    repository.create(VersionedProduct(id=1, name="Oven", category="Furniture"))
+    return BaseController(repository)
+
+@pytest.mark.parametrize("if_match,expected_version", 
+                         [('"1"',2),
+                          ('"3", "1"',2),
+                          ('W/"1", "1"',2),
+                          ('*',2),
+                          (None,2)])
+def test_update_by_id__if_match(versioned_controller, if_match, expected_version):
+    item = versioned_controller.update_by_id(1,
+                                             ProductSavePartialDTO(product_name="Chair"),
+                                             ProductSavePartialDTO,
+                                             VersionedProduct,
+                                             if_match=if_match)
+
+    assert (item.name, item.version) == ("Chair", expected_version)
+
+@pytest.mark.parametrize("if_match,expected_status_code", 
+                         [('"2"',status.HTTP_409_CONFLICT),
+                          ('"2", "3"',status.HTTP_409_CONFLICT),
+                          ('W/"1"',status.HTTP_412_PRECONDITION_FAILED),
+                          ('"two"',status.HTTP_400_BAD_REQUEST)])
+def test_update_by_id__if_match_failed(versioned_controller, if_match, expected_status_code):
+    with pytest.raises(HTTPException) as exception:
+        versioned_controller.update_by_id(1,
+                                          ProductSavePartialDTO(product_name="Chair"),
+                                          ProductSavePartialDTO,
+                                          VersionedProduct,
+                                          if_match=if_match)
+
+    assert exception.value.status_code == expected_status_code
+    assert versioned_controller._repository.readById(1).name == "Oven"
+
+mapper_services.register(
+    VersionedProduct,
+    ProductNameDTO,
+    lambda src : {
+        "id":src.id,
+        "name":src.name
+    }
+)
+
+def test_update_by_id__etag(versioned_controller):
+    response = Response()
+    assert versioned_controller.read_by_id(1, ProductNameDTO, response=response).name == "Oven"
+    assert response.headers["ETag"] == '"1"'
+
+    response = Response()
+    versioned_controller.update_by_id(1,
+                                      ProductSavePartialDTO(product_name="Chair"),
+                                      ProductSavePartialDTO,
+                                      VersionedProduct,
+                                      if_match='"1"',
+                                      response=response)
+    assert response.headers["ETag"] == '"2"'
@@ -1,11 +1,13 @@
 from sqlalchemy.engine import Engine
 from sqlalchemy import create_engine
-from sqlalchemy.pool import StaticPool
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import StaticPool, NullPool
 import os
 
 
 TEST_DB_PATH = 'test.db'
 TEST_DB_URI = f'sqlite:///{TEST_DB_PATH}'
+TEST_ASYNC_DB_URI = f'sqlite+aiosqlite:///{TEST_DB_PATH}'
 class MockDbServices():
     
     def __init__(self) -> None:
@@ -20,3 +22,17 @@ class MockDbServices():
             echo=True
         )
         return engine
+
+    def get_read_engine(self) -> Engine:
+        return self.get_engine()
+
+    def eject_replica(self, engine:Engine) -> bool:
+        return False
+
+    def get_async_engine(self) -> AsyncEngine:
+        engine = create_async_engine(
+            TEST_ASYNC_DB_URI,
+            poolclass=NullPool,
+            echo=True
+        )
+        return engine
@@ -8,7 +8,10 @@ from ez_rest.modules.password.services import PaswordServices
 from tests.mock_db_services import MockDbServices
 from sqlalchemy import BigInteger
 from sqlalchemy import Table, Column, MetaData, Integer,Text, String, DateTime, ForeignKey, Boolean
-from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy.orm import Mapped, mapped_column, noload, raiseload
+from sqlalchemy import text
+from sqlalchemy.exc import InvalidRequestError
+from ez_rest.modules.crud.repository import BaseRepository
 
 meta = MetaData()
 users = Table(
@@ -50,6 +53,8 @@ class UserModel(BaseUserModel):
     email:Mapped[str] = mapped_column(String(100),use_existing_column=True)
     phone:Mapped[str] = mapped_column(String(100),use_existing_column=True)
 
+email_indexes = UserModel.add_identity_indexes("email")
+
 class UserRepository(BaseUserRepository[UserModel]):
     _identity_fields = ['username', 'email']
 
@@ -111,3 +116,84 @@ def test_read_by_identity_fields(repository, value, expected_user_id):
         assert read_user.id == expected_user_id
     else:
         assert read_user is None
+
+def test_read__loader_options(repository):
+    role_repository = BaseRepository(RoleModel, repository._db_services)
+    role_repository.create(RoleModel(id=1, name="Admin", scopes=[]))
+    repository.create(UserModel(
+        id=1,
+        username="user",
+        password="123456",
+        email="user@user.com",
+        phone="000000",
+        role_id=1
+    ))
+
+    assert repository.readById(1).role.name == "Admin"
+    assert repository.readById(1, options=[noload(UserModel.role)]).role is None
+    with pytest.raises(InvalidRequestError):
+        repository.read(options=[raiseload(UserModel.role)])[0].role
+
+class CaseInsensitiveUserRepository(UserRepository):
+    _case_insensitive_identity_fields = ['email']
+
+@pytest.mark.parametrize("value, expected_user_id", 
+                         [("USER@user.com",1),
+                          ("user@user.com",1),
+                          ("USER",None),
+                          ("user",1)])
+def test_read_by_identity_fields__case_insensitive(repository, value, expected_user_id):
+    repository = CaseInsensitiveUserRepository(repository._db_services, MockPasswordServices())
+    repository.create(UserModel(
+        id=1,
+        username="user",
+        password="123456",
+        email="User@User.com",
+        phone="000000"
+    ))
+
+    read_user = repository.read_by_identity_field(value)
+
+    if expected_user_id != None:
+        assert read_user.id == expected_user_id
+    else:
+        assert read_user is None
+
+def test_read_by_identity_fields__index_probes(repository):
+    repository = CaseInsensitiveUserRepository(repository._db_services, MockPasswordServices())
+    engine = repository._db_services.get_engine()
+    for index in email_indexes:
+        index.create(engine)
+    repository.read_by_identity_field("user")
+    statement = repository._get_statement(("read_by_identity_field",), None) \
+        .params(identity_field_value="user", lowercase_identity_field_value="user") \
+        .compile(engine, compile_kwargs={"literal_binds":True})
+
+    with engine.connect() as connection:
+        plan = " ".join(str(row[-1]) for row in connection.execute(
+            text(f"EXPLAIN QUERY PLAN {statement}")))
+
+    assert "UNION ALL" in plan
+    assert "ix_users_email_lower" in plan
+
+def test_create_many__hashes_passwords(repository):
+    password_services = PaswordServices()
+    repository = UserRepository(repository._db_services, password_services)
+    repository.create_many([
+        UserModel(id=1, username="user", password="secret1", email="user@user.com"),
+        UserModel(id=2, username="user2", password="secret2", email="user2@user2.com")])
+
+    users = sorted(repository.read(), key=lambda user: user.id)
+    assert [user.password[:4] for user in users] == ["$2b$", "$2b$"]
+    assert password_services.verify_password("secret2", users[1].password)
+
+def test_upsert__hashes_passwords(repository):
+    password_services = PaswordServices()
+    repository = UserRepository(repository._db_services, password_services)
+    repository.upsert(UserModel(id=1, username="user", password="secret1", email="user@user.com"))
+    repository.upsert_many([UserModel(id=1, username="user", password="secret2", email="user@user.com"),
+                            UserModel(id=2, username="user2", password="secret3", email="user2@user2.com")])
+
+    users = sorted(repository.read(), key=lambda user: user.id)
+    assert password_services.verify_password("secret2", users[0].password)
+    assert password_services.verify_password("secret3", users[1].password)
@@ -0,0 +1,105 @@
+from ez_rest.modules.cache.services import EntityCacheServices, InMemoryCacheBackend, QueryCacheServices
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from sqlalchemy import Select, column, select, table
+import threading
+import time_machine
+
+class Item():
+    __tablename__ = "items"
+
+items = table("items", column("id"), column("name"))
+
+def test_in_memory_backend__lru_eviction():
+    backend = InMemoryCacheBackend(max_size=2)
+    backend.set("a", 1)
+    backend.set("b", 2)
+    backend.get("a")
+    backend.set("c", 3)
+
+    assert backend.get("a") == 1
+    assert backend.get("b") is None
+    assert backend.get("c") == 3
+    assert len(backend) == 2
+
+def test_in_memory_backend__expiration():
+    with time_machine.travel(datetime(2020,1,1), tick=False) as traveller:
+        backend = InMemoryCacheBackend(ttl=10)
+        backend.set("a", 1)
+        backend.set("b", 2, ttl=30)
+        traveller.shift(20)
+
+        assert backend.get("a") is None
+        assert backend.get("b") == 2
+
+def test_entity_cache__invalidate():
+    cache = EntityCacheServices()
+    cache.set(Item, 1, "item 1")
+    cache.set(Item, 2, "item 2")
+
+    cache.invalidate(Item, [1])
+    assert cache.get(Item, 1) is None
+    assert cache.get(Item, 2) == "item 2"
+
+    cache.invalidate(Item)
+    assert cache.get(Item, 2) is None
+
+def test_entity_cache__stats():
+    cache = EntityCacheServices()
+    cache.set(Item, 1, "item 1")
+    cache.get(Item, 1)
+    cache.get(Item, 2)
+
+    stats = cache.get_stats()
+    assert (stats.hits, stats.misses, stats.size) == (1, 1, 1)
+
+def test_query_cache__fingerprint():
+    cache = QueryCacheServices()
+    cache.get_or_compute(Item, "read", select(items).where(items.c.id == 1), lambda: ["item 1"])
+
+    assert cache.get_or_compute(
+        Item, "read", select(items).where(items.c.id == 1), lambda: ["other"]) == ["item 1"]
+    assert cache.get_or_compute(
+        Item, "read", select(items).where(items.c.id == 2), lambda: ["item 2"]) == ["item 2"]
+    assert cache.get_or_compute(
+        Item, "rows", select(items).where(items.c.id == 1), lambda: ["row 1"]) == ["row 1"]
+
+def test_query_cache__fingerprint_without_compiling(monkeypatch):
+    def compile(*args, **kwargs):
+        raise AssertionError("Statements shouldn't be compiled")
+    monkeypatch.setattr(Select, "compile", compile)
+    cache = QueryCacheServices()
+    cache.get_or_compute(Item, "read", select(items).where(items.c.id.in_([1, 2])), lambda: ["items 1, 2"])
+
+    assert cache.get_or_compute(
+        Item, "read", select(items).where(items.c.id.in_([1, 2])), lambda: ["other"]) == ["items 1, 2"]
+    assert cache.get_or_compute(
+        Item, "read", select(items).where(items.c.id.in_([1, 3])), lambda: ["items 1, 3"]) == ["items 1, 3"]
+
+def test_query_cache__bump_version():
+    cache = QueryCacheServices()
+    statement = select(items)
+    cache.get_or_compute(Item, "read", statement, lambda: ["item 1"])
+    cache.bump_version(Item)
+
+    assert cache.get_version(Item) == 1
+    assert cache.get_or_compute(Item, "read", statement, lambda: ["item 2"]) == ["item 2"]
+
+def test_query_cache__single_computation():
+    cache = QueryCacheServices()
+    computations = []
+    started = threading.Event()
+    def compute():
+        computations.append(1)
+        started.wait(1)
+        return ["item 1"]
+
+    with ThreadPoolExecutor(8) as executor:
+        futures = [executor.submit(cache.get_or_compute, Item, "read", select(items), compute) 
+                   for _ in range(8)]
+        started.set()
+        results = [future.result() for future in futures]
+
+    assert len(computations) == 1
+    assert results == [["item 1"]] * 8
+    assert (cache.get_stats().hits, cache.get_stats().misses) == (7, 1)
@@ -0,0 +1,194 @@
+import pytest
+from ez_rest.modules.crud.models import BaseModel
+from ez_rest.modules.crud.repository import AsyncBaseRepository, BaseRepository
+from ez_rest.modules.cache.services import EntityCacheServices, QueryCacheServices
+from ez_rest.modules.counter.models import CounterModel
+from datetime import datetime
+from tests.mock_db_services import MockDbServices
+from sqlalchemy import Table, Column, MetaData, Integer, String, DateTime, ForeignKey
+from sqlalchemy.orm import Mapped, mapped_column, relationship, joinedload, noload
+from typing import List
+import time_machine
+
+meta = MetaData()
+gadgets = Table(
+    'gadgets',
+    meta,
+    Column('created_at',DateTime),
+    Column('updated_at',DateTime),
+    Column('deleted_at',DateTime),
+    Column('id', Integer, primary_key=True),
+    Column('name', String),
+    Column('category',String)
+)
+
+drawers = Table(
+    'drawers',
+    meta,
+    Column('created_at',DateTime),
+    Column('updated_at',DateTime),
+    Column('deleted_at',DateTime),
+    Column('id', Integer, primary_key=True),
+    Column('name', String)
+)
+
+tools = Table(
+    'tools',
+    meta,
+    Column('created_at',DateTime),
+    Column('updated_at',DateTime),
+    Column('deleted_at',DateTime),
+    Column('id', Integer, primary_key=True),
+    Column('drawer_id', Integer, ForeignKey('drawers.id'))
+)
+
+class Gadget(BaseModel):
+     __tablename__ = "gadgets"
+     name:Mapped[str] = mapped_column(String(100))
+     category:Mapped[str] = mapped_column(String(100))
+
+class Tool(BaseModel):
+     __tablename__ = "tools"
+     drawer_id:Mapped[int] = mapped_column(ForeignKey("drawers.id"))
+
+class Drawer(BaseModel):
+     __tablename__ = "drawers"
+     name:Mapped[str] = mapped_column(String(100))
+     tools:Mapped[List[Tool]] = relationship(lazy="joined")
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+@pytest.fixture
+def repository():
+    db_services = MockDbServices()
+    engine = db_services.get_engine()
+    meta.create_all(engine)
+
+    return AsyncBaseRepository(Gadget, db_services)
+
+async def test_create(repository):
+    item = Gadget(id=1,name="Demo",category="Food")
+    item = await repository.create(item)
+
+    assert item.id == 1
+
+@pytest.mark.parametrize("include_deleted", [(True),(False)])
+async def test_read(repository, include_deleted):
+    await repository.create(Gadget(
+        id=1,
+        name="Demo",
+        category="Food",
+        deleted_at=None if include_deleted is False else datetime.utcnow()
+    ))
+    items = await repository.read(include_deleted=include_deleted)
+
+    assert len(items) == 1 and items[0].id == 1
+
+async def test_read__filter(repository):
+    await repository.create(Gadget(id=1,name="Demo",category="Food"))
+    await repository.create(Gadget(id=2,name="Demo",category="Sports"))
+    items = await repository.read([Gadget.category == 'Sports'])
+
+    assert len(items) == 1 and items[0].id == 2
+
+@pytest.mark.parametrize("id,found", [(1,True),(3,False)])
+async def test_read_by_id(repository, id, found):
+    await repository.create(Gadget(id=1,name="Demo",category="Food"))
+
+    item = await repository.readById(id)
+    if found:
+        assert item.id == id
+    else:
+        assert item is None
+
+@pytest.mark.parametrize("options, expected_tools", 
+                         [(None, [[1,2,3],[4]]),
+                          ([joinedload(Drawer.tools)], [[1,2,3],[4]]),
+                          ([noload(Drawer.tools)], [[],[]])])
+async def test_read__loader_options(repository, options, expected_tools):
+    drawers_repository = AsyncBaseRepository(Drawer, repository._db_services)
+    await drawers_repository.create(Drawer(id=1, name="Drawer 1", tools=[Tool(id=1), Tool(id=2), Tool(id=3)]))
+    await drawers_repository.create(Drawer(id=2, name="Drawer 2", tools=[Tool(id=4)]))
+
+    items = await drawers_repository.read(limit=2, options=options)
+    assert [[tool.id for tool in item.tools] for item in items] == expected_tools
+    assert len((await drawers_repository.readById(1)).tools) == 3
+
+async def test_update(repository):
+    await repository.create(Gadget(id=1,name="Potato",category="Food"))
+
+    with time_machine.travel(datetime(2020,1,1,0,0,0,0)):
+        item = await repository.updateById({"name":"Tomato"}, 1)
+
+    assert item.name == "Tomato"
+    assert item.category == "Food"
+    assert item.updated_at.strftime("%d-%m-%Y") == "01-01-2020"
+
+@pytest.mark.parametrize("soft_delete", [(True),(False)])
+async def test_delete(repository, soft_delete):
+    await repository.create(Gadget(id=1,name="Demo",category="Food"))
+
+    await repository.deleteById(1, soft_delete=soft_delete)
+
+    assert await repository.count() == 0
+    assert await repository.count(include_deleted=True) == (1 if soft_delete else 0)
+
+async def test_delete__not_found(repository):
+    with pytest.raises(Exception):
+        await repository.deleteById(2)
+
+async def test_count(repository):
+    for i in range(1,11):
+        await repository.create(Gadget(id=i,name="Demo",category="Food"))
+
+    assert await repository.count([Gadget.id > 5]) == 5
+
+counted_gadgets = Table(
+    'counted_gadgets',
+    meta,
+    Column('created_at',DateTime),
+    Column('updated_at',DateTime),
+    Column('deleted_at',DateTime),
+    Column('id', Integer, primary_key=True),
+    Column('name', String),
+    Column('category',String)
+)
+
+class CountedGadget(BaseModel):
+     __tablename__ = "counted_gadgets"
+     __counter_columns__ = ["category"]
+     name:Mapped[str] = mapped_column(String(100))
+     category:Mapped[str] = mapped_column(String(100), default="Misc")
+
+async def test_counters(repository):
+    CounterModel.__table__.create(repository._db_services.get_engine())
+    counted_repository = AsyncBaseRepository(CountedGadget, repository._db_services)
+    sync_repository = BaseRepository(CountedGadget, repository._db_services)
+
+    await counted_repository.create(CountedGadget(id=1, name="Demo 1"))
+    await counted_repository.create(CountedGadget(id=2, name="Demo 2", category="Food"))
+    await counted_repository.create(CountedGadget(id=3, name="Demo 3", category="Food"))
+    await counted_repository.updateById({"category":"Sports"}, 2)
+    await counted_repository.deleteById(3)
+
+    assert [sync_repository.count([CountedGadget.category == category]) 
+            for category in ["Misc", "Food", "Sports"]] == [1, 0, 1]
+
+async def test_update__invalidates_caches(repository):
+    entity_cache = EntityCacheServices()
+    query_cache = QueryCacheServices()
+    async_repository = AsyncBaseRepository(Gadget, repository._db_services, entity_cache, query_cache)
+    sync_repository = BaseRepository(Gadget, repository._db_services, entity_cache, query_cache)
+    await async_repository.create(Gadget(id=1, name="Potato", category="Food"))
+
+    assert sync_repository.readById(1).name == "Potato"
+    assert sync_repository.count([Gadget.name == "Tomato"]) == 0
+
+    await async_repository.updateById({"name":"Tomato"}, 1)
+
+    assert sync_repository.readById(1).name == "Tomato"
+    assert sync_repository.count([Gadget.name == "Tomato"]) == 1
@@ -1,13 +1,21 @@
-from typing import Type
+from typing import List, Type
 import pytest
-from ez_rest.modules.crud.models import BaseModel
+from ez_rest.modules.crud.models import BaseModel, SoftDeleteFlagMixin, VersionedMixin
 from ez_rest.modules.crud.repository import BaseRepository
+from ez_rest.modules.cache.services import EntityCacheServices, QueryCacheServices
+from ez_rest.modules.counter.models import CounterModel
 from datetime import datetime
-from ez_rest.modules.db.services import DbServices
+from ez_rest.modules.db.services import DbServices, UnitOfWork, _primary_pinned_until
+from ez_rest.modules.singleton.models import SingletonMeta
 from tests.mock_db_services import MockDbServices
-from sqlalchemy import Table, Column, MetaData, Integer, String, DateTime
-from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy import Table, Column, MetaData, Integer, String, DateTime, ForeignKey, Boolean
+from sqlalchemy.orm import Mapped, mapped_column, relationship, joinedload, noload
+from sqlalchemy.orm.exc import NoResultFound, StaleDataError
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.engine import Engine
+from sqlalchemy import event, select
 import time_machine
+from concurrent.futures import ThreadPoolExecutor
 
 meta = MetaData()
 commodities = Table(
@@ -21,11 +29,70 @@ commodities = Table(
     Column('category',String)
 )
 
+shelves = Table(
+    'shelves',
+    meta,
+    Column('created_at',DateTime),
+    Column('updated_at',DateTime),
+    Column('deleted_at',DateTime),
+    Column('id', Integer, primary_key=True),
+    Column('name', String)
+)
+boxes = Table(
+    'boxes',
+    meta,
+    Column('created_at',DateTime),
+    Column('updated_at',DateTime),
+    Column('deleted_at',DateTime),
+    Column('id', Integer, primary_key=True),
+    Column('shelf_id', Integer, ForeignKey('shelves.id'))
+)
+flagged_commodities = Table(
+    'flagged_commodities',
+    meta,
+    Column('created_at',DateTime),
+    Column('updated_at',DateTime),
+    Column('deleted_at',DateTime),
+    Column('is_deleted',Boolean),
+    Column('id', Integer, primary_key=True),
+    Column('name', String)
+)
+
 class Commodity(BaseModel):
      __tablename__ = "commodities"
      name:Mapped[str] = mapped_column(String(100))
      category:Mapped[str] = mapped_column(String(100))
 
+class Box(BaseModel):
+     __tablename__ = "boxes"
+     shelf_id:Mapped[int] = mapped_column(ForeignKey("shelves.id"))
+
+class Shelf(BaseModel):
+     __tablename__ = "shelves"
+     name:Mapped[str] = mapped_column(String(100))
+     boxes:Mapped[List[Box]] = relationship(lazy="joined")
+
+class FlaggedCommodity(SoftDeleteFlagMixin, BaseModel):
+     __tablename__ = "flagged_commodities"
+     name:Mapped[str] = mapped_column(String(100))
+
+counted_commodities = Table(
+    'counted_commodities',
+    meta,
+    Column('created_at',DateTime),
+    Column('updated_at',DateTime),
+    Column('deleted_at',DateTime),
+    Column('id', Integer, primary_key=True),
+    Column('name', String),
+    Column('category',String)
+)
+
+class CountedCommodity(BaseModel):
+     __tablename__ = "counted_commodities"
+     __counter_columns__ = ["category"]
+     name:Mapped[str] = mapped_column(String(100))
+     category:Mapped[str] = mapped_column(String(100), default="Misc")
+
 class CommoditiesRepository(BaseRepository):
     def __init__(self, db_services: DbServices = None) -> None:
         super().__init__(Commodity, db_services)
@@ -151,3 +218,630 @@ def test_count(repository, items_generated,include_deleted):
         item = repository.create(item)
 
     assert repository.count(include_deleted=include_deleted) == items_generated
+
+@pytest.mark.parametrize("query, include_deleted, expected", 
+                         [(None, False, True),
+                          ([Commodity.category == "Food"], False, False),
+                          ([Commodity.category == "Food"], True, True),
+                          ([Commodity.category == "Toys"], True, False)])
+def test_exists(repository, query, include_deleted, expected):
+    repository.create(Commodity(id=1, name="Demo", category="Sports"))
+    repository.create(Commodity(id=2, name="Demo", category="Food", deleted_at=datetime.utcnow()))
+
+    assert repository.exists(query, include_deleted) == expected
+
+@pytest.mark.parametrize("sort_field, after, before, expected_ids", 
+                         [("id", None, None, [1,2,3]),
+                          ("id", [2], None, [3,4,5]),
+                          ("id", None, [4], [1,2,3]),
+                          ("name", None, None, [5,4,3]),
+                          ("name", ["C",3], None, [2,1]),
+                          ("name", None, ["E",1], [4,3,2])])
+def test_read_by_cursor(repository, sort_field, after, before, expected_ids):
+    for i, name in enumerate(["E","D","C","B","A"]):
+        repository.create(Commodity(id=i+1,name=name,category="Food"))
+
+    items = repository.read_by_cursor(
+        limit=3, 
+        sort_field=sort_field, 
+        after=after, 
+        before=before)
+
+    assert [item.id for item in items] == expected_ids
+
+@pytest.mark.parametrize("sort_field, after", 
+                         [("price", None),
+                          ("deleted_at", None),
+                          ("name", [3])])
+def test_read_by_cursor__invalid(repository, sort_field, after):
+    with pytest.raises(ValueError):
+        repository.read_by_cursor(limit=3, sort_field=sort_field, after=after)
+
+@pytest.mark.parametrize("window_functions", [(True),(False)])
+@pytest.mark.parametrize("limit, offset, expected_ids", 
+                         [(2, 0, [1,2]),
+                          (2, 2, [3]),
+                          (2, 10, [])])
+def test_read_with_count(repository, monkeypatch, window_functions, limit, offset, expected_ids):
+    monkeypatch.setattr(repository, 
+                        "_supports_window_functions", 
+                        lambda dialect: window_functions)
+    for i in range(1,5):
+        repository.create(Commodity(
+            id=i,
+            name="Demo",
+            category="Food" if i != 4 else "Sports"))
+
+    items, count = repository.read_with_count(
+        [Commodity.category == "Food"], 
+        limit, 
+        offset)
+
+    assert [item.id for item in items] == expected_ids
+    assert count == 3
+
+@pytest.mark.parametrize("returning", [(True),(False)])
+@pytest.mark.parametrize("chunk_size", [(2),(1000)])
+def test_create_many(repository, returning, chunk_size):
+    items = [Commodity(name=f"Demo {i}", category="Food") for i in range(1,6)]
+
+    created_items = repository.create_many(items, chunk_size, returning)
+
+    if returning:
+        assert [item.id for item in created_items] == [1,2,3,4,5]
+        assert [item.name for item in created_items] == [f"Demo {i}" for i in range(1,6)]
+    else:
+        assert created_items == []
+    assert repository.count() == 5
+
+def test_create_many__without_returning_support(repository, monkeypatch):
+    monkeypatch.setattr("sqlalchemy.dialects.sqlite.base.SQLiteDialect.insert_executemany_returning_sort_by_parameter_order", False)
+    items = [Commodity(name=f"Demo {i}", category="Food") for i in range(1,4)]
+
+    created_items = repository.create_many(items)
+
+    assert [item.id for item in created_items] == [1,2,3]
+
+def test_update_many(repository):
+    for i in range(1,5):
+        repository.create(Commodity(id=i, name=f"Demo {i}", category="Food"))
+    repository.deleteById(4)
+
+    with time_machine.travel(datetime(2020,1,1,0,0,0,0)):
+        repository.update_many({
+            1:{"name":"Tomato"},
+            2:{"name":"Ball", "category":"Sports"},
+            4:{"name":"Deleted"}
+        }, chunk_size=1)
+
+    items = {item.id:item for item in repository.read(include_deleted=True)}
+    assert (items[1].name, items[1].category) == ("Tomato", "Food")
+    assert (items[2].name, items[2].category) == ("Ball", "Sports")
+    assert items[1].updated_at.strftime("%d-%m-%Y") == "01-01-2020"
+    assert items[3].name == "Demo 3" and items[3].updated_at is None
+    assert items[4].name == "Demo 4"
+
+@pytest.mark.parametrize("soft_delete", [(True),(False)])
+def test_delete_many(repository, soft_delete):
+    for i in range(1,6):
+        repository.create(Commodity(id=i, name=f"Demo {i}", category="Food"))
+
+    deleted_count = repository.delete_many([1,2,3,10], soft_delete, chunk_size=2)
+
+    assert deleted_count == 3
+    assert [item.id for item in repository.read()] == [4,5]
+    assert repository.count(include_deleted=True) == (5 if soft_delete else 2)
+
+def test_update__single_statement(repository):
+    repository.create(Commodity(id=1,name="Potato",category="Food"))
+    statements = []
+    def on_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+    
+    event.listen(Engine, "before_cursor_execute", on_execute)
+    try:
+        item = repository.updateById({"name":"Tomato"}, 1)
+    finally:
+        event.remove(Engine, "before_cursor_execute", on_execute)
+
+    assert (item.id, item.name, item.category) == (1, "Tomato", "Food")
+    assert len(statements) == 1 and statements[0].startswith("UPDATE")
+
+def test_update__soft_deleted(repository):
+    repository.create(Commodity(id=1,name="Potato",category="Food"))
+    repository.deleteById(1)
+
+    with pytest.raises(NoResultFound):
+        repository.updateById({"name":"Tomato"}, 1)
+
+@pytest.mark.parametrize("soft_delete", [(True),(False)])
+def test_delete__already_deleted(repository, soft_delete):
+    repository.create(Commodity(id=1,name="Demo",category="Food"))
+    repository.deleteById(1, soft_delete=soft_delete)
+
+    with pytest.raises(NoResultFound):
+        repository.deleteById(1, soft_delete=soft_delete)
+
+def test_unit_of_work__commits_once(repository):
+    with UnitOfWork(repository._db_services):
+        repository.create(Commodity(id=1,name="Demo",category="Food"))
+        repository.create_many([Commodity(id=2,name="Demo 2",category="Food")])
+        repository.updateById({"name":"Tomato"}, 1)
+
+        assert repository.readById(1) is repository.readById(1)
+        assert repository.readById(1).name == "Tomato"
+        assert repository.count() == 2
+
+    assert repository.readById(1).name == "Tomato"
+    assert repository.count() == 2
+
+def test_unit_of_work__rollback(repository):
+    repository.create(Commodity(id=1,name="Demo",category="Food"))
+
+    with pytest.raises(ValueError):
+        with UnitOfWork(repository._db_services):
+            repository.create(Commodity(id=2,name="Demo 2",category="Food"))
+            repository.deleteById(1)
+            raise ValueError()
+
+    assert [item.id for item in repository.read()] == [1]
+
+def test_unit_of_work__expires_bulk_updates(repository):
+    repository.create(Commodity(id=1,name="Demo",category="Food"))
+
+    with UnitOfWork(repository._db_services):
+        item = repository.readById(1)
+        repository.update_many({1:{"name":"Tomato"}})
+        repository.delete_many([1])
+
+        assert item.name == "Tomato"
+        assert item.deleted_at is not None
+
+def test_read__fields(repository):
+    repository.create(Commodity(id=1,name="Demo",category="Food"))
+
+    items = repository.read(fields=["name"])
+    item = repository.readById(1, fields=["category"])
+    items_with_count, count = repository.read_with_count(fields=["name"])
+
+    assert items[0].__dict__.keys() >= {"id", "name"} and "category" not in items[0].__dict__
+    assert item.__dict__.keys() >= {"id", "category"} and "name" not in item.__dict__
+    assert "category" not in items_with_count[0].__dict__ and count == 1
+
+def test_read__unknown_fields(repository):
+    with pytest.raises(ValueError):
+        repository.read(fields=["name", "price"])
+
+@pytest.mark.parametrize("fields, expected_keys", 
+                         [(None, {"created_at", "deleted_at", "updated_at", "id", "name", "category"}),
+                          (["name"], {"id", "name"})])
+def test_read__rows(repository, fields, expected_keys):
+    repository.create(Commodity(id=1,name="Demo",category="Food"))
+    repository.create(Commodity(id=2,name="Demo 2",category="Food"))
+
+    rows = repository.read(fields=fields, hydrate=False)
+    rows_with_count, count = repository.read_with_count(limit=1, fields=fields, hydrate=False)
+
+    assert [row.id for row in rows] == [1,2]
+    assert set(rows[0]._mapping.keys()) == expected_keys
+    assert rows_with_count[0].name == "Demo" and count == 2
+
+def record_statements():
+    statements = []
+    def on_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+    event.listen(Engine, "before_cursor_execute", on_execute)
+    return statements, lambda: event.remove(Engine, "before_cursor_execute", on_execute)
+
+@pytest.mark.parametrize("options, expected_boxes, expected_statements", 
+                         [(None, [[1,2,3],[4]], 2),
+                          ([joinedload(Shelf.boxes)], [[1,2,3],[4]], 1),
+                          ([noload(Shelf.boxes)], [[],[]], 1)])
+def test_read__loader_options(repository, options, expected_boxes, expected_statements):
+    shelves_repository = BaseRepository(Shelf, repository._db_services)
+    shelves_repository.create(Shelf(id=1, name="Shelf 1", boxes=[Box(id=1), Box(id=2), Box(id=3)]))
+    shelves_repository.create(Shelf(id=2, name="Shelf 2", boxes=[Box(id=4)]))
+
+    statements, stop_recording = record_statements()
+    try:
+        items = shelves_repository.read(limit=2, options=options)
+    finally:
+        stop_recording()
+
+    assert [[box.id for box in item.boxes] for item in items] == expected_boxes
+    assert len(statements) == expected_statements
+
+def test_read_by_id__loader_options(repository):
+    shelves_repository = BaseRepository(Shelf, repository._db_services)
+    shelves_repository.create(Shelf(id=1, name="Shelf 1", boxes=[Box(id=1), Box(id=2)]))
+
+    assert len(shelves_repository.readById(1).boxes) == 2
+    assert shelves_repository.readById(1, options=[noload(Shelf.boxes)]).boxes == []
+
+def test_soft_delete_indexes():
+    assert {index.name for index in Commodity.__table__.indexes} == \
+        {"ix_commodities_deleted_at", "ix_commodities_live_id"}
+
+@pytest.mark.parametrize("archive", [(True),(False)])
+def test_purge_deleted(repository, archive):
+    archive_table = Commodity.get_archive_table() if archive else None
+    if archive:
+        archive_table.create(repository._db_services.get_engine())
+    
+    with time_machine.travel(datetime(2020,1,1)):
+        for i in range(1,6):
+            repository.create(Commodity(id=i, name=f"Demo {i}", category="Food"))
+        repository.delete_many([1,2,3])
+    with time_machine.travel(datetime(2020,1,25)):
+        repository.deleteById(4)
+
+    with time_machine.travel(datetime(2020,2,1)):
+        purged_count = repository.purge_deleted(10, 2, archive_table)
+
+    assert purged_count == 3
+    assert [item.id for item in repository.read(include_deleted=True)] == [4,5]
+    if archive:
+        with repository._db_services.get_engine().connect() as connection:
+            archived = connection.execute(select(archive_table)).all()
+        assert [(row.id, row.name) for row in archived] == [(1,"Demo 1"),(2,"Demo 2"),(3,"Demo 3")]
+
+def test_soft_delete_flag(repository):
+    flagged_repository = BaseRepository(FlaggedCommodity, repository._db_services)
+    flagged_repository.create(FlaggedCommodity(id=1, name="Demo 1"))
+    flagged_repository.create(FlaggedCommodity(id=2, name="Demo 2", deleted_at=datetime.utcnow()))
+    flagged_repository.create_many([FlaggedCommodity(id=i, name=f"Demo {i}") for i in range(3,6)])
+
+    flagged_repository.deleteById(3)
+    flagged_repository.delete_many([4])
+
+    items = flagged_repository.read(include_deleted=True)
+    assert [item.is_deleted for item in items] == [False, True, True, True, False]
+    assert [item.id for item in flagged_repository.read()] == [1,5]
+    assert flagged_repository.count() == 2
+
+def test_read_by_id__entity_cache_racing_write(repository, monkeypatch):
+    cache = EntityCacheServices()
+    cached_repository = BaseRepository(Commodity, repository._db_services, entity_cache=cache)
+    writer_repository = BaseRepository(Commodity, repository._db_services, entity_cache=cache)
+    cached_repository.create(Commodity(id=1, name="old", category="Food"))
+    read = cached_repository._read
+    def read_then_write(*args, **kwargs):
+        item = read(*args, **kwargs)
+        monkeypatch.setattr(cached_repository, "_read", read)
+        # Committed after the SELECT, before the item is cached
+        writer_repository.updateById({"name":"new"}, 1)
+        return item
+    monkeypatch.setattr(cached_repository, "_read", read_then_write)
+
+    assert cached_repository.readById(1).name == "old"
+    assert cached_repository.readById(1).name == "new"
+
+def test_read_by_id__entity_cache(repository):
+    cache = EntityCacheServices()
+    cached_repository = BaseRepository(Commodity, repository._db_services, entity_cache=cache)
+    cached_repository.create(Commodity(id=1, name="Demo", category="Food"))
+
+    statements, stop_recording = record_statements()
+    try:
+        first = cached_repository.readById(1)
+        second = cached_repository.readById(1)
+    finally:
+        stop_recording()
+    assert first is second
+    assert len(statements) == 1
+
+    cached_repository.updateById({"name":"Demo 2"}, 1)
+    assert cached_repository.readById(1).name == "Demo 2"
+
+    cached_repository.deleteById(1)
+    assert cached_repository.readById(1) is None
+    assert (cache.get_stats().hits, cache.get_stats().misses) == (1, 3)
+
+def test_read__query_cache(repository):
+    cache = QueryCacheServices()
+    cached_repository = BaseRepository(Commodity, repository._db_services, query_cache=cache)
+    cached_repository.create_many([Commodity(id=i, name=f"Demo {i}", category="Food") for i in range(1,4)])
+
+    statements, stop_recording = record_statements()
+    try:
+        for _ in range(2):
+            items = cached_repository.read([Commodity.category == "Food"], limit=2)
+            count = cached_repository.count([Commodity.category == "Food"])
+            _, total = cached_repository.read_with_count(limit=2)
+    finally:
+        stop_recording()
+    assert [item.id for item in items] == [1,2] and count == 3 and total == 3
+    assert len(statements) == 3
+
+    cached_repository.deleteById(1)
+    assert [item.id for item in cached_repository.read([Commodity.category == "Food"], limit=2)] == [2,3]
+    assert cached_repository.count([Commodity.category == "Food"]) == 2
+
+def test_read__query_cache_loader_options(repository):
+    cache = QueryCacheServices()
+    shelves_repository = BaseRepository(Shelf, repository._db_services, query_cache=cache)
+    shelves_repository.create(Shelf(id=1, name="Shelf 1", boxes=[Box(id=1), Box(id=2)]))
+
+    for _ in range(2):
+        assert [len(item.boxes) for item in shelves_repository.read()] == [2]
+        assert [item.boxes for item in shelves_repository.read(options=[noload(Shelf.boxes)])] == [[]]
+    assert (cache.get_stats().hits, cache.get_stats().misses) == (2, 2)
+
+def test_read__query_cache_unit_of_work(repository):
+    cache = QueryCacheServices()
+    cached_repository = BaseRepository(Commodity, repository._db_services, query_cache=cache)
+    cached_repository.create(Commodity(id=1, name="Demo", category="Food"))
+
+    with UnitOfWork(repository._db_services):
+        cached_repository.create(Commodity(id=2, name="Demo 2", category="Food"))
+        assert cached_repository.count() == 2
+        # A new thread doesn't share the unit of work, so it reads and caches the committed state
+        with ThreadPoolExecutor(1) as executor:
+            assert executor.submit(cached_repository.count).result() == 1
+
+    assert cached_repository.count() == 2
+
+@pytest.mark.parametrize("query, include_deleted, threshold, expected", 
+                         [([], True, 1, (5, True)),
+                          ([], False, 1, (3, True)),
+                          ([], True, 10, (6, False)),
+                          ([Commodity.category == "Food"], True, 1, (6, False))])
+def test_estimate_count(repository, monkeypatch, query, include_deleted, threshold, expected):
+    engine = repository._db_services.get_engine()
+    for index in Commodity.__table__.indexes:
+        index.create(engine)
+    repository.create_many([Commodity(id=i, name=f"Demo {i}", category="Food") for i in range(1,6)])
+    repository.delete_many([1,2])
+    with engine.begin() as connection:
+        connection.exec_driver_sql("ANALYZE")
+    # Statistics aren't updated until the next ANALYZE
+    repository.create(Commodity(id=6, name="Demo 6", category="Food"))
+    monkeypatch.setattr(repository, "_approximate_count_threshold", threshold)
+
+    assert repository.estimate_count(query, include_deleted) == expected
+    assert repository.count(query, include_deleted, approximate=True) == expected[0]
+
+def test_estimate_count__not_analyzed(repository):
+    repository.create(Commodity(id=1, name="Demo", category="Food"))
+
+    assert repository.estimate_count() == (1, False)
+
+@pytest.fixture
+def counted_repository(repository):
+    CounterModel.__table__.create(repository._db_services.get_engine())
+    return BaseRepository(CountedCommodity, repository._db_services)
+
+def test_counters(counted_repository):
+    counted_repository.create(CountedCommodity(id=1, name="Demo 1", category="Food"))
+    counted_repository.create_many([CountedCommodity(id=i, name=f"Demo {i}", category="Food") 
+                                    for i in range(2,6)])
+    counted_repository.create(CountedCommodity(id=6, name="Demo 6", category="Food", 
+                                               deleted_at=datetime.utcnow()))
+    counted_repository.updateById({"category":"Sports"}, 1)
+    counted_repository.updateById({"name":"Demo"}, 2)
+    counted_repository.update_many({3:{"category":"Sports"}, 4:{"name":"Demo"}})
+    counted_repository.deleteById(4)
+    counted_repository.delete_many([1,5], soft_delete=False)
+
+    statements, stop_recording = record_statements()
+    try:
+        counts = [counted_repository.count([CountedCommodity.category == category]) 
+                  for category in ("Food", "Sports", "Toys")]
+    finally:
+        stop_recording()
+    assert counts == [1,1,0]
+    assert all("counters" in statement for statement in statements)
+    assert counted_repository.count([CountedCommodity.category == "Food"], include_deleted=True) == 3
+
+def test_counters__rollback(counted_repository):
+    counted_repository.create(CountedCommodity(id=1, name="Demo 1", category="Food"))
+    with pytest.raises(NoResultFound):
+        with UnitOfWork(counted_repository._db_services):
+            counted_repository.create(CountedCommodity(id=2, name="Demo 2", category="Food"))
+            counted_repository.deleteById(3)
+
+    assert counted_repository.count([CountedCommodity.category == "Food"]) == 1
+
+def test_counters__rebuild(counted_repository):
+    engine = counted_repository._db_services.get_engine()
+    with engine.begin() as connection:
+        connection.execute(counted_commodities.insert(), 
+                           [{"id":1, "name":"Demo 1", "category":"Food"},
+                            {"id":2, "name":"Demo 2", "category":"Food"}])
+    assert counted_repository.count([CountedCommodity.category == "Food"]) == 0
+
+    counted_repository.rebuild_counters()
+
+    assert counted_repository.count([CountedCommodity.category == "Food"]) == 2
+
+@pytest.mark.parametrize("hydrate", [(True),(False)])
+def test_stream(repository, hydrate):
+    repository.create_many([Commodity(id=i, name=f"Demo {i}", category="Food") for i in range(1,8)])
+    repository.delete_many([3])
+
+    items = repository.stream(hydrate=hydrate, batch_size=2)
+    first = next(items)
+
+    assert first.id == 1
+    assert [item.id for item in items] == [2,4,5,6,7]
+
+@pytest.fixture
+def replica_repository(monkeypatch, tmp_path):
+    urls = [f'sqlite:///{tmp_path / name}' for name in ("primary.db", "replica.db")]
+    monkeypatch.setenv('DB_CONNECTION_STRING', urls[0])
+    monkeypatch.setenv('DB_REPLICA_CONNECTION_STRINGS', urls[1])
+    monkeypatch.delitem(SingletonMeta._instances, DbServices, raising=False)
+    token = _primary_pinned_until.set(0)
+    db_services = DbServices()
+    for engine, name in [(db_services.get_engine(), "Primary"), 
+                         (db_services.get_replica_engines()[0], "Replica")]:
+        meta.create_all(engine)
+        with engine.begin() as connection:
+            connection.execute(commodities.insert(), [{"id":1, "name":name, "category":"Food"}])
+    yield BaseRepository(Commodity, db_services)
+    _primary_pinned_until.reset(token)
+
+def test_read__replicas(replica_repository):
+    assert replica_repository.readById(1).name == "Replica"
+    assert [item.name for item in replica_repository.read()] == ["Replica"]
+    assert replica_repository.count() == 1
+
+    replica_repository.updateById({"name":"Updated"}, 1)
+
+    # Read your writes
+    assert replica_repository.readById(1).name == "Updated"
+    with ThreadPoolExecutor(1) as executor:
+        assert executor.submit(replica_repository.readById, 1).result().name == "Replica"
+
+def test_read__replicas_cached(replica_repository):
+    replica_repository._entity_cache = EntityCacheServices()
+    replica_repository._query_cache = QueryCacheServices()
+
+    # Cached results are read from the primary, replicas may lag behind its invalidations
+    assert replica_repository.readById(1).name == "Primary"
+    assert [item.name for item in replica_repository.read()] == ["Primary"]
+    assert replica_repository.readById(1, fields=["name"]).name == "Replica"
+
+def test_read__replica_ejection(replica_repository, monkeypatch):
+    replica = replica_repository._db_services.get_replica_engines()[0]
+    with replica.begin() as connection:
+        connection.exec_driver_sql("DROP TABLE commodities")
+
+    # Failing queries don't eject the replica
+    with pytest.raises(OperationalError):
+        replica_repository.readById(1)
+    assert replica_repository._db_services.get_read_engine() is replica
+
+    monkeypatch.setattr(replica.dialect, "is_disconnect", lambda *args: True)
+    assert replica_repository.readById(1).name == "Primary"
+    assert replica_repository._db_services.get_read_engine() is replica_repository._db_services.get_engine()
+
+def test_statement_cache(repository):
+    repository.create(Commodity(id=1, name="Demo", category="Food"))
+    repository.create(Commodity(id=2, name="Demo 2", category="Food", deleted_at=datetime.utcnow()))
+
+    assert repository.readById(1).name == "Demo" and repository.readById(2) is None
+    assert repository.readById(2, include_deleted=True).name == "Demo 2"
+    assert repository.readById(1, fields=["name"]).name == "Demo"
+    assert repository.count() == 1 and repository.count(include_deleted=True) == 2
+    assert set(repository._statements.keys()) == {("readById", False, None), 
+                                                   ("readById", True, None), 
+                                                   ("readById", False, ("name",)),
+                                                   ("count", False),
+                                                   ("count", True)}
+
+def test_upsert_many__counters(counted_repository):
+    counted_repository.create(CountedCommodity(id=1, name="Demo 1", category="Food"))
+
+    result = counted_repository.upsert_many([CountedCommodity(id=1, name="Demo 1", category="Sports"),
+                                             CountedCommodity(id=2, name="Demo 2", category="Food")])
+
+    assert (result.inserted, result.updated) == (1, 1)
+    assert counted_repository.count([CountedCommodity.category == "Food"]) == 1
+    assert counted_repository.count([CountedCommodity.category == "Sports"]) == 1
+
+def test_counters__locked_rows(counted_repository):
+    counted_repository.create(CountedCommodity(id=1, name="Demo 1", category="Food"))
+    statements = []
+    def on_execute(conn, clauseelement, *args):
+        statements.append(clauseelement)
+    event.listen(Engine, "before_execute", on_execute)
+    try:
+        counted_repository.updateById({"category":"Sports"}, 1)
+    finally:
+        event.remove(Engine, "before_execute", on_execute)
+
+    locks = [statement for statement in statements 
+             if getattr(statement, "_for_update_arg", None) is not None]
+    assert len(locks) == 1
+    assert statements.index(locks[0]) < [statement.is_dml for statement in statements].index(True)
+
+@pytest.mark.parametrize("returning", [True, False])
+def test_counters__column_defaults(counted_repository, returning):
+    counted_repository.create(CountedCommodity(id=1, name="Demo 1"))
+    counted_repository.create_many([CountedCommodity(id=2, name="Demo 2"),
+                                    CountedCommodity(id=3, name="Demo 3", category="Food")], 
+                                   returning=returning)
+
+    assert counted_repository.count([CountedCommodity.category == "Misc"]) == 2
+    assert counted_repository.count([CountedCommodity.category == "Food"]) == 1
+
+def test_upsert__counters(counted_repository):
+    counted_repository.create(CountedCommodity(id=1, name="Demo 1", category="Food"))
+
+    counted_repository.upsert(CountedCommodity(id=1, name="Demo 1", category="Sports"))
+    counted_repository.upsert(CountedCommodity(name="Demo 2", category="Sports"))
+
+    assert counted_repository.count([CountedCommodity.category == "Food"]) == 0
+    assert counted_repository.count([CountedCommodity.category == "Sports"]) == 2
+
+class Sku(BaseModel):
+     __tablename__ = "skus"
+     code:Mapped[str] = mapped_column(String(100), unique=True)
+     barcode:Mapped[str] = mapped_column(String(100), unique=True)
+
+def test_get_conflict_columns(repository):
+    assert repository.get_conflict_columns() == ["id"]
+
+    with pytest.raises(ValueError):
+        BaseRepository(Sku, repository._db_services).get_conflict_columns()
+
+versioned_commodities = Table(
+    'versioned_commodities',
+    meta,
+    Column('created_at',DateTime),
+    Column('updated_at',DateTime),
+    Column('deleted_at',DateTime),
+    Column('id', Integer, primary_key=True),
+    Column('version', Integer, nullable=False),
+    Column('name', String, unique=True)
+)
+
+class VersionedCommodity(VersionedMixin, BaseModel):
+     __tablename__ = "versioned_commodities"
+     name:Mapped[str] = mapped_column(String(100), unique=True)
+
+@pytest.fixture
+def versioned_repository(repository):
+    return BaseRepository(VersionedCommodity, repository._db_services)
+
+def test_update__version(versioned_repository):
+    versioned_repository.create(VersionedCommodity(id=1, name="Demo"))
+
+    item = versioned_repository.updateById({"name":"Tomato", "version":10}, 1)
+    assert (item.name, item.version) == ("Tomato", 2)
+
+    item = versioned_repository.updateById({"name":"Potato"}, 1, expected_version=2)
+    assert (item.name, item.version) == ("Potato", 3)
+
+def test_update__stale_version(versioned_repository):
+    versioned_repository.create(VersionedCommodity(id=1, name="Demo"))
+    versioned_repository.updateById({"name":"Tomato"}, 1)
+
+    with pytest.raises(StaleDataError):
+        versioned_repository.updateById({"name":"Potato"}, 1, expected_version=1)
+    with pytest.raises(NoResultFound):
+        versioned_repository.updateById({"name":"Potato"}, 2, expected_version=1)
+
+    item = versioned_repository.readById(1)
+    assert (item.name, item.version) == ("Tomato", 2)
+
+def test_update__version_not_supported(repository):
+    repository.create(Commodity(id=1, name="Demo", category="Food"))
+
+    with pytest.raises(ValueError):
+        repository.updateById({"name":"Tomato"}, 1, expected_version=1)
+
+def test_update_many__version(versioned_repository):
+    versioned_repository.create_many([VersionedCommodity(id=1, name="Demo"),
+                                      VersionedCommodity(id=2, name="Demo 2")])
+    versioned_repository.update_many({1:{"name":"Tomato"}, 2:{"name":"Potato"}})
+
+    items = sorted(versioned_repository.read(), key=lambda item: item.id)
+    assert [(item.name, item.version) for item in items] == [("Tomato", 2), ("Potato", 2)]
+
+def test_upsert__version(versioned_repository):
+    versioned_repository.upsert(VersionedCommodity(name="Demo"), ["name"])
+    item = versioned_repository.upsert(VersionedCommodity(name="Demo"), ["name"])
+
+    assert item.version == 2
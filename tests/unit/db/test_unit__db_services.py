@@ -1,6 +1,13 @@
 from sqlalchemy.engine import Engine
-from ez_rest.modules.db.services import DbServices
+from ez_rest.modules.db.services import DbServices, UnitOfWorkRoute, _dispose_after_fork, _primary_pinned_until, get_current_session, pin_primary, unit_of_work
+from ez_rest.modules.singleton.models import SingletonMeta
+from tests.mock_db_services import MockDbServices
+from fastapi import APIRouter, Depends, FastAPI
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+from fastapi.testclient import TestClient
 import os
+import pytest
 
 
 TEST_DB_PATH = 'test.db'
@@ -9,4 +16,131 @@ TEST_DB_URI = f'sqlite:///{TEST_DB_PATH}'
 os.environ['DB_CONNECTION_STRING'] = TEST_DB_URI
 
 def test_create_engine():
-    assert isinstance(DbServices().get_engine(), Engine) == True
\ No newline at end of file
+    assert isinstance(DbServices().get_engine(), Engine) == True
+
+def test_unit_of_work_dependency(monkeypatch):
+    monkeypatch.setitem(SingletonMeta._instances, DbServices, MockDbServices())
+    app = FastAPI()
+    router = APIRouter(route_class=UnitOfWorkRoute)
+
+    @router.get("/sync")
+    def read_sync(session:Session = Depends(unit_of_work)):
+        return get_current_session() is session
+
+    @router.get("/async")
+    async def read_async(session:Session = Depends(unit_of_work)):
+        return get_current_session() is session
+    
+    @app.get("/outside")
+    def read_outside(session:Session = Depends(unit_of_work)):
+        return True
+
+    app.include_router(router)
+    client = TestClient(app)
+    
+    assert client.get("/sync").json() == True
+    assert client.get("/async").json() == True
+    assert get_current_session() is None
+    with pytest.raises(RuntimeError):
+        client.get("/outside")
+
+def test_unit_of_work_route__commit_failed(monkeypatch):
+    monkeypatch.setitem(SingletonMeta._instances, DbServices, MockDbServices())
+    def commit(session):
+        raise OperationalError("COMMIT", {}, Exception("disk I/O error"))
+    monkeypatch.setattr(Session, "commit", commit)
+    app = FastAPI()
+    app.router.route_class = UnitOfWorkRoute
+
+    @app.post("/items")
+    def create_item():
+        return {"ok":True}
+
+    response = TestClient(app, raise_server_exceptions=False).post("/items")
+
+    assert response.status_code == 500
+    assert get_current_session() is None
+
+@pytest.fixture
+def replica_services(monkeypatch, tmp_path):
+    monkeypatch.setenv('DB_CONNECTION_STRING', f'sqlite:///{tmp_path / "primary.db"}')
+    monkeypatch.setenv('DB_REPLICA_CONNECTION_STRINGS', 
+                       f'sqlite:///{tmp_path / "replica_1.db"}, sqlite:///{tmp_path / "replica_2.db"}')
+    monkeypatch.delitem(SingletonMeta._instances, DbServices, raising=False)
+    # Writes made by other tests in this context would pin reads to the primary
+    token = _primary_pinned_until.set(0)
+    yield DbServices()
+    _primary_pinned_until.reset(token)
+
+def get_database(engine:Engine) -> str:
+    return os.path.basename(engine.url.database)
+
+def test_get_read_engine__without_replicas():
+    services = DbServices()
+
+    assert services.get_read_engine() is services.get_engine()
+
+def test_get_read_engine__round_robin(replica_services):
+    databases = [get_database(replica_services.get_read_engine()) for _ in range(4)]
+
+    assert databases == ["replica_1.db", "replica_2.db", "replica_1.db", "replica_2.db"]
+
+def test_get_read_engine__least_connections(replica_services, monkeypatch):
+    monkeypatch.setenv('DB_REPLICA_STRATEGY', 'least_connections')
+    replica = replica_services.get_replica_engines()[0]
+
+    with replica.connect():
+        assert get_database(replica_services.get_read_engine()) == "replica_2.db"
+
+def test_eject_replica(replica_services, monkeypatch):
+    replicas = replica_services.get_replica_engines()
+
+    assert replica_services.eject_replica(replica_services.get_engine()) == False
+    assert replica_services.eject_replica(replicas[0]) == True
+    assert all(replica_services.get_read_engine() is replicas[1] for _ in range(3))
+
+    replica_services.eject_replica(replicas[1])
+    assert replica_services.get_read_engine() is replica_services.get_engine()
+
+    monkeypatch.setenv('DB_REPLICA_EJECT_SECONDS', '0')
+    replica_services.eject_replica(replicas[0])
+    assert replica_services.get_read_engine() is replicas[0]
+
+def test_pin_primary(replica_services):
+    pin_primary(60)
+
+    assert replica_services.get_read_engine() is replica_services.get_engine()
+
+@pytest.fixture
+def pooled_services(monkeypatch, tmp_path):
+    monkeypatch.setenv('DB_CONNECTION_STRING', f'sqlite:///{tmp_path / "primary.db"}')
+    monkeypatch.setenv('DB_POOL_SIZE', '3')
+    monkeypatch.setenv('DB_MAX_OVERFLOW', '2')
+    monkeypatch.setenv('DB_POOL_RECYCLE', '1800')
+    monkeypatch.setenv('DB_POOL_TIMEOUT', '5')
+    monkeypatch.setenv('DB_POOL_PRE_PING', '1')
+    monkeypatch.delitem(SingletonMeta._instances, DbServices, raising=False)
+    return DbServices()
+
+def test_get_engine__pool_options(pooled_services):
+    pool = pooled_services.get_engine().pool
+
+    assert (pool.size(), pool._max_overflow, pool._recycle, pool._timeout, pool._pre_ping) == \
+        (3, 2, 1800, 5, True)
+
+def test_warmup(pooled_services):
+    assert pooled_services.warmup() == 3
+    assert pooled_services.get_engine().pool.checkedin() == 3
+
+def test_dispose_after_fork(pooled_services):
+    engine = pooled_services.get_engine()
+    pool = engine.pool
+    connection = engine.connect()
+    dbapi_connection = connection.connection.dbapi_connection
+
+    _dispose_after_fork()
+
+    assert engine.pool is not pool
+    # The connection of the parent process is left open
+    assert dbapi_connection.execute("SELECT 1").fetchone() == (1,)
+    connection.close()
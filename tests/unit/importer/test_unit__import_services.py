@@ -0,0 +1,92 @@
+from typing import Optional
+from ez_rest.modules.crud.models import BaseModel
+from ez_rest.modules.crud.repository import BaseRepository
+from ez_rest.modules.importer.services import ImportServices
+from ez_rest.modules.mapper.services import mapper_services
+from tests.mock_db_services import MockDbServices
+from pydantic import BaseModel as PydanticModel
+from sqlalchemy import Table, Column, MetaData, Integer, String, DateTime
+from sqlalchemy.orm import Mapped, mapped_column
+import io
+import pytest
+
+meta = MetaData()
+imported_products = Table(
+    'imported_products',
+    meta,
+    Column('created_at',DateTime),
+    Column('updated_at',DateTime),
+    Column('deleted_at',DateTime),
+    Column('id', Integer, primary_key=True),
+    Column('name', String),
+    Column('price', Integer)
+)
+
+class ImportedProduct(BaseModel):
+     __tablename__ = "imported_products"
+     name:Mapped[str] = mapped_column(String(100))
+     price:Mapped[Optional[int]]
+
+class ImportedProductDTO(PydanticModel):
+    id:int
+    name:str
+    price:Optional[int]
+
+mapper_services.register(
+    ImportedProductDTO,
+    ImportedProduct,
+    lambda src: {"id":src.id, "name":src.name, "price":src.price}
+)
+
+@pytest.fixture
+def repository():
+    db_services = MockDbServices()
+    meta.create_all(db_services.get_engine())
+    return BaseRepository(ImportedProduct, db_services)
+
+def test_import_file__csv(repository):
+    file = io.StringIO(
+        "id,name,price\n"
+        "1,Oven,100\n"
+        "2,Chair,\n"
+        "3,Table,cheap\n"
+        "1,Lamp,10\n"
+        "4,\"Desk\nwith drawers\",50\n"
+        "5,Sofa,300\n")
+    progress = []
+
+    result = ImportServices().import_file(
+        file, repository, ImportedProductDTO, chunk_size=2, progress=progress.append)
+
+    assert (result.processed, result.inserted, result.failed) == (6, 4, 2)
+    assert [error.line for error in result.errors] == [4, 5]
+    assert "price" in result.errors[0].message
+    assert [(item.id, item.name, item.price) for item in repository.read()] == \
+        [(1, "Oven", 100), (2, "Chair", None), (4, "Desk\nwith drawers", 50), (5, "Sofa", 300)]
+    assert [(item.processed, item.inserted, item.failed) for item in progress] == \
+        [(2, 2, 0), (5, 3, 2), (6, 4, 2)]
+
+def test_import_file__ndjson(repository, tmp_path):
+    path = tmp_path / "products.ndjson"
+    path.write_text(
+        '{"id":1,"name":"Oven","price":100}\n'
+        '\n'
+        '{"id":2,"name":\n'
+        '{"id":3,"name":"Chair"}\n')
+
+    result = ImportServices().import_file(str(path), repository, ImportedProductDTO, format="ndjson")
+
+    assert (result.processed, result.inserted, result.failed) == (3, 2, 1)
+    assert [error.line for error in result.errors] == [3]
+    assert [item.id for item in repository.read()] == [1, 3]
+
+def test_import_file__max_errors(repository):
+    file = io.StringIO("id,name\n" + "".join(f"x{i},Oven\n" for i in range(5)))
+
+    result = ImportServices().import_file(file, repository, ImportedProductDTO, max_errors=2)
+
+    assert result.failed == 5 and len(result.errors) == 2
+
+def test_import_file__unsupported_format(repository):
+    with pytest.raises(ValueError):
+        ImportServices().import_file(io.StringIO(""), repository, ImportedProductDTO, format="xml")
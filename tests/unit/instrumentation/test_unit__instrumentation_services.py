@@ -0,0 +1,82 @@
+from ez_rest.modules.instrumentation.services import InstrumentationServices, QueryStatsMiddleware, instrumentation_services
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+import json
+import logging
+import pytest
+
+@pytest.fixture
+def engine(monkeypatch) -> Engine:
+    monkeypatch.setenv("DB_N_PLUS_ONE_THRESHOLD", "2")
+    engine = create_engine("sqlite://")
+    instrumentation_services.instrument(engine)
+    return engine
+
+def execute(engine:Engine, statements:list):
+    with engine.connect() as connection:
+        for statement, parameters in statements:
+            connection.exec_driver_sql(statement, parameters)
+
+def test_track(engine):
+    with instrumentation_services.track() as stats:
+        execute(engine, [("SELECT ?", (1,)), ("SELECT ?", (2,)), ("SELECT 1 + ?", (1,))])
+    execute(engine, [("SELECT ?", (3,))])
+
+    assert stats.query_count == 3 and stats.total_duration > 0
+    assert stats.statement_counts["SELECT ?"] == 2
+    assert stats.n_plus_one_statements == []
+    assert instrumentation_services.get_stats() is None
+
+def test_failed_statements(engine):
+    with engine.connect() as connection:
+        for _ in range(3):
+            with pytest.raises(OperationalError):
+                connection.exec_driver_sql("SELECT * FROM missing_table")
+        connection.exec_driver_sql("SELECT 1")
+
+        assert connection.connection.info["ez_rest_started_at"] == []
+
+def test_track__n_plus_one(engine, caplog):
+    with caplog.at_level(logging.WARNING, "ez_rest.sql"):
+        with instrumentation_services.track() as stats:
+            execute(engine, [("SELECT ?", (i,)) for i in range(5)])
+
+    assert stats.n_plus_one_statements == ["SELECT ?"]
+    assert [json.loads(record.message) for record in caplog.records] == \
+        [{"event":"n_plus_one", "count":3, "statement":"SELECT ?"}]
+
+def test_slow_query_log(monkeypatch, caplog):
+    monkeypatch.setenv("DB_SLOW_QUERY_MS", "0")
+    engine = create_engine("sqlite://")
+    services = InstrumentationServices()
+    services.instrument(engine)
+
+    with caplog.at_level(logging.WARNING, "ez_rest.sql"):
+        with services.track() as stats:
+            execute(engine, [("SELECT 1", ())])
+
+    log = json.loads(caplog.records[0].message)
+    assert log["event"] == "slow_query" and log["statement"] == "SELECT 1"
+    assert stats.slow_query_count == 1
+
+@pytest.mark.parametrize("expose_headers", [(True),(False)])
+def test_query_stats_middleware(engine, expose_headers):
+    app = FastAPI()
+    app.add_middleware(QueryStatsMiddleware, expose_headers=expose_headers)
+
+    @app.get("/items")
+    def read_items():
+        execute(engine, [("SELECT ?", (i,)) for i in range(3)])
+        return []
+
+    response = TestClient(app).get("/items")
+
+    if expose_headers:
+        assert response.headers["X-DB-Query-Count"] == "3"
+        assert response.headers["X-DB-N-Plus-One"] == "1"
+        assert float(response.headers["X-DB-Query-Time-Ms"]) > 0
+    else:
+        assert "X-DB-Query-Count" not in response.headers
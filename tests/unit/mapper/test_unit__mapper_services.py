@@ -1,5 +1,7 @@
 from ez_rest.modules.mapper.services import MapperServices
 from dataclasses import dataclass
+from collections import namedtuple
+from pydantic import BaseModel
 import pytest
 
 @dataclass
@@ -51,4 +53,47 @@ def test_map(services):
         PublicUser
     )
     assert public_user.fullname == "John Doe"
-    assert public_user.email == "user@user.com"
\ No newline at end of file
+    assert public_user.email == "user@user.com"
+
+class PublicUserDTO(BaseModel):
+    fullname:str
+    email:str
+
+@pytest.mark.parametrize("validate", [(True),(False)])
+def test_map_many(services, validate):
+    services.register(User, 
+                      PublicUserDTO,
+                      lambda src: {
+                          "fullname": f"{src.name} {src.surname}",
+                          "email": src.email
+                      })
+    # Any object with the attributes used by the mapping function can be mapped
+    Row = namedtuple("Row", ["name", "surname", "password", "email"])
+    
+    public_users = services.map_many(
+        [Row("John", "Doe", "123456", "john@user.com"),
+         Row("Jane", "Doe", "123456", "jane@user.com")],
+        User,
+        PublicUserDTO,
+        validate)
+
+    assert [user.fullname for user in public_users] == ["John Doe", "Jane Doe"]
+    assert all(isinstance(user, PublicUserDTO) for user in public_users)
+
+def test_map_iter(services):
+    services.register(User, 
+                      PublicUserDTO,
+                      lambda src: {
+                          "fullname": f"{src.name} {src.surname}",
+                          "email": src.email
+                      })
+    consumed = []
+    def read_users():
+        for name in ["John", "Jane"]:
+            consumed.append(name)
+            yield User(name=name, surname="Doe", password="123456", email=f"{name.lower()}@user.com")
+
+    public_users = services.map_iter(read_users(), User, PublicUserDTO)
+
+    assert consumed == []
+    assert next(public_users).fullname == "John Doe" and consumed == ["John"]
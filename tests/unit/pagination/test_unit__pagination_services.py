@@ -1,5 +1,6 @@
 from ez_rest.modules.pagination.services import PaginationServices
 import pytest
+from datetime import datetime
 import os
 
 
@@ -24,3 +25,21 @@ def test_get_offset(page, limit, expected_offset):
 def test_get_pages_count(count, limit, expected_pages):
     services = PaginationServices()
     assert services.get_pages_count(count, limit) == expected_pages
+
+@pytest.mark.parametrize("values, direction", 
+                         [([1],"next"),
+                          (["Demo", 20],"prev"),
+                          ([datetime(2020,1,1,10,30), 3],"next")])
+def test_encode_decode_cursor(values, direction):
+    services = PaginationServices()
+    cursor = services.encode_cursor(values, direction)
+    assert services.decode_cursor(cursor) == (values, direction)
+
+@pytest.mark.parametrize("cursor", 
+                         ["not a cursor",
+                          "eyJ2IjpbMV0sImQiOiJ1cCJ9",
+                          "e30="])
+def test_decode_cursor__invalid(cursor):
+    services = PaginationServices()
+    with pytest.raises(ValueError):
+        services.decode_cursor(cursor)
@@ -14,7 +14,7 @@ roles = Table(
     Column('updated_at',DateTime),
     Column('deleted_at',DateTime),
     Column('id', Integer, primary_key=True),
-    Column('name',String),
+    Column('name',String, unique=True),
     Column('is_admin', Boolean),
     Column('scopes', Text)
 )
@@ -37,4 +37,26 @@ def test_scopes_field_role(repository):
     item = repository.create(item)
     items = repository.read()
 
-    assert items[0].scopes == ["product:read","product:create"]
\ No newline at end of file
+    assert items[0].scopes == ["product:read","product:create"]
+
+def test_upsert_many(repository):
+    repository.create(RoleModel(id=1, name="Admin", is_admin=True, scopes=[]))
+    
+    result = repository.upsert_many([
+        RoleModel(id=2, name="Admin", is_admin=True, scopes=["*"]),
+        RoleModel(id=3, name="Sales Manager", is_admin=False, scopes=["product:read"]),
+        RoleModel(id=4, name="Buyer", is_admin=False, scopes=[])
+    ], chunk_size=2)
+
+    assert (result.inserted, result.updated) == (2, 1)
+    assert [(item.id, item.name, item.scopes) for item in repository.read()] == \
+        [(1, "Admin", ["*"]), (3, "Sales Manager", ["product:read"]), (4, "Buyer", [])]
+    assert repository.readById(1).updated_at is not None
+
+def test_upsert(repository):
+    repository.create(RoleModel(id=1, name="Admin", is_admin=False, scopes=[]))
+
+    item = repository.upsert(RoleModel(name="Admin", is_admin=True))
+
+    assert (item.id, item.is_admin, item.scopes) == (1, True, [])
+    assert repository.get_conflict_columns() == ["name"]